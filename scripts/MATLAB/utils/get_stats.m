@@ -1,23 +1,22 @@
 function [mean_t1, std_t1] = get_stats(phi, PSI, PLOT_HIST, data)
 % GET_STATS function to get the mean and std of the log normal distributions
-% We sample from distrbutions of beta and beta*t1 and then calculate t1
-% we then get the mean and std of log(t1) because this is normally
-% distributed
+% log(beta) and log(q) are normally distributed (independent random effects)
+% and q = beta * t1, so log(t1) = log(q) - log(beta) is normally distributed
+% with the difference of the means and the sum of the variances
 
 [fe_beta, fe_q] = deal(phi(1), phi(2));
 [sd_beta, sd_q] = deal(sqrt(PSI(1,1)), sqrt(PSI(2,2))); % q here is -beta * t1
 
-% Both beta and q are log transformed so 
-beta_vec = exp(normrnd(fe_beta, sd_beta ,[1, 100000]));
-q_vec = exp(normrnd(fe_q, sd_q ,[1, 100000])); 
-t1_vec = q_vec ./ beta_vec; % Here q = beta * t1
-
-log_t1_vec = log(t1_vec);
-mean_t1 = mean(log_t1_vec);
-std_t1 = std(log_t1_vec);
+% Exact mean and std of log(t1), no sampling needed
+mean_t1 = fe_q - fe_beta;
+std_t1 = sqrt(sd_q^2 + sd_beta^2);
 
 % Plot a histogram of t1
 if PLOT_HIST == 1
+    % Both beta and q are log transformed so 
+    beta_vec = exp(normrnd(fe_beta, sd_beta ,[1, 100000]));
+    q_vec = exp(normrnd(fe_q, sd_q ,[1, 100000])); 
+    t1_vec = q_vec ./ beta_vec; % Here q = beta * t1
     t1_vec = t1_vec * 12 / 365;
     histogram(t1_vec); hold on;
     yLimits = ylim;
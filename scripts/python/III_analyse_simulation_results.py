@@ -1,37 +1,76 @@
-'''
-Script to take data from simulations and determine
-1. What proportion of tumours will metastasise before the earliest possible screen detection
-2. What the window of opportunity is for those tumours that can be detected before metastasis.
-'''
-import pandas as pd
-import os
-import matplotlib.pyplot as plt
-
-
-# Paths
-path_to_sims = './../../output/simulations/sims.csv'
-
-sims = pd.read_csv(path_to_sims, index_col=0)
-
-'''
-Statistics
-1a. How many reach CA125 limit before mets
-1b. What is the WOO between CA125 limit and mets
-2a. How many reach US detection limit before mets
-2b. What is the WOO between US limit and mets
-'''
-
-ca125_b4_mets = sims[sims.time_to_met.gt(sims.time_to_ca125)]
-US_b4_mets = sims[sims.time_to_met.gt(sims.time_to_US)]
-
-
-print('{} out of 10,000 cases reach CA125 detection limit before mets'.format(sims[sims.time_to_met.gt(sims.time_to_ca125)].shape[0]))
-print('{} out of 10,000 cases reach US detection limit before mets'.format(sims[sims.time_to_met.gt(sims.time_to_US)].shape[0]))
-
-print('\n **** WOO for CA125 stats **** \n')
-print((ca125_b4_mets.time_to_met * 12 / 365 - ca125_b4_mets.time_to_ca125 * 12 / 365).agg('describe'))
-print('\n')
-
-print('\n **** WOO for US stats **** \n')
-print((US_b4_mets.time_to_met * 12 / 365 - US_b4_mets.time_to_US * 12 / 365).agg('describe'))
-print('\n')
+'''
+Script to take data from simulations and determine
+1. What proportion of tumours will metastasise before the earliest possible screen detection
+2. What the window of opportunity is for those tumours that can be detected before metastasis.
+
+The statistics are gathered in a single pass over chunks of the simulations, so the results are never loaded in full.
+The quartiles come from a quantile sketch and are accurate to 0.5%.
+The statistics are the analyse_simulations stage in kinetics/stages.py (also run by: python -m kinetics analyse).
+'''
+import os
+
+from kinetics.io import OUTPUT_DIR, SIMULATIONS_DIR
+from kinetics.profiling import manifest_path, profile_run
+from kinetics.stages import analyse_simulations, woo_report
+
+
+# Paths (resolved from the repository, so the script can be run from any folder)
+path_to_sims = os.path.join(SIMULATIONS_DIR, 'sims.csv')
+path_to_store = os.path.join(SIMULATIONS_DIR, 'sims') # column store written by II_simulate_population.py with OUTPUT_FORMAT = 'npy'
+# 'csv' or 'npy' read the output of II_simulate_population.py (should match its OUTPUT_FORMAT)
+# 'simulate' aggregates the chunks as they are simulated with the settings in II_simulate_population.py, without writing them
+# 'adaptive' simulates batches (with the SEED and N_WORKERS of II_simulate_population.py) until the standard errors of
+# the statistics meet ABS_TOL or REL_TOL (kinetics/adaptive.py), instead of simulating N_TUMOURS
+# 'analytic' gives the exact statistics of the simulated population in closed form, without simulating (kinetics/analytic.py),
+# for the Gompertz model only
+INPUT_FORMAT = 'csv'
+CHUNK_SIZE = 1000000 # Number of simulations read at a time
+ABS_TOL = None # Absolute tolerance on the standard errors (a number, or a dict by statistic e.g. {'fraction_US': 0.001})
+REL_TOL = 0.01 # Relative tolerance on the standard errors
+BATCH_SIZE = 10000 # Number of tumours simulated between two checks of the tolerances
+MAX_TUMOURS = 10 ** 8 # The adaptive simulation stops here even if the tolerances are not met
+# Write a manifest of the run (time, rows and parameters of each step, seeds) to output/manifests. PROFILE_MEMORY also
+# traces the allocations of each step (slower) and PROFILER = 'cprofile' or 'pyinstrument' profiles the whole run
+PROFILE = False
+PROFILE_MEMORY = False
+PROFILER = None
+
+
+'''
+Statistics
+1a. How many reach CA125 limit before mets
+1b. What is the WOO between CA125 limit and mets
+2a. How many reach US detection limit before mets
+2b. What is the WOO between US limit and mets
+'''
+if __name__ == '__main__':
+    stats, errors = None, None
+    manifest = manifest_path(os.path.join(OUTPUT_DIR, 'manifests'), 'III_analyse_simulation_results') if PROFILE else None
+    with profile_run(manifest, PROFILE_MEMORY, PROFILER, input_format=INPUT_FORMAT):
+        if INPUT_FORMAT == 'analytic':
+            from II_simulate_population import MODEL
+            from kinetics.stages import analyse_analytic
+            if MODEL != 'gompertz':
+                raise ValueError("INPUT_FORMAT = 'analytic' is only for the Gompertz model, not MODEL = {!r}".format(MODEL))
+            print('\n **** Exact fraction detected before mets and WOO (months) for the CA125 and US limits **** \n')
+            print(analyse_analytic().T)
+        elif INPUT_FORMAT == 'adaptive':
+            from II_simulate_population import SEED, N_WORKERS, MODEL
+            from kinetics.stages import analyse_adaptive
+            stats, errors = analyse_adaptive(ABS_TOL, REL_TOL, BATCH_SIZE, MAX_TUMOURS, SEED, N_WORKERS, MODEL)
+        else:
+            if INPUT_FORMAT == 'simulate':
+                from II_simulate_population import N_TUMOURS, SEED, N_WORKERS, CHUNK_SIZE as SIM_CHUNK_SIZE, MODEL
+                from kinetics.models import model_kwargs
+                from kinetics.simulation import simulate_chunks
+                sims = simulate_chunks(N_TUMOURS, SIM_CHUNK_SIZE, seed=SEED, workers=N_WORKERS, **model_kwargs(MODEL))
+            else:
+                # Only the time columns are read
+                sims = path_to_store if INPUT_FORMAT == 'npy' else path_to_sims
+            stats = analyse_simulations(sims, CHUNK_SIZE)
+
+    if stats is not None:
+        print(woo_report(stats))
+    if errors is not None:
+        print('Precision reached after {:,} tumours \n'.format(stats.n_total))
+        print(errors)
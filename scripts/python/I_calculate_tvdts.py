@@ -1,33 +1,37 @@
 """
 Script to calculate tumour volume doubling times for the 34 cases
+The calculation is the calculate_tvdts stage in kinetics/stages.py (also run by: python -m kinetics tvdt)
 """
-import pandas as pd
-import numpy as np
-import sys
 import os
 
+from kinetics.io import PATH_TO_VOLUMES, OUTPUT_DIR
+from kinetics.profiling import manifest_path, profile_run
+from kinetics.stages import calculate_tvdts, update_patients
 
-# Paths
-path_to_volumes = './../../data/raw_volumes.csv'
-path_for_output = './../../output/'
-os.makedirs(path_for_output, exist_ok=True)
 
-vols = pd.read_csv(path_to_volumes)
-
-ratios_ov = vols[vols.valid_ov.ge(1)].groupby('anon_id').vol_ov.apply(lambda x: x.iloc[-1]/ x.iloc[0])
-ratios_ov.name = 'ratio_ov'
-ratios_om = vols[vols.valid_om.ge(1)].groupby('anon_id').vol_om.apply(lambda x: x.iloc[-1]/ x.iloc[0])
-ratios_om.name = 'ratio_om'
-dt = vols.groupby('anon_id').dt.apply(lambda x: x.iloc[-1])
-dt.name = 'dt'
+# Paths (resolved from the repository, so the script can be run from any folder)
+path_to_volumes = PATH_TO_VOLUMES
+path_for_output = OUTPUT_DIR
+# Only recompute the patients whose scans changed since the last run (kinetics/incremental.py). This also updates their
+# individual Gompertz parameters in gompertz_params_<site>.csv; the first run refits and rewrites those with kinetics/nlme.py
+INCREMENTAL = False
+# Write a manifest of the run (time, rows and parameters of each step, seeds) to output/manifests. PROFILE_MEMORY also
+# traces the allocations of each step (slower) and PROFILER = 'cprofile' or 'pyinstrument' profiles the whole run
+PROFILE = False
+PROFILE_MEMORY = False
+PROFILER = None
 
 '''
 V = V0 exp(r*t)
 r = 1/t ln(V/V0)
 tvdt = 1/r ln(2) = t * ln(2) / ln(V/V0)
+With more than two scans per patient, r is the least squares slope of ln(V) against t (kinetics/tvdt.py)
 '''
-tvdt = pd.concat([dt, ratios_ov, ratios_om], axis=1).reset_index()
-tvdt['tvdt_ov'] = tvdt.apply(lambda x: x.loc['dt'] * np.log(2) / np.log(x.loc['ratio_ov']), axis=1)
-tvdt['tvdt_om'] = tvdt.apply(lambda x: x.loc['dt'] * np.log(2) / np.log(x.loc['ratio_om']), axis=1)
-
-tvdt.to_csv(path_for_output + 'tvdts.csv')
\ No newline at end of file
+if __name__ == '__main__':
+    manifest = manifest_path(os.path.join(path_for_output, 'manifests'), 'I_calculate_tvdts') if PROFILE else None
+    with profile_run(manifest, PROFILE_MEMORY, PROFILER, incremental=INCREMENTAL):
+        if INCREMENTAL:
+            changed, removed = update_patients(path_to_volumes, path_for_output)
+            print('Recomputed {} patients, removed {}'.format(len(changed), len(removed)))
+        else:
+            calculate_tvdts(path_to_volumes, os.path.join(path_for_output, 'tvdts.csv'))
\ No newline at end of file
@@ -0,0 +1,41 @@
+'''
+Shared functions for the HGSOC growth kinetics analyses.
+
+The scripts in this folder (and in plot/) import the growth kernels and the
+simulation engine from here instead of redefining them.
+
+The most used functions can be imported from the package itself, e.g. from kinetics import V. The submodules are only
+imported when one of their functions is first used, so importing the package (or running the command line interface,
+python -m kinetics) does not pay for pandas, scipy or matplotlib unless they are needed.
+'''
+import importlib
+
+
+# Public name: submodule it lives in
+_EXPORTS = {'V': 'gompertz',
+            'get_time_to_vol_gompertz': 'gompertz',
+            'get_model': 'models',
+            'load_volumes': 'io',
+            'load_site_data': 'io',
+            'load_gompertz_params': 'io',
+            'iter_simulations': 'io',
+            'simulate_tumours': 'simulation',
+            'simulate_chunks': 'simulation',
+            'aggregate_chunks': 'aggregate',
+            'fit_gompertz': 'nlme',
+            'fit_exponential': 'nlme',
+            'calculate_tvdts': 'stages',
+            'update_patients': 'stages',
+            'simulate_population': 'stages',
+            'analyse_simulations': 'stages',
+            }
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module('kinetics.' + _EXPORTS[name]), name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS))
@@ -0,0 +1,9 @@
+'''
+python -m kinetics <command> [options], see kinetics/cli.py
+'''
+import sys
+
+from kinetics.cli import main
+
+
+sys.exit(main())
@@ -0,0 +1,133 @@
+'''
+Adaptive Monte Carlo: simulate batches of tumours until the statistics of III_analyse_simulation_results.py reach a
+target precision, instead of a fixed N_TUMOURS.
+
+After every batch the standard error of each statistic is estimated from the aggregator
+- fraction of tumours reaching the CA125 / US limit before metastasis: sqrt(p (1 - p) / n)
+- quartiles of the WOO: d * Q'(q) with d = sqrt(q (1 - q) / m) for m tumours detected before metastasis, the spread of
+  the order statistics (distribution free). The slope of the quantile function Q' is read from the quantile sketch over
+  q +/- max(d, WINDOW), wide enough that the buckets of the sketch do not show. The error of the sketch itself
+  (its relative accuracy times the quartile) is added in quadrature, as it does not shrink with m.
+The simulation stops once every statistic is within its absolute or relative tolerance. The batches are the
+chunks of simulate_chunks (one generator spawned per batch), consumed in order, so the stopping point and the result
+for a given seed do not depend on the number of workers, and a run that stops after n tumours is the fixed run of n.
+'''
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from kinetics.aggregate import WOOAggregator
+from kinetics.simulation import _simulate_shard
+
+
+QUANTILES = {'25%': 0.25, '50%': 0.5, '75%': 0.75}
+WINDOW = 0.02 # smallest half width (in probability) the slope of the quantile function is measured over
+
+
+def _batches(batch_size, seed_seq, workers, kwargs):
+    '''
+    Endless sequence of simulated batches, in order, with the generators simulate_chunks would give them
+    '''
+    def shard(i):
+        return (batch_size, i * batch_size, seed_seq.spawn(1)[0], kwargs)
+
+    if workers <= 1:
+        i = 0
+        while True:
+            yield _simulate_shard(shard(i))
+            i += 1
+
+    # Keep two batches per worker in flight; the ones that are not needed once the tolerances are met are dropped
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        pending = deque(executor.submit(_simulate_shard, shard(i)) for i in range(2 * workers))
+        i = 2 * workers
+        while True:
+            batch = pending.popleft().result()
+            pending.append(executor.submit(_simulate_shard, shard(i)))
+            i += 1
+            yield batch
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def standard_errors(stats):
+    '''
+    Estimate and standard error of the detection fractions and the WOO quartiles (months) of a WOOAggregator
+
+    Returns
+    -------
+    DataFrame indexed by statistic (e.g. 'fraction_CA125', 'woo_50%_US') with estimate, se and n
+    (the number of tumours the statistic is estimated from)
+    '''
+    rows = {}
+    n = stats.n_total
+    for name in stats.DETECTIONS:
+        p = stats.n_before_met[name] / max(n, 1)
+        rows['fraction_' + name] = (p, np.sqrt(p * (1 - p) / max(n, 1)), n)
+    for name in stats.DETECTIONS:
+        m = stats.n_before_met[name]
+        q = np.array(list(QUANTILES.values()))
+        d = np.sqrt(q * (1 - q) / max(m, 1))
+        lo, hi = np.maximum(q - np.maximum(d, WINDOW), 0), np.minimum(q + np.maximum(d, WINDOW), 1)
+        sketch = stats.sketches[name]
+        estimate, Q_lo, Q_hi = sketch.quantile(np.stack([q, lo, hi]))
+        se = np.hypot(d * (Q_hi - Q_lo) / (hi - lo), sketch.accuracy * np.abs(estimate))
+        for label, e, s in zip(QUANTILES, estimate, se):
+            rows['woo_{}_{}'.format(label, name)] = (e, s if m > 1 else np.inf, m)
+    return pd.DataFrame.from_dict(rows, orient='index', columns=['estimate', 'se', 'n'])
+
+
+def within_tolerance(errors, abs_tol=None, rel_tol=None):
+    '''
+    Whether each statistic meets its absolute (se <= abs_tol) or relative (se <= rel_tol * |estimate|) tolerance.
+    abs_tol and rel_tol are numbers or dicts by statistic; statistics without any tolerance are always met.
+    '''
+    def per_statistic(tol):
+        if isinstance(tol, dict):
+            return errors.index.map(lambda s: tol.get(s, np.nan)).values.astype(float)
+        return np.full(len(errors), np.nan if tol is None else tol, dtype=float)
+
+    abs_tol, rel_tol = per_statistic(abs_tol), per_statistic(rel_tol)
+    se, estimate = errors['se'].values, np.abs(errors['estimate'].values)
+    met = (se <= abs_tol) | (se <= rel_tol * estimate)
+    return met | (np.isnan(abs_tol) & np.isnan(rel_tol))
+
+
+def simulate_adaptive(abs_tol=None, rel_tol=0.01, batch_size=10000, min_tumours=10000, max_tumours=10 ** 8, seed=None,
+                      workers=1, sketch_kwargs=None, **kwargs):
+    '''
+    Simulate batches of tumours until every statistic of standard_errors meets its tolerance
+
+    Parameters
+    ----------
+    abs_tol, rel_tol : absolute and relative tolerances on the standard errors, numbers or dicts by statistic
+                       (e.g. {'fraction_US': 0.001}). A statistic is precise enough when either one is met.
+                       The quartiles can not be more precise than the accuracy of the quantile sketch (0.5%).
+    batch_size : number of tumours simulated between two checks
+    min_tumours, max_tumours : bounds on the number of tumours simulated
+    seed : master seed, as in simulate_chunks
+    workers : number of worker processes. The results do not depend on it.
+    sketch_kwargs : passed on to the quantile sketches
+    kwargs : passed on to simulate_tumours
+
+    Returns
+    -------
+    WOOAggregator of the tumours simulated and the DataFrame of standard_errors with the tolerance met for each
+    statistic (converged)
+    '''
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    stats = WOOAggregator(**(sketch_kwargs or {}))
+    batches = _batches(batch_size, seed_seq, workers, kwargs)
+    try:
+        for batch in batches:
+            stats.update(batch)
+            errors = standard_errors(stats)
+            errors['converged'] = within_tolerance(errors, abs_tol, rel_tol)
+            if stats.n_total >= max_tumours or (stats.n_total >= min_tumours and errors['converged'].all()):
+                break
+    finally:
+        batches.close()
+    return stats, errors
@@ -0,0 +1,172 @@
+'''
+Single-pass, mergeable statistics for the simulation results.
+
+The aggregators consume the simulation chunks one at a time and keep only counts, moments and a quantile sketch,
+so the summary of any number of tumours is computed without holding them in memory. Aggregators filled from
+different shards can be combined with merge().
+'''
+import numpy as np
+import pandas as pd
+
+
+DAYS_TO_MONTHS = 12 / 365
+
+
+class Moments:
+    '''
+    Running count, mean, variance, min and max, merged with the pairwise update of Chan et al.
+    With shape, an array of independent moments is kept (e.g. one per detection limit) and updated from
+    values of shape + (n,), where mask selects the values that count towards each of them.
+    '''
+    def __init__(self, shape=()):
+        self.count = np.zeros(shape, dtype=np.int64)[()]
+        self.mean = np.zeros(shape)[()]
+        self.m2 = np.zeros(shape)[()] # sum of squared differences from the mean
+        self.min = np.full(shape, np.inf)[()]
+        self.max = np.full(shape, -np.inf)[()]
+
+    def update(self, values, mask=None):
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return
+        if mask is None:
+            mask = np.ones(values.shape, dtype=bool)
+        other = Moments()
+        other.count = mask.sum(axis=-1)
+        n = np.maximum(other.count, 1)
+        other.mean = np.where(mask, values, 0).sum(axis=-1) / n
+        other.m2 = np.where(mask, (values - other.mean[..., None]) ** 2, 0).sum(axis=-1)
+        other.min = np.where(mask, values, np.inf).min(axis=-1)
+        other.max = np.where(mask, values, -np.inf).max(axis=-1)
+        self.merge(other)
+
+    def merge(self, other):
+        n = self.count + other.count
+        if np.all(n == 0):
+            return self
+        w = np.where(n > 0, other.count / np.maximum(n, 1), 0)
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * w
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * w
+        self.count = n
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        return self
+
+    @property
+    def std(self):
+        # Sample standard deviation, as in pandas describe
+        return np.where(self.count > 1, np.sqrt(self.m2 / np.maximum(self.count - 1, 1)), np.nan)[()]
+
+
+class QuantileSketch:
+    '''
+    Quantile sketch for positive values with a fixed relative accuracy.
+
+    Values are counted in logarithmically spaced buckets, bucket i holding (gamma^(i-1), gamma^i] with
+    gamma = (1 + accuracy) / (1 - accuracy), so any quantile is returned within the relative accuracy and two
+    sketches with the same settings merge by adding their counts. Values outside [min_value, max_value]
+    are counted in the first or last bucket.
+    With shape, an array of independent sketches is kept and updated as in Moments.
+    '''
+    def __init__(self, accuracy=0.005, min_value=1e-9, max_value=1e9, shape=()):
+        self.accuracy = accuracy
+        self.log_gamma = np.log((1 + accuracy) / (1 - accuracy))
+        self.offset = int(np.ceil(np.log(min_value) / self.log_gamma))
+        n_buckets = int(np.ceil(np.log(max_value) / self.log_gamma)) - self.offset + 1
+        self.counts = np.zeros(np.broadcast_shapes(shape) + (n_buckets,), dtype=np.int64)
+
+    def update(self, values, mask=None):
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return
+        n_buckets = self.counts.shape[-1]
+        if mask is None:
+            mask = np.ones(values.shape, dtype=bool)
+        # Sketch that each selected value belongs to and its bucket, as an index into the flattened counts
+        sketch = np.broadcast_to(np.arange(self.counts.size // n_buckets).reshape(self.counts.shape[:-1] + (1,)),
+                                 values.shape)[mask]
+        ix = np.ceil(np.log(values[mask]) / self.log_gamma).astype(np.int64) - self.offset
+        ix = sketch * n_buckets + np.clip(ix, 0, n_buckets - 1)
+        self.counts += np.bincount(ix, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def merge(self, other):
+        if other.counts.shape != self.counts.shape or other.log_gamma != self.log_gamma:
+            raise ValueError('Only sketches with the same accuracy and range can be merged')
+        self.counts += other.counts
+        return self
+
+    def quantile(self, q):
+        '''
+        Quantile(s) q in [0, 1] of the values seen so far (with the shape of the sketches followed by that of q)
+        '''
+        q = np.asarray(q, dtype=float)
+        counts = self.counts.reshape(-1, self.counts.shape[-1])
+        total = counts.sum(axis=1)
+        # Bucket holding the value of rank q * (n - 1), and the mid-point of that bucket in relative terms
+        rank = q.reshape(1, -1) * (total[:, None] - 1)
+        i = np.sum(np.cumsum(counts, axis=1)[:, None, :] <= rank[..., None], axis=-1)
+        values = 2 * np.exp((i + self.offset) * self.log_gamma) / ((1 + self.accuracy) / (1 - self.accuracy) + 1)
+        values = np.where(total[:, None] > 0, values, np.nan)
+        return values.reshape(self.counts.shape[:-1] + q.shape)
+
+
+class WOOAggregator:
+    '''
+    Streaming version of the statistics in III_analyse_simulation_results.py
+    1. How many tumours reach the CA125 / US detection limits before metastasis
+    2. Moments and quantiles of the WOO (months) for those tumours
+    '''
+    DETECTIONS = {'CA125': 'time_to_ca125', 'US': 'time_to_US'}
+
+    def __init__(self, **sketch_kwargs):
+        self.n_total = 0
+        self.n_before_met = {name: 0 for name in self.DETECTIONS}
+        self.moments = {name: Moments() for name in self.DETECTIONS}
+        self.sketches = {name: QuantileSketch(**sketch_kwargs) for name in self.DETECTIONS}
+
+    def update(self, chunk):
+        '''
+        Add a chunk of simulations (dict of arrays or DataFrame with time_to_met, time_to_ca125 and time_to_US)
+        '''
+        time_to_met = np.asarray(chunk['time_to_met'])
+        self.n_total += time_to_met.size
+        for name, column in self.DETECTIONS.items():
+            time_to_detect = np.asarray(chunk[column])
+            b4_mets = time_to_met > time_to_detect
+            woo = (time_to_met[b4_mets] - time_to_detect[b4_mets]) * DAYS_TO_MONTHS
+            self.n_before_met[name] += int(b4_mets.sum())
+            self.moments[name].update(woo)
+            self.sketches[name].update(woo)
+        return self
+
+    def merge(self, other):
+        '''
+        Combine with an aggregator filled from another part of the population (e.g. another shard)
+        '''
+        self.n_total += other.n_total
+        for name in self.DETECTIONS:
+            self.n_before_met[name] += other.n_before_met[name]
+            self.moments[name].merge(other.moments[name])
+            self.sketches[name].merge(other.sketches[name])
+        return self
+
+    def describe(self, name):
+        '''
+        Summary of the WOO (months) for 'CA125' or 'US', in the layout of pandas describe
+        '''
+        m = self.moments[name]
+        q25, q50, q75 = self.sketches[name].quantile([0.25, 0.5, 0.75])
+        return pd.Series({'count': float(m.count), 'mean': m.mean if m.count else np.nan, 'std': m.std,
+                          'min': m.min if m.count else np.nan, '25%': q25, '50%': q50, '75%': q75,
+                          'max': m.max if m.count else np.nan})
+
+
+def aggregate_chunks(chunks, **sketch_kwargs):
+    '''
+    Fill a WOOAggregator from an iterable of chunks (e.g. simulate_chunks or iter_store_chunks)
+    '''
+    aggregator = WOOAggregator(**sketch_kwargs)
+    for chunk in chunks:
+        aggregator.update(chunk)
+    return aggregator
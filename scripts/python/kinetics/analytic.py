@@ -0,0 +1,72 @@
+'''
+Detection before metastasis and WOO of the simulated population in closed form, without sampling.
+
+In the simulation (kinetics/simulation.py) the times to metastasis and to detection share beta_pt and K:
+    time_to_met = c(size_at_met) / beta_pt,  time_to_detect = c(limit) / beta_pt,  c(v) = -ln(1 - ln(v/V0)/K)
+so a tumour is detected before metastasis exactly when size_at_met > limit, and its WOO is (c(size) - c(limit)) / beta_pt.
+Enumerating the 2 primary sites and the 11 sizes at metastasis gives 22 equally likely (per site) components; with
+log(beta_pt) normal, the WOO of each component is lognormal with mu = ln((c(size) - c(limit)) * 12/365) - ln_beta_mean
+and sigma = ln_beta_std. The fraction detected before metastasis is the total weight of the components with
+size > limit, and the WOO is the mixture of their lognormals, from which the mean, std and quantiles are exact.
+'''
+import numpy as np
+import pandas as pd
+
+from kinetics.aggregate import DAYS_TO_MONTHS
+from kinetics.lognormal import mixture_quantile
+from kinetics.simulation import V0, LIMIT_CA, LIMIT_US, ovarian_params, omental_params, pt_size_at_met, p_om
+from kinetics.thresholds import detection_invariant
+
+
+def woo_components(limits, sizes=pt_size_at_met, p_om=p_om, ovarian_params=ovarian_params,
+                   omental_params=omental_params, V0=V0):
+    '''
+    Lognormal components of the WOO (months) for every detection limit
+
+    Returns
+    -------
+    weights, mu, sigma : arrays of shape (limits, 2 * sizes), ovarian primaries first. The weight of a component is
+    the probability of its primary site and size, and 0 if that size is not above the limit.
+    '''
+    limits = np.atleast_1d(np.asarray(limits, dtype=float))
+    sizes = np.asarray(sizes, dtype=float)
+    weights, mu, sigma = [], [], []
+    for params, p_site in [(ovarian_params, 1 - p_om), (omental_params, p_om)]:
+        c_size = detection_invariant(sizes, params['vmax'], V0)
+        c_limit = detection_invariant(limits, params['vmax'], V0)
+        dc = c_size[None, :] - c_limit[:, None]
+        detected = dc > 0
+        weights.append(np.where(detected, p_site / len(sizes), 0.))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mu.append(np.where(detected, np.log(dc * DAYS_TO_MONTHS), 0.) - params['ln_beta_mean'])
+        sigma.append(np.full(dc.shape, params['ln_beta_std']))
+    return np.concatenate(weights, axis=1), np.concatenate(mu, axis=1), np.concatenate(sigma, axis=1)
+
+
+def detection_analytic(limits=(LIMIT_CA, LIMIT_US), quantiles=(0.25, 0.5, 0.75), **kwargs):
+    '''
+    Exact fraction of tumours detected before metastasis and the mean, std and quantiles of their WOO (months)
+
+    Parameters
+    ----------
+    limits : detection limits (cm3)
+    quantiles : quantiles of the WOO to give
+    kwargs : simulation parameters (sizes, p_om, ovarian_params, omental_params, V0) as in woo_components
+
+    Returns
+    -------
+    DataFrame indexed by the detection limit with fraction_before_met, mean, std and the quantiles (e.g. '50%'),
+    the columns of ThresholdSweep.summary that do not depend on the number of tumours
+    '''
+    limits = np.atleast_1d(np.asarray(limits, dtype=float))
+    weights, mu, sigma = woo_components(limits, **kwargs)
+    fraction = weights.sum(axis=1)
+    norm = np.where(fraction > 0, fraction, np.nan)
+    # Moments of the mixture: E[X^k] = sum_i w_i exp(k mu_i + k^2 sigma_i^2 / 2)
+    m1 = np.sum(weights * np.exp(mu + sigma ** 2 / 2), axis=1) / norm
+    m2 = np.sum(weights * np.exp(2 * mu + 2 * sigma ** 2), axis=1) / norm
+    df = pd.DataFrame({'fraction_before_met': fraction, 'mean': m1, 'std': np.sqrt(np.maximum(m2 - m1 ** 2, 0))},
+                      index=pd.Index(limits, name='limit'))
+    for q, values in zip(quantiles, np.moveaxis(mixture_quantile(quantiles, weights, mu, sigma), -1, 0)):
+        df['{:g}%'.format(100 * q)] = values
+    return df
@@ -0,0 +1,244 @@
+'''
+Benchmarks of the pipeline stages on synthetic data of a given size, with fixed seeds.
+
+Every case builds its input (not timed, in a process of its own) and then runs one stage:
+- tvdt : doubling times (I_calculate_tvdts.py) of n scans, 2 to 10 per patient
+- simulate : simulation of n tumours (II_simulate_population.py), in chunks of at most 10^6
+- analyse : detection and WOO statistics (III_analyse_simulation_results.py) of n tumours read from a compact store
+- woo : TTM / WOO table of figure_3.py for n patients
+- violins : log(t1) moments and violin statistics of the Figure S2 scripts for n runs
+Each (case, size) runs in a fresh process that loads the input from a temporary file, so that building the input does
+not count towards the peak resident memory of the stage. On Linux the peak (VmHWM) is also reset once the input is
+loaded, and peak_rss_mb is the peak of the runs alone; elsewhere it includes the loaded input. The results are appended to a history file (one JSON record per line) and compared with a stored baseline.
+'''
+import json
+import os
+import pickle
+import platform
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+from kinetics.profiling import git_commit, peak_rss_mb
+
+
+CASES = ['tvdt', 'simulate', 'analyse', 'woo', 'violins']
+SEED = 2024
+
+
+def _tvdt_input(n, rng, directory):
+    import pandas as pd
+    counts = rng.integers(2, 11, size=n // 2)
+    counts = counts[np.cumsum(counts) <= n]
+    ids = np.repeat(np.arange(len(counts)), counts)
+    # Times since the first scan and volumes growing with a random rate, valid for 70% of the lesions
+    dt = np.concatenate([[0], rng.integers(1, 60, size=len(ids) - 1)]).cumsum()
+    dt = dt - np.repeat(dt[np.cumsum(counts) - counts], counts)
+    rate = np.repeat(rng.lognormal(-4, 1, size=len(counts)), counts)
+    vols = pd.DataFrame({'anon_id': ids,
+                         'vol_om': 1e4 * np.exp(rate * dt + 0.05 * rng.standard_normal(len(ids))),
+                         'vol_ov': 2e4 * np.exp(rate * dt + 0.05 * rng.standard_normal(len(ids))),
+                         'valid_ov': np.repeat(rng.uniform(size=len(counts)) < 0.7, counts).astype(int),
+                         'valid_om': np.repeat(rng.uniform(size=len(counts)) < 0.7, counts).astype(int),
+                         'dt': dt})
+    return (vols,)
+
+
+def _tvdt(vols):
+    from kinetics.tvdt import calculate_tvdts
+    calculate_tvdts(vols)
+
+
+def _simulate_input(n, rng, directory):
+    return (n,)
+
+
+def _simulate(n):
+    from kinetics.simulation import simulate_chunks
+    for _ in simulate_chunks(n, min(n, 10 ** 6), seed=SEED):
+        pass
+
+
+def _analyse_input(n, rng, directory):
+    from kinetics.simulation import simulate_chunks
+    from kinetics.store import write_compact_store
+    path = os.path.join(directory, 'sims')
+    write_compact_store(path, simulate_chunks(n, min(n, 10 ** 6), seed=SEED), n)
+    return (path,)
+
+
+def _analyse(path):
+    from kinetics.stages import analyse_simulations
+    analyse_simulations(path, 10 ** 6)
+
+
+def _woo_input(n, rng, directory):
+    import pandas as pd
+    params = {}
+    for site, (ln_beta, sd) in {'ov': (-5.79, 0.94), 'om': (-5.52, 0.94)}.items():
+        beta = np.exp(ln_beta + sd * rng.standard_normal(n))
+        params['beta_' + site] = beta
+        params['t1_' + site] = np.exp(np.log(beta * 500) + 0.2 * rng.standard_normal(n)) / beta
+    return (pd.DataFrame(params),)
+
+
+def _woo(df):
+    from kinetics.woo import ttm_woo
+    ttm_woo(df)
+
+
+def _violins_input(n, rng, directory):
+    import pandas as pd
+    return (pd.DataFrame({'fe-logbeta': -5.79 + 0.1 * rng.standard_normal(n), 'fe-logq': 0.64 + 0.05 * rng.standard_normal(n),
+                          'sd-logbeta': 0.88 * rng.chisquare(20, n) / 20, 'sd-logq': 0.03 * rng.chisquare(20, n) / 20}),)
+
+
+def _violins(df):
+    from kinetics.lognormal import logt1_moments, violin_stats
+    mu, sigma = logt1_moments(df['fe-logbeta'], df['fe-logq'], df['sd-logbeta'], df['sd-logq'])
+    violin_stats(mu, sigma, scale=12 / 365, points=500)
+
+
+_CASES = {'tvdt': (_tvdt_input, _tvdt), 'simulate': (_simulate_input, _simulate), 'analyse': (_analyse_input, _analyse),
+          'woo': (_woo_input, _woo), 'violins': (_violins_input, _violins)}
+
+
+def _status_mb(field):
+    # VmHWM (peak) or VmRSS (current) resident memory of this process (MB), None where /proc is not available
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 2 ** 10 # kB
+    except OSError:
+        return None
+
+
+def _reset_peak_rss():
+    # Reset VmHWM to the current resident memory (Linux only), returns whether it was reset
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return _status_mb('VmHWM') is not None
+
+
+def _build_input(args):
+    '''
+    Build the input of a case and pickle it in directory (in a worker process, so that it does not count towards the
+    memory of the case)
+    '''
+    case, n, directory = args
+    inputs = _CASES[case][0](n, np.random.default_rng(SEED), directory)
+    path = os.path.join(directory, 'input.pkl')
+    with open(path, 'wb') as f:
+        pickle.dump(inputs, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _run_case(args):
+    '''
+    Load the input of a case and time it (in a worker process, so the peak memory is the case's own)
+    '''
+    case, path, repeats = args
+    with open(path, 'rb') as f:
+        inputs = pickle.load(f)
+    input_rss = _status_mb('VmRSS') or peak_rss_mb()
+    reset = _reset_peak_rss()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        _CASES[case][1](*inputs)
+        times.append(time.perf_counter() - start)
+    return {'wall': min(times), 'peak_rss_mb': _status_mb('VmHWM') if reset else peak_rss_mb(),
+            'input_rss_mb': input_rss}
+
+
+def run_case(case, n, repeats=1):
+    '''
+    Wall time (best of repeats), peak resident memory (MB) and throughput (rows per second) of one case at size n
+    '''
+    directory = tempfile.mkdtemp(prefix='kinetics-bench-')
+    try:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            path = executor.submit(_build_input, (case, n, directory)).result()
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            result = executor.submit(_run_case, (case, path, repeats)).result()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    result['throughput'] = n / result['wall'] if result['wall'] > 0 else float('inf')
+    return result
+
+
+def run_benchmarks(cases=CASES, scales=(10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6), max_rows=None, repeats=1, verbose=True):
+    '''
+    Run every case at every scale (up to max_rows[case] if given)
+
+    Returns
+    -------
+    list of records with the case, n, wall (s), peak_rss_mb, throughput (rows/s) and the environment
+    '''
+    env = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(), 'host': platform.node(),
+           'python': platform.python_version(), 'numpy': np.__version__}
+    records = []
+    for case in cases:
+        for n in scales:
+            if max_rows is not None and n > max_rows.get(case, n):
+                continue
+            record = dict(env, case=case, n=int(n), **run_case(case, int(n), repeats))
+            records.append(record)
+            if verbose:
+                print('{case:>10} n={n:<10.0e} {wall:10.4f} s {peak_rss_mb:9.1f} MB {throughput:12.4g} rows/s'.format(**record))
+    return records
+
+
+def append_history(path, records):
+    '''
+    Append records to a history file, one JSON record per line
+    '''
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def save_baseline(path, records):
+    '''
+    Store the wall time and peak memory of every (case, n) as the baseline to compare later runs with
+    '''
+    baseline = {}
+    for r in records:
+        baseline.setdefault(r['case'], {})[str(r['n'])] = {'wall': r['wall'], 'peak_rss_mb': r['peak_rss_mb'],
+                                                           'commit': r['commit']}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=1)
+
+
+def compare(records, path_to_baseline, threshold=0.2, metrics=('wall', 'peak_rss_mb')):
+    '''
+    Regressions against the baseline: the (case, n, metric) whose value is more than threshold (relative) above it
+
+    Returns
+    -------
+    list of dicts with case, n, metric, baseline, value and ratio (empty if there is no baseline)
+    '''
+    if not os.path.exists(path_to_baseline):
+        return []
+    with open(path_to_baseline) as f:
+        baseline = json.load(f)
+    regressions = []
+    for r in records:
+        ref = baseline.get(r['case'], {}).get(str(r['n']))
+        if ref is None:
+            continue
+        for metric in metrics:
+            if ref[metric] > 0 and r[metric] > ref[metric] * (1 + threshold):
+                regressions.append({'case': r['case'], 'n': r['n'], 'metric': metric, 'baseline': ref[metric],
+                                    'value': r[metric], 'ratio': r[metric] / ref[metric]})
+    return regressions
@@ -0,0 +1,171 @@
+'''
+Bootstrap of the uncertainty in the simulation inputs through to the detection and WOO statistics.
+
+The simulator (kinetics/simulation.py) takes the NLME estimates of log(beta), p_om = 4/11 and the 11 sizes of the
+primary at metastasis as exact. Each bootstrap replicate instead
+1. resamples the 11 cases with growing lesions in both sites (with replacement), which gives its sizes at metastasis
+   and its probability of an omental primary (the fraction of the resampled cases where the omental lesion came first)
+2. draws the mean of log(beta) of each site from N(estimate, se^2) and its variance from variance * chi2(n-1) / (n-1)
+and simulates N tumours with those inputs. Blocks of replicates are simulated as (replicates x tumours) arrays and the
+statistics of every replicate are taken along the tumour axis, so the whole bootstrap is a few array passes per block.
+'''
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from kinetics.aggregate import DAYS_TO_MONTHS
+from kinetics.gompertz import get_time_to_vol_gompertz
+from kinetics.simulation import V0, LIMIT_CA, LIMIT_US, ovarian_params, omental_params
+
+
+# Standard errors of the mean of log(beta) (sebeta(1) of fit_gompertz for each site) and the number of patients fitted
+UNCERTAINTY = {'ov': {'ln_beta_se': 0.1915, 'n_patients': 24},
+               'om': {'ln_beta_se': 0.2050, 'n_patients': 21}}
+LIMITS = {'ca125': LIMIT_CA, 'US': LIMIT_US} # detection limits (cm3), named as the time_to_<name> columns of sims.csv
+QUANTILES = [0.25, 0.5, 0.75] # quantiles of the WOO reported for each replicate
+
+
+def draw_replicates(n_replicates, rng, sizes, omental_first, ovarian_params=ovarian_params,
+                    omental_params=omental_params, uncertainty=UNCERTAINTY, resample_cases=True, resample_params=True):
+    '''
+    Simulation inputs of each bootstrap replicate
+
+    Parameters
+    ----------
+    n_replicates : number of replicates B
+    rng : numpy Generator
+    sizes : size of the primary at metastasis of each case (cm3), e.g. kinetics.woo.ttm_woo(...)['size_at_met']
+    omental_first : whether the omental lesion came first in each case (d_t1 < 0)
+    ovarian_params, omental_params : dicts with 'ln_beta_mean' and 'ln_beta_std', as in kinetics/simulation.py
+    uncertainty : dict by site with the standard error of ln_beta_mean and the number of patients of the fit
+    resample_cases, resample_params : which of the two sources of uncertainty to include
+
+    Returns
+    -------
+    dict with sizes (B x cases), p_om (B,) and ln_beta_mean_<site>, ln_beta_std_<site> (B,)
+    '''
+    sizes = np.asarray(sizes, dtype=float)
+    omental_first = np.asarray(omental_first, dtype=bool)
+    n_cases = len(sizes)
+    if resample_cases:
+        idx = rng.integers(0, n_cases, size=(n_replicates, n_cases))
+    else:
+        idx = np.broadcast_to(np.arange(n_cases), (n_replicates, n_cases))
+    reps = {'sizes': sizes[idx], 'p_om': omental_first[idx].mean(axis=1)}
+    for site, params in [('ov', ovarian_params), ('om', omental_params)]:
+        mean = np.full(n_replicates, params['ln_beta_mean'], dtype=float)
+        var = np.full(n_replicates, params['ln_beta_std'] ** 2, dtype=float)
+        if resample_params:
+            mean += uncertainty[site]['ln_beta_se'] * rng.standard_normal(n_replicates)
+            dof = uncertainty[site]['n_patients'] - 1
+            var *= rng.chisquare(dof, n_replicates) / dof
+        reps['ln_beta_mean_' + site] = mean
+        reps['ln_beta_std_' + site] = np.sqrt(var)
+    return reps
+
+
+def masked_quantiles(values, mask, q):
+    '''
+    Quantiles (linear interpolation, as np.quantile) of the values where mask is True, along the last axis
+
+    Returns
+    -------
+    array of shape values.shape[:-1] + (len(q),), nan where a row has no values
+    '''
+    x = np.sort(np.where(mask, values, np.inf), axis=-1) # the masked out values are sorted to the end
+    n = mask.sum(axis=-1)[..., None]
+    pos = (np.maximum(n, 1) - 1) * np.asarray(q, dtype=float)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, np.maximum(n - 1, 0))
+    x_lo, x_hi = np.take_along_axis(x, lo, axis=-1), np.take_along_axis(x, hi, axis=-1)
+    with np.errstate(invalid='ignore'):
+        out = x_lo + (pos - lo) * (x_hi - x_lo)
+    return np.where(n > 0, out, np.nan)
+
+
+def simulate_replicates(reps, n, rng, vmax_ov=ovarian_params['vmax'], vmax_om=omental_params['vmax'], limits=LIMITS,
+                        quantiles=QUANTILES):
+    '''
+    Simulate n tumours for every replicate as (replicates x tumours) arrays, drawn from the same distributions as in
+    simulate_tumours (site, size at metastasis and beta_pt; beta_met is not needed). The draws are laid out and ordered
+    differently, so a seed does not give the tumours of simulate_tumours.
+
+    Returns
+    -------
+    DataFrame with one row per replicate: p_om and, for each detection limit, the fraction of tumours detected before
+    metastasis and the mean and quantiles of their WOO (months)
+    '''
+    B = len(reps['p_om'])
+    omental = rng.uniform(size=(B, n)) <= reps['p_om'][:, None]
+    size_at_met = np.take_along_axis(reps['sizes'], rng.integers(0, reps['sizes'].shape[1], size=(B, n)), axis=1)
+    mean_pt = np.where(omental, reps['ln_beta_mean_om'][:, None], reps['ln_beta_mean_ov'][:, None])
+    std_pt = np.where(omental, reps['ln_beta_std_om'][:, None], reps['ln_beta_std_ov'][:, None])
+    beta_pt = np.exp(mean_pt + std_pt * rng.standard_normal((B, n)))
+    K = np.where(omental, np.log(vmax_om / V0), np.log(vmax_ov / V0))
+
+    time_to_met = get_time_to_vol_gompertz(size_at_met, beta_pt, K, V0)
+    df = pd.DataFrame({'p_om': reps['p_om']})
+    for name, limit in limits.items():
+        time_to_detect = get_time_to_vol_gompertz(limit, beta_pt, K, V0)
+        b4_mets = time_to_met > time_to_detect
+        woo = (time_to_met - time_to_detect) * DAYS_TO_MONTHS
+        count = b4_mets.sum(axis=1)
+        df['fraction_before_met_' + name] = count / n
+        with np.errstate(invalid='ignore'):
+            df['woo_mean_' + name] = np.where(b4_mets, woo, 0).sum(axis=1) / count
+        for q, values in zip(quantiles, np.moveaxis(masked_quantiles(woo, b4_mets, quantiles), -1, 0)):
+            df['woo_q{:g}_{}'.format(100 * q, name)] = values
+    return df
+
+
+def _run_block(args):
+    '''
+    Draw and simulate one block of replicates with its own generator (top level so that it can be sent to workers)
+    '''
+    n_replicates, n, seed_seq, kwargs, sim_kwargs = args
+    rng = np.random.default_rng(seed_seq)
+    return simulate_replicates(draw_replicates(n_replicates, rng, **kwargs), n, rng, **sim_kwargs)
+
+
+def run_bootstrap(sizes, omental_first, n_replicates=1000, n_tumours=100000, seed=None, workers=1,
+                  max_elements=5 * 10 ** 6, sim_kwargs=None, **kwargs):
+    '''
+    Bootstrap the detection and WOO statistics of the simulated population
+
+    Parameters
+    ----------
+    sizes, omental_first : the cases with growing lesions in both sites, as in draw_replicates
+    n_replicates : number of bootstrap replicates B
+    n_tumours : number of tumours simulated per replicate N
+    seed : master seed; every block of replicates gets its own generator spawned from it
+    workers : number of worker processes. The results do not depend on it.
+    max_elements : maximum size of the (replicates x tumours) arrays of a block
+    sim_kwargs : passed on to simulate_replicates (vmax_ov, vmax_om, limits, quantiles)
+    kwargs : passed on to draw_replicates
+
+    Returns
+    -------
+    DataFrame with one row per replicate (see simulate_replicates)
+    '''
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    block_size = max(1, max_elements // n_tumours)
+    sizes_ = [min(block_size, n_replicates - start) for start in range(0, n_replicates, block_size)]
+    blocks = [(b, n_tumours, child, dict(kwargs, sizes=sizes, omental_first=omental_first), sim_kwargs or {})
+              for b, child in zip(sizes_, seed_seq.spawn(len(sizes_)))]
+
+    if workers <= 1:
+        results = [_run_block(block) for block in blocks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_run_block, blocks))
+    return pd.concat(results, ignore_index=True)
+
+
+def confidence_intervals(df, level=0.95):
+    '''
+    Mean, standard deviation and percentile confidence interval of every statistic over the replicates
+    '''
+    alpha = (1 - level) / 2
+    return pd.DataFrame({'mean': df.mean(), 'std': df.std(),
+                         'lower': df.quantile(alpha), 'upper': df.quantile(1 - alpha)})
@@ -0,0 +1,286 @@
+'''
+Discrete-event simulation of metastatic cascades: every lesion can seed new lesions in any of several sites, and a
+patient is detected by whichever lesion reaches a detection limit first.
+
+Every patient starts with a primary at t = 0 in a site drawn from p_primary. Each lesion draws its beta from the
+log(beta) distribution of its site and seeds_per_lesion sizes from the sizes of the primary at metastasis
+(pt_size_at_met): when it reaches one of them, it seeds a new lesion in another site drawn from p_target. Lesions of
+generation max_generations do not seed. The detection of each limit is the first time any lesion reaches it.
+
+The patients of a chunk are simulated together. The state of the lesions is held in compact (patients x lesions)
+arrays and the pending seeding events of every patient in a (patients x lesions x seeds) array of times, the event
+queue of the patient: at each step the earliest event of every patient still running is popped (argmin over its
+slots), the new lesions of all those patients are drawn at once and their seeding and detection times are pushed.
+The times come from the invariants of the growth model (kinetics/models.py), computed once per site, so a step only
+divides them by the betas of the new lesions. A patient stops when its next seeding is after it has reached every
+detection limit (or after horizon), since later lesions cannot change its detections, or when it has max_lesions
+lesions (truncated).
+
+With two sites, one seed per lesion and max_generations=1, this is the model of kinetics/simulation.py, except that a
+metastasis reaching a limit before the primary also detects the patient.
+'''
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from kinetics.aggregate import DAYS_TO_MONTHS, Moments, QuantileSketch
+from kinetics.models import get_model
+from kinetics.simulation import V0, LIMIT_CA, LIMIT_US, ovarian_params, omental_params, pt_size_at_met, p_om
+
+
+SITES = {'ov': ovarian_params, 'om': omental_params} # site: dict with 'vmax', 'ln_beta_mean' and 'ln_beta_std'
+LIMITS = {'ca125': LIMIT_CA, 'US': LIMIT_US} # detection limits (cm3), written to the time_to_<name> columns
+P_PRIMARY = {'ov': 1 - p_om, 'om': p_om} # probability of the primary site, the other sites get 0
+
+
+def _cumulative(weights):
+    weights = np.asarray(weights, dtype=float)
+    return np.cumsum(weights, axis=-1) / weights.sum(axis=-1, keepdims=True)
+
+
+def simulate_cascades(n, rng=None, start=0, sites=SITES, p_primary=P_PRIMARY, p_target=None, sizes=pt_size_at_met,
+                      seeds_per_lesion=1, max_generations=2, max_lesions=8, limits=LIMITS, horizon=np.inf,
+                      model='gompertz'):
+    '''
+    Simulate the cascades of a batch of patients
+
+    Parameters
+    ----------
+    n : number of patients
+    rng : numpy Generator used for all the draws (a fresh unseeded one if None)
+    start : index of the first patient in the batch, used for the 'ix' column
+    sites : dict of site: params ('vmax', 'ln_beta_mean', 'ln_beta_std'), in the order of the site codes
+    p_primary : dict of site: probability of the primary being there (normalised, missing sites get 0)
+    p_target : dict of site: weight of being seeded, renormalised over the sites other than the seeding one
+               (all the sites equally if None)
+    sizes : sizes at which a lesion seeds (cm3), each lesion draws seeds_per_lesion of them
+    max_generations : generation of the lesions that do not seed (the primary is generation 0)
+    max_lesions : lesions per patient at most, the patients that would have more are truncated
+    limits : dict of name: detection limit (cm3)
+    horizon : time (days) after which no seeding is simulated
+    model : growth model of the lesions (kinetics/models.py)
+
+    Returns
+    -------
+    dict of 1D arrays of length n:
+        ix, primary_site (code of the site, in the order of sites), n_lesions, truncated,
+        time_to_met (onset of the first metastasis, days),
+        and for each limit: time_to_<name> (days, inf if never reached), site_at_<name> and generation_at_<name> (of
+        the lesion that reached it first, -1 if none) and lesions_at_<name> (lesions at that time)
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    model = get_model(model)
+    names = list(sites)
+    ln_mean = np.array([sites[s]['ln_beta_mean'] for s in names], dtype=float)
+    ln_std = np.array([sites[s]['ln_beta_std'] for s in names], dtype=float)
+    K = np.log(np.array([sites[s]['vmax'] for s in names], dtype=float) / V0)
+    sizes = np.asarray(sizes, dtype=float)
+    limit_values = np.array(list(limits.values()), dtype=float)
+
+    # beta * time to reach each size / limit, by site: the times of a lesion are these divided by its beta
+    c_seed = model.invariant(sizes[None, :], K[:, None], V0)
+    c_detect = model.invariant(limit_values[None, :], K[:, None], V0)
+    cum_primary = _cumulative([p_primary.get(s, 0) for s in names])
+    weights = np.array([1. if p_target is None else p_target.get(s, 0) for s in names])
+    cum_target = _cumulative(weights[None, :] * (1 - np.eye(len(names)))) # a lesion seeds another site
+
+    S = seeds_per_lesion
+    onset = np.full((n, max_lesions), np.inf)
+    site = np.zeros((n, max_lesions), dtype=np.int8)
+    generation = np.zeros((n, max_lesions), dtype=np.int8)
+    seed_time = np.full((n, max_lesions, S), np.inf) # pending seeding events
+    first = np.full((n, len(limit_values)), np.inf) # first time each limit is reached
+    by = np.zeros((n, len(limit_values)), dtype=np.int64) # and the lesion that reached it
+    n_lesions = np.zeros(n, dtype=np.int64)
+    truncated = np.zeros(n, dtype=bool)
+
+    def add_lesions(idx, t, lesion_site, lesion_generation):
+        # New lesions of the patients idx at times t: draw them and push their seeding and detection times
+        beta = model.sample_rates(rng, ln_mean[lesion_site], ln_std[lesion_site], len(idx))
+        size_ix = rng.integers(0, len(sizes), size=(len(idx), S))
+        j = n_lesions[idx]
+        onset[idx, j] = t
+        site[idx, j] = lesion_site
+        generation[idx, j] = lesion_generation
+        seeds = t[:, None] + c_seed[lesion_site[:, None], size_ix] / beta[:, None]
+        seed_time[idx, j] = np.where((lesion_generation < max_generations)[:, None], seeds, np.inf)
+        detect = t[:, None] + c_detect[lesion_site] / beta[:, None]
+        earlier = detect < first[idx]
+        first[idx] = np.where(earlier, detect, first[idx])
+        by[idx] = np.where(earlier, j[:, None], by[idx])
+        n_lesions[idx] += 1
+
+    # Primaries
+    primary_site = np.minimum(np.searchsorted(cum_primary, rng.uniform(size=n), side='right'), len(names) - 1)
+    add_lesions(np.arange(n), np.zeros(n), primary_site, np.zeros(n, dtype=np.int8))
+    time_to_met = seed_time[:, 0].min(axis=1) # the first metastasis is the first seeding of the primary
+
+    active = np.arange(n)
+    while len(active):
+        # Pop the earliest pending event of every patient still running
+        pending = seed_time[active].reshape(len(active), -1)
+        k = pending.argmin(axis=1)
+        t = pending[np.arange(len(active)), k]
+        # A seeding after every limit has been reached cannot change the detections
+        live = t < np.minimum(first[active].max(axis=1), horizon)
+        full = n_lesions[active] >= max_lesions
+        truncated[active[live & full]] = True
+        go = live & ~full
+        active, k, t = active[go], k[go], t[go]
+        if not len(active):
+            break
+        parent = k // S
+        seed_time[active, parent, k % S] = np.inf
+        u = rng.uniform(size=len(active))
+        target = np.minimum((u[:, None] >= cum_target[site[active, parent]]).sum(axis=1), len(names) - 1)
+        add_lesions(active, t, target, generation[active, parent] + 1)
+
+    rows = np.arange(n)
+    out = {'ix': np.arange(start, start + n), 'primary_site': primary_site.astype(np.int8), 'n_lesions': n_lesions,
+           'truncated': truncated, 'time_to_met': time_to_met}
+    for l, name in enumerate(limits):
+        lesion, reached = by[:, l], np.isfinite(first[:, l])
+        out['time_to_' + name] = first[:, l]
+        out['site_at_' + name] = np.where(reached, site[rows, lesion], -1).astype(np.int8)
+        out['generation_at_' + name] = np.where(reached, generation[rows, lesion], -1).astype(np.int8)
+        out['lesions_at_' + name] = (onset < first[:, l:l + 1]).sum(axis=1)
+    return out
+
+
+def _simulate_shard(args):
+    '''
+    Simulate one shard of patients with its own generator (top level so that it can be sent to worker processes)
+    '''
+    n, start, seed_seq, kwargs = args
+    return simulate_cascades(n, np.random.default_rng(seed_seq), start=start, **kwargs)
+
+
+def cascade_chunks(n, chunk_size, seed=None, workers=1, **kwargs):
+    '''
+    Simulate the cascades of n patients in chunks, as simulate_chunks does for simulate_tumours: every chunk has its
+    own generator spawned from SeedSequence(seed), so the output does not depend on workers.
+    kwargs : passed on to simulate_cascades
+
+    Returns
+    -------
+    generator of dicts of 1D arrays, one per chunk and in order
+    '''
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    starts = range(0, n, chunk_size)
+    shards = [(min(chunk_size, n - start), start, child, kwargs)
+              for start, child in zip(starts, seed_seq.spawn(len(starts)))]
+
+    if workers <= 1:
+        for shard in shards:
+            yield _simulate_shard(shard)
+        return
+
+    # Keep at most two shards per worker in flight so that finished chunks do not pile up in memory
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for shard in shards:
+            pending.append(executor.submit(_simulate_shard, shard))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class CascadeSummary:
+    '''
+    For every detection limit: how many patients reach it before metastasis and the moments and quantiles of their
+    WOO (months), as WOOAggregator does, and which lesions detect the patients (site, metastasis or primary) and how
+    many lesions they have by then
+
+    Parameters
+    ----------
+    sites : names of the sites, in the order of the site codes of simulate_cascades
+    limits : names of the limits (the time_to_<name> columns)
+    sketch_kwargs : passed on to QuantileSketch
+    '''
+    def __init__(self, sites=tuple(SITES), limits=tuple(LIMITS), **sketch_kwargs):
+        self.sites, self.limits = list(sites), list(limits)
+        L = len(self.limits)
+        self.n_total = 0
+        self.n_truncated = 0
+        self.n_detected = np.zeros(L, dtype=np.int64)
+        self.n_before_met = np.zeros(L, dtype=np.int64)
+        self.n_by_met = np.zeros(L, dtype=np.int64) # detected by a metastasis
+        self.n_by_site = np.zeros((L, len(self.sites)), dtype=np.int64)
+        self.woo = Moments(shape=L)
+        self.sketch = QuantileSketch(shape=L, **sketch_kwargs)
+        self.lesions = Moments(shape=L)
+
+    def update(self, chunk):
+        '''
+        Add a chunk of cascades (simulate_cascades)
+        '''
+        time_to_met = np.asarray(chunk['time_to_met'], dtype=float)
+        self.n_total += len(time_to_met)
+        self.n_truncated += int(np.sum(chunk['truncated']))
+        time_to_detect = np.stack([np.asarray(chunk['time_to_' + name], dtype=float) for name in self.limits])
+        detected = np.isfinite(time_to_detect)
+        b4_mets = time_to_met > time_to_detect
+        self.n_detected += detected.sum(axis=1)
+        self.n_before_met += b4_mets.sum(axis=1)
+        woo = np.where(b4_mets, time_to_met - time_to_detect, 0.) * DAYS_TO_MONTHS
+        self.woo.update(woo, b4_mets)
+        self.sketch.update(woo, b4_mets)
+        for l, name in enumerate(self.limits):
+            d = detected[l]
+            self.n_by_met[l] += int(np.sum(np.asarray(chunk['generation_at_' + name])[d] > 0))
+            self.n_by_site[l] += np.bincount(np.asarray(chunk['site_at_' + name])[d], minlength=len(self.sites))
+        lesions = np.stack([np.asarray(chunk['lesions_at_' + name], dtype=float) for name in self.limits])
+        self.lesions.update(lesions, detected)
+        return self
+
+    def merge(self, other):
+        '''
+        Combine with a summary filled from another part of the population
+        '''
+        if self.sites != other.sites or self.limits != other.limits:
+            raise ValueError('Only summaries over the same sites and limits can be merged')
+        self.n_total += other.n_total
+        self.n_truncated += other.n_truncated
+        self.n_detected += other.n_detected
+        self.n_before_met += other.n_before_met
+        self.n_by_met += other.n_by_met
+        self.n_by_site += other.n_by_site
+        self.woo.merge(other.woo)
+        self.sketch.merge(other.sketch)
+        self.lesions.merge(other.lesions)
+        return self
+
+    def summary(self):
+        '''
+        DataFrame indexed by the detection limit with the fraction of the patients detected before metastasis and
+        their WOO (months), and for the detected patients the fraction detected by a metastasis, by a lesion of each
+        site and the mean and max number of lesions at detection
+        '''
+        n, detected = max(self.n_total, 1), np.maximum(self.n_detected, 1)
+        seen = self.woo.count > 0
+        q25, q50, q75 = np.moveaxis(self.sketch.quantile([0.25, 0.5, 0.75]), -1, 0)
+        df = pd.DataFrame({'n_before_met': self.n_before_met, 'fraction_before_met': self.n_before_met / n,
+                           'woo_mean': np.where(seen, self.woo.mean, np.nan), 'woo_std': self.woo.std,
+                           'woo_25%': q25, 'woo_50%': q50, 'woo_75%': q75,
+                           'fraction_detected': self.n_detected / n, 'fraction_by_met': self.n_by_met / detected},
+                          index=pd.Index(self.limits, name='limit'))
+        for i, name in enumerate(self.sites):
+            df['fraction_by_' + name] = self.n_by_site[:, i] / detected
+        df['lesions_mean'] = np.where(self.lesions.count > 0, self.lesions.mean, np.nan)
+        df['lesions_max'] = np.where(self.lesions.count > 0, self.lesions.max, np.nan)
+        df['fraction_truncated'] = self.n_truncated / n
+        return df
+
+
+def summarise_cascades(chunks, sites=tuple(SITES), limits=tuple(LIMITS), **sketch_kwargs):
+    '''
+    Fill a CascadeSummary from an iterable of chunks (e.g. cascade_chunks)
+    '''
+    summary = CascadeSummary(sites, limits, **sketch_kwargs)
+    for chunk in chunks:
+        summary.update(chunk)
+    return summary
@@ -0,0 +1,336 @@
+'''
+Command line interface to the pipeline stages, e.g.
+    python -m kinetics simulate --n-tumours 1000000 --format npy --output ./sims_run1
+    python -m kinetics analyse --sims ./sims_run1/sims
+    python -m kinetics --profile simulate --n-tumours 10000000 (writes a manifest of the run to output/manifests)
+Every input and output path can be given explicitly; the defaults are the repository's data and output folders
+whatever the working directory. Only argparse is imported up front, each command imports what it needs when it runs.
+'''
+import argparse
+import os
+import sys
+
+from kinetics.io import PATH_TO_VOLUMES, OUTPUT_DIR, SIMULATIONS_DIR, SENSITIVITY_DIR
+from kinetics.profiling import manifest_path, profile_run
+
+
+DEFAULT_SIMS = os.path.join(SIMULATIONS_DIR, 'sims.csv')
+
+
+def _tvdt(args):
+    from kinetics.stages import calculate_tvdts
+    calculate_tvdts(args.volumes, args.output)
+
+
+def _update(args):
+    from kinetics.stages import update_patients
+    changed, removed = update_patients(args.volumes, args.output_dir, args.full)
+    print('Recomputed {} patients, removed {}'.format(len(changed), len(removed)))
+
+
+def _simulate(args):
+    from kinetics.stages import simulate_population
+    path, entropy = simulate_population(args.output, args.n_tumours, args.chunk_size, args.seed, args.workers,
+                                        args.format, args.model)
+    print('Simulated {} tumours with seed {} to {}'.format(args.n_tumours, entropy, path))
+
+
+def _analyse(args):
+    from kinetics.stages import analyse_simulations, woo_report
+    print(woo_report(analyse_simulations(args.sims, args.chunk_size)))
+
+
+def _adaptive(args):
+    from kinetics.stages import analyse_adaptive, woo_report
+    stats, errors = analyse_adaptive(args.abs_tol, args.rel_tol, args.batch_size, args.max_tumours, args.seed,
+                                     args.workers, args.model)
+    print(woo_report(stats))
+    print('Precision reached after {:,} tumours\n{}'.format(stats.n_total, errors))
+
+
+def _exact(args):
+    import numpy as np
+    from kinetics.stages import analyse_analytic
+    limits = np.logspace(np.log10(args.min_limit), np.log10(args.max_limit), args.n_limits) if args.n_limits else None
+    print(analyse_analytic(limits, args.output))
+
+
+def _thresholds(args):
+    import numpy as np
+    from kinetics.stages import detection_limit_sweep
+    limits = np.logspace(np.log10(args.min_limit), np.log10(args.max_limit), args.n_limits)
+    print(detection_limit_sweep(limits, args.sims, args.chunk_size, args.output, args.model))
+
+
+def _screening(args):
+    from kinetics.screening import make_schedules
+    from kinetics.stages import screening_schedules
+    schedules = make_schedules(args.intervals, args.starts, args.limits)
+    print(screening_schedules(schedules, args.sims, args.seed, args.chunk_size, args.output,
+                              args.model).to_string(index=False))
+
+
+def _bootstrap(args):
+    from kinetics.stages import bootstrap_population
+    _, intervals = bootstrap_population(args.replicates, args.n_tumours, args.seed, args.workers, args.params,
+                                        args.output, args.level)
+    print(intervals)
+
+
+def _noise(args):
+    from kinetics.sensitivity import summarise_sensitivity
+    from kinetics.stages import measurement_sensitivity
+    results = measurement_sensitivity(args.sites, args.levels, args.replicates, args.seed, args.workers,
+                                      args.block_size, args.volumes, args.output)
+    for site, df in results.items():
+        print('\n **** Sensitivity to measurement errors ({}) **** \n'.format(site))
+        print(summarise_sensitivity(df))
+
+
+def _vmax(args):
+    import numpy as np
+    from kinetics.stages import vmax_sensitivity
+    vmaxs = np.arange(args.min_vmax, args.max_vmax + args.step / 2, args.step)
+    sweeps = vmax_sensitivity(vmaxs, args.sites, args.workers, args.block_size, args.volumes, args.output, args.grid)
+    for site, df in sweeps.items():
+        t1 = np.exp(df['mean-logt1'])
+        print('CV for {} for the mean of log t1 over {} values of Vmax is {}'.format(site, len(df), np.std(t1) / np.mean(t1)))
+
+
+def _bench(args):
+    from kinetics.stages import benchmark_stages
+    scales = [10 ** k for k in range(args.min_exp, args.max_exp + 1)]
+    _, regressions = benchmark_stages(args.cases, scales, None, args.repeats, args.output, args.threshold,
+                                      args.save_baseline)
+    for r in regressions:
+        print('regression: {case} n={n:.0e} {metric} {value:.4g} (baseline {baseline:.4g}, x{ratio:.2f})'.format(**r))
+    return 1 if regressions else 0
+
+
+def _scenarios(args):
+    from kinetics.stages import scenario_sweep
+    summary = scenario_sweep(args.n_tumours, args.chunk_size, args.seed, args.workers, args.sites, args.p_oms,
+                             args.limits_ca, args.limits_us, args.sensitivity, args.output)
+    print(summary[['source', 'site', 'row', 'woo_mean_US', 'diff_woo_mean_US', 'se_diff_woo_mean_US']].to_string())
+
+
+def _trajectories(args):
+    import numpy as np
+    from kinetics.stages import trajectory_fan_chart
+    grid = np.linspace(0, 365 * args.years, args.n_times)
+    summary = trajectory_fan_chart(args.n_tumours, args.chunk_size, args.seed, args.workers, grid, args.sims,
+                                   args.output, args.model).summary()
+    print(summary[['primary_q50', 'met_q50', 'total_q50', 'fraction_with_met']].iloc[::max(1, (args.n_times - 1) // args.years)].to_string())
+
+
+def _cascades(args):
+    from kinetics.models import model_kwargs
+    from kinetics.simulation import pt_size_at_met, ovarian_params, omental_params
+    from kinetics.stages import metastatic_cascades
+    # The parameters of the fits of the model. The extra sites grow like the omentum, for which there are fits.
+    kwargs = model_kwargs(args.model)
+    om = kwargs.get('omental_params', omental_params)
+    sites = dict(ov=kwargs.get('ovarian_params', ovarian_params), om=om, **{name: om for name in args.extra_sites})
+    summary = metastatic_cascades(args.n_tumours, args.chunk_size, args.seed, args.workers, sites, args.seeds_per_lesion,
+                                  args.max_generations, args.max_lesions, args.output, model=kwargs['model'],
+                                  sizes=kwargs.get('sizes', pt_size_at_met))
+    print(summary.T.to_string())
+
+
+def _pipeline(args):
+    from kinetics.pipeline import default_stages, plan, run_pipeline
+    stages = default_stages(args.n_tumours, args.chunk_size, args.seed, args.sim_workers, args.format, model=args.model)
+    if args.dry_run:
+        for name, status in plan(stages, force=args.force).items():
+            print('{:>14} {}'.format(name, status))
+        return 0
+    status = run_pipeline(stages, args.workers, force=args.force, only=args.only)
+    return 0 if all(s in ('skipped', 'ran') for s in status.values()) else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='kinetics', description='HGSOC growth kinetics pipeline')
+    parser.add_argument('--profile', action='store_true', help='write a manifest of the run (timings, rows, parameters)')
+    parser.add_argument('--profile-memory', action='store_true', help='also trace the allocations of every step (slower)')
+    parser.add_argument('--profiler', choices=['cprofile', 'pyinstrument'], default=None,
+                        help='also profile the whole run, saved next to the manifest')
+    parser.add_argument('--manifest', default=None, help='json file to write the manifest to (implies --profile)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('tvdt', help='tumour volume doubling times')
+    p.add_argument('--volumes', default=PATH_TO_VOLUMES, help='raw_volumes.csv')
+    p.add_argument('--output', default=os.path.join(OUTPUT_DIR, 'tvdts.csv'), help='csv to write')
+    p.set_defaults(func=_tvdt)
+
+    p = commands.add_parser('update', help='recompute the doubling times and individual parameters of changed patients')
+    p.add_argument('--volumes', default=PATH_TO_VOLUMES, help='raw_volumes.csv')
+    p.add_argument('--output-dir', default=OUTPUT_DIR, help='folder with tvdts.csv, gompertz_params_*.csv and the index')
+    p.add_argument('--full', action='store_true', help='recompute every patient and refit the population parameters')
+    p.set_defaults(func=_update)
+
+    p = commands.add_parser('simulate', help='simulate the population of tumours')
+    p.add_argument('--n-tumours', type=int, default=10000)
+    p.add_argument('--chunk-size', type=int, default=1000000, help='tumours simulated at a time')
+    p.add_argument('--seed', type=int, default=2024, help='master seed')
+    p.add_argument('--workers', type=int, default=1, help='processes, the results do not depend on it')
+    p.add_argument('--format', choices=['csv', 'npy', 'compact'], default='csv',
+                   help='sims.csv, a column store sims/ or a column store with the compact schema')
+    p.add_argument('--output', default=SIMULATIONS_DIR, help='folder to write to')
+    p.add_argument('--model', default='gompertz',
+                   help='growth model: gompertz, exponential or logistic (needs output/<model>_params_*.csv)')
+    p.set_defaults(func=_simulate)
+
+    p = commands.add_parser('analyse', help='detection before mets and WOO for the CA125 and US limits')
+    p.add_argument('--sims', default=DEFAULT_SIMS, help='sims.csv or a column store folder')
+    p.add_argument('--chunk-size', type=int, default=1000000, help='simulations read at a time')
+    p.set_defaults(func=_analyse)
+
+    p = commands.add_parser('adaptive', help='simulate and analyse until the statistics reach a target precision')
+    p.add_argument('--abs-tol', type=float, default=None, help='absolute tolerance on the standard errors')
+    p.add_argument('--rel-tol', type=float, default=0.01, help='relative tolerance on the standard errors')
+    p.add_argument('--batch-size', type=int, default=10000, help='tumours simulated between two checks')
+    p.add_argument('--max-tumours', type=int, default=10 ** 8)
+    p.add_argument('--seed', type=int, default=2024, help='master seed')
+    p.add_argument('--workers', type=int, default=1, help='processes, the results do not depend on it')
+    p.add_argument('--model', default='gompertz',
+                   help='growth model: gompertz, exponential or logistic (needs output/<model>_params_*.csv)')
+    p.set_defaults(func=_adaptive)
+
+    p = commands.add_parser('exact', help='exact detection before mets and WOO statistics of the Gompertz model')
+    p.add_argument('--min-limit', type=float, default=1e-4, help='cm3')
+    p.add_argument('--max-limit', type=float, default=10, help='cm3')
+    p.add_argument('--n-limits', type=int, default=0, help='log spaced limits (0 for the CA125 and US limits)')
+    p.add_argument('--output', default=None, help='csv to write')
+    p.set_defaults(func=_exact)
+
+    p = commands.add_parser('thresholds', help='detection before mets and WOO over a grid of detection limits')
+    p.add_argument('--sims', default=DEFAULT_SIMS, help='sims.csv or a column store folder')
+    p.add_argument('--chunk-size', type=int, default=1000000, help='simulations read at a time')
+    p.add_argument('--min-limit', type=float, default=1e-4, help='cm3')
+    p.add_argument('--max-limit', type=float, default=10, help='cm3')
+    p.add_argument('--n-limits', type=int, default=2000, help='log spaced limits')
+    p.add_argument('--output', default=os.path.join(SIMULATIONS_DIR, 'detection_limit_sweep.csv'), help='csv to write')
+    p.add_argument('--model', default='gompertz', help='growth model the simulations were made with')
+    p.set_defaults(func=_thresholds)
+
+    p = commands.add_parser('screening', help='screen detection before mets for periodic screening schedules')
+    p.add_argument('--sims', default=DEFAULT_SIMS, help='sims.csv or a column store folder')
+    p.add_argument('--chunk-size', type=int, default=1000000, help='simulations read at a time')
+    p.add_argument('--intervals', type=float, nargs='+', default=[3, 6, 12, 24, 36], help='months between screens')
+    p.add_argument('--starts', type=float, nargs='+', default=[0], help='months after onset when screening starts')
+    p.add_argument('--limits', type=float, nargs='+', default=[0.015, 0.5], help='detection limits (cm3)')
+    p.add_argument('--seed', type=int, default=2024, help='seed of the phases of the screens')
+    p.add_argument('--output', default=os.path.join(SIMULATIONS_DIR, 'screening_schedules.csv'), help='csv to write')
+    p.add_argument('--model', default='gompertz', help='growth model the simulations were made with')
+    p.set_defaults(func=_screening)
+
+    p = commands.add_parser('bootstrap', help='confidence intervals of the detection and WOO statistics')
+    p.add_argument('--replicates', type=int, default=1000, help='bootstrap replicates')
+    p.add_argument('--n-tumours', type=int, default=100000, help='tumours simulated per replicate')
+    p.add_argument('--seed', type=int, default=2024)
+    p.add_argument('--workers', type=int, default=1, help='processes, the results do not depend on it')
+    p.add_argument('--level', type=float, default=0.95, help='confidence level')
+    p.add_argument('--params', default=OUTPUT_DIR, help='folder with gompertz_params_<site>.csv')
+    p.add_argument('--output', default=os.path.join(SIMULATIONS_DIR, 'bootstrap.csv'), help='csv to write')
+    p.set_defaults(func=_bootstrap)
+
+    p = commands.add_parser('noise', help='sensitivity of the NLME estimates to measurement errors')
+    p.add_argument('--volumes', default=PATH_TO_VOLUMES, help='raw_volumes.csv')
+    p.add_argument('--sites', nargs='+', default=['ov', 'om'])
+    p.add_argument('--levels', type=float, nargs='+', default=[5, 10, 20], help='noise in % of the volume')
+    p.add_argument('--replicates', type=int, default=1000, help='accepted replicates per noise level')
+    p.add_argument('--seed', type=int, default=2024)
+    p.add_argument('--workers', type=int, default=1)
+    p.add_argument('--block-size', type=int, default=250, help='replicates fitted together')
+    p.add_argument('--output', default=SENSITIVITY_DIR, help='folder to write measurement_sweep_<site>.csv to')
+    p.set_defaults(func=_noise)
+
+    p = commands.add_parser('vmax', help='sensitivity of the NLME estimates to Vmax')
+    p.add_argument('--volumes', default=PATH_TO_VOLUMES, help='raw_volumes.csv')
+    p.add_argument('--sites', nargs='+', default=['ov', 'om'])
+    p.add_argument('--min-vmax', type=float, default=2000, help='cm3')
+    p.add_argument('--max-vmax', type=float, default=10000, help='cm3')
+    p.add_argument('--step', type=float, default=50, help='cm3')
+    p.add_argument('--workers', type=int, default=1)
+    p.add_argument('--block-size', type=int, default=20, help='Vmax values fitted together')
+    p.add_argument('--output', default=os.path.join(SENSITIVITY_DIR, 'vmax_sweep.csv'), help='csv to write')
+    p.add_argument('--grid', default=None, help='csv to write the (Vmax_ov x Vmax_om) grid to')
+    p.set_defaults(func=_vmax)
+
+    p = commands.add_parser('bench', help='time the stages on synthetic data of increasing size')
+    p.add_argument('--cases', nargs='+', default=None, choices=['tvdt', 'simulate', 'analyse', 'woo', 'violins'])
+    p.add_argument('--min-exp', type=int, default=3, help='smallest size, 10^min_exp rows')
+    p.add_argument('--max-exp', type=int, default=6, help='largest size, 10^max_exp rows')
+    p.add_argument('--repeats', type=int, default=1, help='the best of repeats runs is kept')
+    p.add_argument('--threshold', type=float, default=0.2, help='relative slowdown reported as a regression')
+    p.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    p.add_argument('--output', default=os.path.join(OUTPUT_DIR, 'benchmarks'), help='folder with history.jsonl and baseline.json')
+    p.set_defaults(func=_bench)
+
+    p = commands.add_parser('scenarios', help='simulate the sensitivity analyses and other parameters with common random numbers')
+    p.add_argument('--n-tumours', type=int, default=1000000, help='tumours, the same for every scenario')
+    p.add_argument('--chunk-size', type=int, default=100000)
+    p.add_argument('--seed', type=int, default=2024)
+    p.add_argument('--workers', type=int, default=1, help='processes, the results do not depend on it')
+    p.add_argument('--sites', nargs='+', default=['ov', 'om'])
+    p.add_argument('--p-oms', type=float, nargs='*', default=[], help='other probabilities of an omental primary')
+    p.add_argument('--limits-ca', type=float, nargs='*', default=[], help='other CA125 detection limits (cm3)')
+    p.add_argument('--limits-us', type=float, nargs='*', default=[], help='other US detection limits (cm3)')
+    p.add_argument('--sensitivity', default=SENSITIVITY_DIR, help='folder with vmax_<site>.csv and measurement_10per_<site>.csv')
+    p.add_argument('--output', default=os.path.join(SIMULATIONS_DIR, 'scenarios.csv'), help='csv to write')
+    p.set_defaults(func=_scenarios)
+
+    p = commands.add_parser('trajectories', help='quantiles of the primary, metastatic and total volumes over time')
+    p.add_argument('--n-tumours', type=int, default=1000000)
+    p.add_argument('--chunk-size', type=int, default=100000)
+    p.add_argument('--seed', type=int, default=2024)
+    p.add_argument('--workers', type=int, default=1, help='processes, the results do not depend on it')
+    p.add_argument('--years', type=int, default=10, help='time since the onset of the primary')
+    p.add_argument('--n-times', type=int, default=241, help='time points')
+    p.add_argument('--sims', default=None, help='sims.csv or a column store folder to use instead of simulating')
+    p.add_argument('--output', default=os.path.join(SIMULATIONS_DIR, 'trajectories.csv'), help='csv to write')
+    p.add_argument('--model', default='gompertz',
+                   help='growth model: gompertz, exponential or logistic (needs output/<model>_params_*.csv)')
+    p.set_defaults(func=_trajectories)
+
+    p = commands.add_parser('cascades', help='simulate metastatic cascades, detected by the first lesion to reach a limit')
+    p.add_argument('--n-tumours', type=int, default=1000000, help='patients')
+    p.add_argument('--chunk-size', type=int, default=100000)
+    p.add_argument('--seed', type=int, default=2024)
+    p.add_argument('--workers', type=int, default=1, help='processes, the results do not depend on it')
+    p.add_argument('--extra-sites', nargs='*', default=['peritoneum'], help='sites besides ov and om, grown as om')
+    p.add_argument('--seeds-per-lesion', type=int, default=1)
+    p.add_argument('--max-generations', type=int, default=2, help='generation of the lesions that do not seed')
+    p.add_argument('--max-lesions', type=int, default=8, help='lesions per patient at most')
+    p.add_argument('--model', default='gompertz',
+                   help='growth model: gompertz, exponential or logistic (needs output/<model>_params_*.csv)')
+    p.add_argument('--output', default=os.path.join(SIMULATIONS_DIR, 'cascades.csv'), help='csv to write')
+    p.set_defaults(func=_cascades)
+
+    p = commands.add_parser('pipeline', help='rerun the stages of the analysis whose inputs changed')
+    p.add_argument('--workers', type=int, default=4, help='stages run at the same time')
+    p.add_argument('--force', nargs='+', default=[], help='stages to rerun even if they are up to date')
+    p.add_argument('--only', nargs='+', default=None, help='stages to bring up to date, with those they depend on')
+    p.add_argument('--dry-run', action='store_true', help='only list the stale stages')
+    p.add_argument('--n-tumours', type=int, default=10000)
+    p.add_argument('--chunk-size', type=int, default=1000000)
+    p.add_argument('--seed', type=int, default=2024)
+    p.add_argument('--sim-workers', type=int, default=1, help='processes of the simulation stage')
+    p.add_argument('--format', choices=['csv', 'npy', 'compact'], default='csv', help='output of the simulation stage')
+    p.add_argument('--model', default='gompertz', help='growth model of the simulation stage')
+    p.set_defaults(func=_pipeline)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    path = args.manifest
+    if path is None and (args.profile or args.profile_memory or args.profiler):
+        path = manifest_path(os.path.join(OUTPUT_DIR, 'manifests'), args.command)
+    options = {k: v for k, v in vars(args).items() if k != 'func'}
+    with profile_run(path, args.profile_memory, args.profiler, **options):
+        return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
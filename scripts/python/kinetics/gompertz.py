@@ -0,0 +1,55 @@
+'''
+Gompertz growth kernels.
+Both functions broadcast, so they can be called with scalars or with whole arrays of tumours.
+'''
+import numpy as np
+
+
+V0 = 1e-9 # starting volume (cm3)
+
+
+# Gompertz function
+def V(t, K, beta, V0=V0):
+    '''
+
+    Parameters
+    ----------
+    t : time
+    K : carrying capacity parameter, K = ln(Vmax/V0)
+    beta : decay rate
+    V0 : init vol (cm3)
+
+    Returns
+    -------
+    V = V0 * exp(K * (1 - exp(-beta * t))
+    '''
+    return V0 * np.exp(K * (1 - np.exp(-beta * t)))
+
+
+def log_V(t, K, beta, V0=V0):
+    '''
+    Natural log of the Gompertz function, ln(V) = ln(V0) + K * (1 - exp(-beta * t)).
+    This stays finite where V itself underflows to 0 (large negative t, e.g. a metastasis long before its onset).
+    '''
+    return np.log(V0) + K * (1 - np.exp(-beta * t))
+
+
+def get_time_to_vol_gompertz(V, beta, K, V0=V0):
+    '''
+    Assuming a Gompertz model, we estimate the time to reach a given volume, V
+
+    Parameters
+    ----------
+    V: The volume for which we want the time. (cm3)
+    beta: decay rate
+    V0: init vol (cm3)
+    K: log(Vmax/V0)
+
+    Returns
+    t : time to reach the given volume --> t = -1/beta * log[ 1 - 1/K log[V/V0]]
+    -------
+    '''
+
+    t = -1 / beta * np.log(1 - 1 / K * np.log(V / V0))
+
+    return t
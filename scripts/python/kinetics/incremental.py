@@ -0,0 +1,150 @@
+'''
+Incremental update of the per patient outputs (tvdts.csv and gompertz_params_<site>.csv) when scans are added.
+
+Every patient's scans are reduced to a content hash, kept in a JSON index next to the outputs together with the
+population parameters of the Gompertz fits. On the next run only the patients whose hash changed (or that are new
+or were removed) are recomputed: their doubling times with kinetics/tvdt.py and their individual parameters as the
+random effects given the stored population parameters (nlme.random_effects), and their rows of the output tables are
+replaced. The population parameters are only refitted by a full run (full=True), e.g. once enough patients changed.
+
+The first run without an index keeps the existing tables (e.g. the MATLAB fits committed in output/): the index is built
+from the current scans and the population parameters are taken from the individual parameters of the tables
+(population_from_params), so nothing is refitted until the scans of a patient change.
+'''
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from kinetics.io import site_data
+from kinetics.nlme import VMAX, V0, fit_gompertz, gompertz_transform, individual_params, random_effects
+from kinetics.tvdt import SITES, calculate_tvdts, group_bounds
+
+
+COLUMNS = ['anon_id', 'vol_om', 'vol_ov', 'valid_ov', 'valid_om', 'dt'] # columns of raw_volumes.csv that are hashed
+
+
+def patient_hashes(vols, columns=COLUMNS):
+    '''
+    64 bit content hash of the scans of every patient, independent of the order of the rows
+
+    Returns
+    -------
+    Series of hashes (hex strings) indexed by anon_id
+    '''
+    rows = vols[columns].astype({c: float for c in columns if c != 'anon_id'})
+    h = pd.util.hash_pandas_object(rows, index=False).values
+    order, keys, starts = group_bounds(vols['anon_id'])
+    with np.errstate(over='ignore'):
+        combined = np.add.reduceat(h[order], starts) # sum modulo 2^64
+    return pd.Series(['{:016x}'.format(x) for x in combined], index=pd.Index(keys, name='anon_id'))
+
+
+def load_index(path):
+    '''
+    The index written by save_index (hashes and population parameters), or None if there is none yet
+    '''
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        index = json.load(f)
+    index['hashes'] = pd.Series(index['hashes'], index=pd.Index(index.pop('ids'), name='anon_id'))
+    return index
+
+
+def save_index(path, hashes, population):
+    '''
+    Write the hash of every patient and the population parameters of each site (phi, PSI, errorparam, vmax) to path
+    '''
+    index = {'ids': hashes.index.tolist(), 'hashes': hashes.tolist(),
+             'population': {site: {k: np.asarray(v).tolist() for k, v in p.items()} for site, p in population.items()}}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(index, f)
+
+
+def changed_patients(hashes, previous):
+    '''
+    Patients that are new or whose scans changed, and patients that were removed, between two sets of hashes
+    '''
+    common = hashes.index.intersection(previous.index)
+    changed = hashes.index.difference(previous.index).union(common[hashes[common].values != previous[common].values])
+    removed = previous.index.difference(hashes.index)
+    return changed, removed
+
+
+def population_from_params(params, vols, site, vmax, V0=V0):
+    '''
+    Population parameters (phi, PSI, errorparam, vmax) implied by a table of individual Gompertz parameters
+    (id, beta, t1): phi and PSI are the mean and covariance of (log(beta), log(beta * t1)) over the patients, and
+    errorparam the root mean square residual of the transformed scans of those patients
+    '''
+    u = np.column_stack([np.log(params['beta'].values), np.log(params['beta'].values * params['t1'].values)])
+    ids, volumes, dt = site_data(vols[vols.anon_id.isin(params['id'])], site)
+    fitted = params.set_index('id').loc[ids]
+    residuals = gompertz_transform(volumes, vmax, V0) - fitted['beta'].values * (fitted['t1'].values + dt)
+    return {'phi': u.mean(axis=0), 'PSI': np.cov(u.T), 'errorparam': np.sqrt(np.mean(residuals ** 2)), 'vmax': vmax}
+
+
+def _patch(table, rows, key, drop):
+    '''
+    Replace the rows of the patients in drop by rows (sorted by key)
+    '''
+    table = table[~table[key].isin(drop)]
+    if rows is None:
+        return table.reset_index(drop=True)
+    return pd.concat([table, rows], ignore_index=True).sort_values(key, kind='stable').reset_index(drop=True)
+
+
+def update_outputs(vols, index=None, tvdts=None, params=None, sites=SITES, vmax=VMAX, V0=V0):
+    '''
+    Recompute the doubling times and the individual Gompertz parameters of the patients whose scans changed
+
+    Parameters
+    ----------
+    vols : all the scans, in the layout of raw_volumes.csv
+    index : the index of the previous run (load_index). Without it the previous tables are kept as they are and the
+            index is built from them (population_from_params). Without the previous tables everything is recomputed and
+            the population parameters are refitted.
+    tvdts : the previous doubling times table (as written by calculate_tvdts)
+    params : dict of the previous individual parameter tables (id, beta, t1) for each site
+    sites, vmax, V0 : disease sites and their Gompertz parameters, as in kinetics/nlme.py
+
+    Returns
+    -------
+    dict with tvdts, params (dict by site), index (new hashes and population parameters),
+    changed and removed (patient ids that were recomputed / dropped)
+    '''
+    hashes = patient_hashes(vols)
+    if tvdts is not None and params is not None and all(site in params for site in sites) and index is None:
+        population = {site: population_from_params(params[site], vols, site, vmax[site], V0) for site in sites}
+        return {'tvdts': tvdts, 'params': dict(params), 'index': {'hashes': hashes, 'population': population},
+                'changed': pd.Index([], name='anon_id'), 'removed': pd.Index([], name='anon_id')}
+    if tvdts is None or params is None or any(site not in params for site in sites):
+        population = {}
+        params = {}
+        for site in sites:
+            fit = fit_gompertz(*site_data(vols, site), vmax[site], V0)
+            population[site] = {'phi': fit['phi'], 'PSI': fit['PSI'], 'errorparam': fit['errorparam'],
+                                'vmax': vmax[site]}
+            params[site] = individual_params(fit)
+        return {'tvdts': calculate_tvdts(vols, sites), 'params': params,
+                'index': {'hashes': hashes, 'population': population},
+                'changed': hashes.index, 'removed': pd.Index([], name='anon_id')}
+
+    changed, removed = changed_patients(hashes, index['hashes'])
+    drop = changed.union(removed)
+    subset = vols[vols.anon_id.isin(changed)]
+    tvdts = _patch(tvdts, calculate_tvdts(subset, sites) if len(subset) else None, 'anon_id', drop)
+    params = dict(params)
+    for site in sites:
+        population = index['population'][site]
+        ids, volumes, dt = site_data(subset, site)
+        rows = None
+        if len(ids):
+            y = gompertz_transform(volumes, population['vmax'], V0)
+            rows = individual_params(random_effects(population, ids, y, dt))
+        params[site] = _patch(params[site], rows, 'id', drop)
+    return {'tvdts': tvdts, 'params': params, 'index': {'hashes': hashes, 'population': index['population']},
+            'changed': changed, 'removed': removed}
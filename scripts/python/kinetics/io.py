@@ -0,0 +1,97 @@
+'''
+Paths and loaders for the data and outputs of the repository.
+
+The default paths are resolved from the location of this package rather than from the working directory, so the
+scripts and the command line interface can be run from anywhere. Set HGSOC_ROOT to point them at another copy of the
+repository (when the package is installed outside of the repository they are otherwise relative to the working directory).
+'''
+import os
+
+
+def _find_root():
+    # HGSOC_ROOT if set, else the repository this package is in, else the working directory (installed elsewhere)
+    if 'HGSOC_ROOT' in os.environ:
+        return os.path.abspath(os.environ['HGSOC_ROOT'])
+    repo = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+    return repo if os.path.isdir(os.path.join(repo, 'data')) else os.getcwd()
+
+
+ROOT = _find_root()
+DATA_DIR = os.path.join(ROOT, 'data')
+OUTPUT_DIR = os.path.join(ROOT, 'output')
+PATH_TO_VOLUMES = os.path.join(DATA_DIR, 'raw_volumes.csv')
+SIMULATIONS_DIR = os.path.join(OUTPUT_DIR, 'simulations')
+SENSITIVITY_DIR = os.path.join(OUTPUT_DIR, 'sensitivity-analysis')
+
+
+def output_path(*parts, makedirs=True):
+    '''
+    Path inside the output folder, creating its parent folders if needed
+    '''
+    path = os.path.join(OUTPUT_DIR, *parts)
+    if makedirs:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def load_volumes(path_to_volumes=PATH_TO_VOLUMES):
+    '''
+    Raw volumes: one row per scan with anon_id, dt (days), vol_ov / vol_om (mm3) and the valid_ov / valid_om flags
+    '''
+    import pandas as pd
+    return pd.read_csv(path_to_volumes)
+
+
+def load_site_data(path_to_volumes, site):
+    '''
+    Load the measured volumes of the valid lesions for one disease site
+
+    Parameters
+    ----------
+    path_to_volumes : path to raw_volumes.csv
+    site : 'ov' for pelvic/ovarian disease or 'om' for omental disease
+
+    Returns
+    -------
+    ids, volumes (cm3) and dt (days) as 1D arrays with one entry per measurement
+    '''
+    return site_data(load_volumes(path_to_volumes), site)
+
+
+def site_data(vols, site):
+    '''
+    ids, volumes (cm3) and dt (days) of the valid lesions for one disease site from a table of scans (load_volumes)
+    '''
+    vols = vols[vols['valid_' + site] == 1]
+    return vols.anon_id.values, vols['vol_' + site].values * 1e-3, vols.dt.values.astype(float)
+
+
+def load_gompertz_params(site, path=None):
+    '''
+    Individual Gompertz parameters (id, beta, t1) of one site from output/gompertz_params_<site>.csv
+    '''
+    return load_growth_params('gompertz', site, path)
+
+
+def load_growth_params(model, site, path=None):
+    '''
+    Individual parameters (id, beta, t1) of one site fitted with a growth model from output/<model>_params_<site>.csv
+    (gompertz or exponential, from the MATLAB fits)
+    '''
+    import pandas as pd
+    return pd.read_csv(path or os.path.join(OUTPUT_DIR, '{}_params_{}.csv'.format(model, site)), header=0, index_col=0)
+
+
+def iter_simulations(path, chunk_size, columns=None):
+    '''
+    Chunks of simulations from sims.csv or from a column store folder (see kinetics/store.py)
+
+    Returns
+    -------
+    iterable of DataFrames (csv) or dicts of arrays (column store) with chunk_size rows
+    '''
+    if os.path.isdir(path):
+        from kinetics.store import iter_store_chunks
+        return iter_store_chunks(path, chunk_size, columns)
+    import pandas as pd
+    return pd.read_csv(path, usecols=columns, chunksize=chunk_size)
@@ -0,0 +1,119 @@
+'''
+Closed form lognormal distribution of t1.
+
+With log(beta) ~ N(fe_logbeta, var_logbeta) and log(q) ~ N(fe_logq, var_logq) independent (diagonal PSI) and q = beta * t1,
+log(t1) = log(q) - log(beta) ~ N(fe_logq - fe_logbeta, var_logq + var_logbeta).
+This replaces drawing samples of beta and q (get_stats.m) or of t1 (the Figure S2 scripts): the moments, density and
+quantiles of t1 are computed exactly, and the violins are drawn from them with matplotlib's Axes.violin.
+'''
+import numpy as np
+
+
+def logt1_moments(fe_logbeta, fe_logq, var_logbeta, var_logq):
+    '''
+    Mean and standard deviation of log(t1) from the fixed effects and the random effects variances
+    (the columns fe-logbeta, fe-logq, sd-logbeta and sd-logq of the sensitivity outputs). Broadcasts.
+    '''
+    return np.asarray(fe_logq) - np.asarray(fe_logbeta), np.sqrt(np.asarray(var_logq) + np.asarray(var_logbeta))
+
+
+def pdf(x, mu, sigma):
+    '''
+    Density of the lognormal distribution with parameters mu and sigma (of log(x)). Broadcasts.
+    '''
+    x = np.asarray(x, dtype=float)
+    with np.errstate(divide='ignore'):
+        z = (np.log(x) - mu) / sigma
+    return np.where(x > 0, np.exp(-0.5 * z ** 2) / (x * sigma * np.sqrt(2 * np.pi)), 0.)
+
+
+def quantile(q, mu, sigma):
+    '''
+    Quantile(s) q in (0, 1) of the lognormal distribution. Broadcasts.
+    '''
+    from scipy.special import ndtri # only needed here, so importing this module does not import scipy
+    return np.exp(mu + sigma * ndtri(q))
+
+
+def cdf(x, mu, sigma):
+    '''
+    Distribution function of the lognormal distribution with parameters mu and sigma. Broadcasts.
+    '''
+    from scipy.special import ndtr
+    x = np.asarray(x, dtype=float)
+    with np.errstate(divide='ignore'):
+        return np.where(x > 0, ndtr((np.log(x) - mu) / sigma), 0.)
+
+
+def mixture_quantile(q, weights, mu, sigma, n_iter=60):
+    '''
+    Quantile(s) q of mixtures of lognormal distributions, by bisection on log(x)
+
+    Parameters
+    ----------
+    q : quantile(s) in (0, 1)
+    weights, mu, sigma : weights (need not sum to 1) and parameters of the components, along the last axis.
+                         The leading axes are independent mixtures.
+
+    Returns
+    -------
+    array with the shape of the mixtures followed by that of q, nan for mixtures with no weight
+    '''
+    from scipy.special import ndtr
+    q = np.asarray(q, dtype=float)
+    weights, mu, sigma = np.broadcast_arrays(np.asarray(weights, dtype=float), mu, sigma)
+    total = weights.sum(axis=-1)
+    w = weights / np.where(total > 0, total, 1)[..., None]
+    used = w > 0
+    # Every component has almost all of its mass within 10 sigma, so the quantile is between lo and hi
+    lo = np.where(used, mu - 10 * sigma, np.inf).min(axis=-1, initial=np.inf)
+    hi = np.where(used, mu + 10 * sigma, -np.inf).max(axis=-1, initial=-np.inf)
+    lo = np.where(total > 0, lo, 0.)[..., None] + np.zeros(q.size)
+    hi = np.where(total > 0, hi, 0.)[..., None] + np.zeros(q.size)
+    for _ in range(n_iter):
+        mid = (lo + hi) / 2
+        F = np.sum(w[..., None, :] * ndtr((mid[..., None] - mu[..., None, :]) / sigma[..., None, :]), axis=-1)
+        below = F < q.ravel()
+        lo, hi = np.where(below, mid, lo), np.where(below, hi, mid)
+    x = np.where((total > 0)[..., None], np.exp((lo + hi) / 2), np.nan)
+    return x.reshape(total.shape + q.shape)
+
+
+def violin_stats(mu, sigma, scale=1., points=500, tail=1e-4, quantiles=None):
+    '''
+    Statistics of lognormal violins in the format of matplotlib.cbook.violin_stats, for Axes.violin
+
+    Parameters
+    ----------
+    mu, sigma : parameters of log(t1), one per violin
+    scale : factor applied to t1, e.g. 12 / 365 to go from days to months
+    points : number of points the density is evaluated at
+    tail : probability left out at each end, so the violins span the quantiles tail to 1 - tail
+    quantiles : optional quantiles to mark on every violin, e.g. [0.25, 0.75]
+
+    Returns
+    -------
+    list of dicts with coords, vals, mean, median, min, max and quantiles
+    '''
+    mu = np.atleast_1d(mu) + np.log(scale) # scaling a lognormal variable shifts mu
+    sigma = np.broadcast_to(sigma, mu.shape)
+    stats = []
+    for m, s in zip(mu, sigma):
+        lo, hi = quantile([tail, 1 - tail], m, s)
+        coords = np.linspace(lo, hi, points)
+        stats.append({'coords': coords, 'vals': pdf(coords, m, s), 'mean': np.exp(m + s ** 2 / 2),
+                      'median': np.exp(m), 'min': lo, 'max': hi,
+                      'quantiles': quantile(np.asarray(quantiles if quantiles is not None else [], dtype=float), m, s)})
+    return stats
+
+
+def violinplot(ax, mu, sigma, positions=None, scale=1., points=500, quantiles=None, showmedians=True,
+               showextrema=False, **kwargs):
+    '''
+    Draw one lognormal violin per (mu, sigma) on ax from the closed form density,
+    instead of a KDE of samples as in Axes.violinplot. kwargs are passed on to Axes.violin.
+    '''
+    stats = violin_stats(mu, sigma, scale=scale, points=points, quantiles=quantiles)
+    if positions is None:
+        positions = np.arange(1, len(stats) + 1)
+    return ax.violin(stats, positions=positions, showmedians=showmedians, showextrema=showextrema, **kwargs)
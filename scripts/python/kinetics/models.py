@@ -0,0 +1,169 @@
+'''
+Registry of the growth models the population can be simulated with.
+
+Every model is written in terms of K = ln(Vmax/V0) and of a rate beta whose log is normal over the population (as
+in the NLME fits, where the parameters are log transformed). A model provides whole-array kernels for
+    V(t, K, beta, V0) : volume at time t since the onset (cm3)
+    log_V(t, K, beta, V0) : its natural log, finite where V underflows to 0
+    time_to_volume(V, beta, K, V0) : time to reach the volume V (days)
+    invariant(V, K, V0) : beta * time_to_volume, which does not depend on the tumour (used by kinetics/thresholds.py)
+and draws the rates of a batch of tumours with sample_rates. The callers look the model up once per batch
+(get_model) and evaluate its kernels over the arrays of the batch, so the cost of a run does not depend on the model.
+
+    gompertz    : V = V0 * exp(K * (1 - exp(-beta * t)))            the model of the paper (kinetics/gompertz.py)
+    exponential : V = V0 * exp(beta * t)                            fit_exponential.m, Vmax is not used
+    logistic    : V = Vmax / (1 + (Vmax/V0 - 1) * exp(-beta * t))  no fits in the repository yet
+
+Under the exponential model the sizes are unbounded: the sizes of the metastasis at detection of the primary
+(met_size_at_ca125, met_size_at_US) can overflow to inf, which is not an error.
+
+Other models are added with register_model. population_params and model_kwargs give the simulation parameters of a
+model from its individual fits (output/<model>_params_<site>.csv).
+'''
+import numpy as np
+
+from kinetics import gompertz
+from kinetics.gompertz import V0
+
+
+class GrowthModel:
+    '''
+    Growth model with vectorised kernels, see the module docstring for their signatures
+
+    Parameters
+    ----------
+    name : name of the model in the registry, also the prefix of its fits (<name>_params_<site>.csv)
+    V, log_V, time_to_volume, invariant : the kernels
+    '''
+    def __init__(self, name, V, log_V, time_to_volume, invariant):
+        self.name = name
+        self.V = V
+        self.log_V = log_V
+        self.time_to_volume = time_to_volume
+        self.invariant = invariant
+
+    def sample_rates(self, rng, ln_mean, ln_std, n):
+        '''
+        Rates of n tumours, lognormal with the (arrays of) mean and std of log(beta)
+        '''
+        return np.exp(ln_mean + ln_std * rng.standard_normal(n))
+
+    def __repr__(self):
+        return 'GrowthModel({!r})'.format(self.name)
+
+
+MODELS = {} # name: GrowthModel
+
+
+def register_model(model):
+    '''
+    Add a GrowthModel to the registry (replacing a model with the same name) and return it
+    '''
+    MODELS[model.name] = model
+    return model
+
+
+def get_model(model='gompertz'):
+    '''
+    GrowthModel registered under a name (a GrowthModel is returned as it is)
+    '''
+    if isinstance(model, GrowthModel):
+        return model
+    if model not in MODELS:
+        raise ValueError('Unknown growth model {!r}, the registered models are {}'.format(model, ', '.join(MODELS)))
+    return MODELS[model]
+
+
+def _gompertz_invariant(V, K, V0=V0):
+    # -ln(1 - ln(V/V0)/K). Volumes that are never reached (V >= Vmax) get inf.
+    x = np.log(np.asarray(V, dtype=float) / V0) / K
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(x < 1, -np.log(1 - x), np.inf)
+
+
+def _exponential_V(t, K, beta, V0=V0):
+    with np.errstate(over='ignore'): # unbounded, large t gives inf
+        return V0 * np.exp(beta * t)
+
+
+def _exponential_log_V(t, K, beta, V0=V0):
+    return np.log(V0) + beta * t
+
+
+def _exponential_invariant(V, K, V0=V0):
+    # Does not depend on K, but has the shape of the other invariants (e.g. limits x sites)
+    return np.log(np.asarray(V, dtype=float) / V0) + np.zeros(np.shape(K))
+
+
+def _exponential_time_to_volume(V, beta, K, V0=V0):
+    return np.log(np.asarray(V, dtype=float) / V0) / beta
+
+
+def _logistic_log_V(t, K, beta, V0=V0):
+    # ln(Vmax) - ln(1 + (Vmax/V0 - 1) * exp(-beta * t)) with Vmax = V0 * exp(K), written with logaddexp so that
+    # it stays finite for large negative t
+    return np.log(V0) + K - np.logaddexp(0, np.log(np.expm1(K)) - beta * t)
+
+
+def _logistic_V(t, K, beta, V0=V0):
+    return np.exp(_logistic_log_V(t, K, beta, V0))
+
+
+def _logistic_invariant(V, K, V0=V0):
+    # ln((Vmax/V0 - 1) / (Vmax/V - 1)). Volumes that are never reached (V >= Vmax) get inf.
+    x = np.log(np.asarray(V, dtype=float) / V0) - K # ln(V/Vmax) < 0 below Vmax
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(x < 0, np.log(np.expm1(K)) - np.log(np.expm1(-x)), np.inf)
+
+
+def _logistic_time_to_volume(V, beta, K, V0=V0):
+    return _logistic_invariant(V, K, V0) / beta
+
+
+register_model(GrowthModel('gompertz', gompertz.V, gompertz.log_V, gompertz.get_time_to_vol_gompertz, _gompertz_invariant))
+register_model(GrowthModel('exponential', _exponential_V, _exponential_log_V, _exponential_time_to_volume,
+                           _exponential_invariant))
+register_model(GrowthModel('logistic', _logistic_V, _logistic_log_V, _logistic_time_to_volume, _logistic_invariant))
+
+
+def population_params(model, site, vmax=None, path=None):
+    '''
+    Simulation parameters of one site (a dict with 'vmax', 'ln_beta_mean' and 'ln_beta_std', as ovarian_params in
+    kinetics/simulation.py) from the individual fits of a model, output/<model>_params_<site>.csv. The mean and
+    std of log(beta) are taken over the patients; for the Gompertz fits the mean is the NLME fixed effect.
+
+    vmax : max volume (cm3), the one of kinetics/simulation.py for the site if None
+    '''
+    from kinetics.io import load_growth_params
+    from kinetics.simulation import ovarian_params, omental_params
+
+    ln_beta = np.log(load_growth_params(get_model(model).name, site, path)['beta'].values)
+    if vmax is None:
+        vmax = {'ov': ovarian_params, 'om': omental_params}[site]['vmax']
+    return {'vmax': vmax, 'ln_beta_mean': ln_beta.mean(), 'ln_beta_std': ln_beta.std(ddof=1)}
+
+
+def model_kwargs(model='gompertz'):
+    '''
+    kwargs of simulate_tumours (and simulate_chunks) to simulate the population under a model. The Gompertz model keeps
+    the parameters of kinetics/simulation.py; the other models get the population parameters of their fits and the
+    sizes of the primary at metastasis of the patients with both sites under the model (kinetics.woo.sizes_at_met).
+    A ValueError is raised for a model without fits (e.g. logistic, which only has kernels).
+    '''
+    import os
+    from kinetics.io import OUTPUT_DIR
+
+    name = get_model(model).name
+    if name == 'gompertz':
+        return {'model': name}
+    fits = [os.path.join(OUTPUT_DIR, '{}_params_{}.csv'.format(name, site)) for site in ('ov', 'om')]
+    missing = [path for path in fits if not os.path.exists(path)]
+    if missing:
+        raise ValueError('The {} model has kernels but no fits to simulate it with: {} not found'.format(
+            name, ', '.join(missing)))
+    from kinetics.io import load_growth_params
+    from kinetics.woo import sizes_at_met
+    ov, om = population_params(name, 'ov'), population_params(name, 'om')
+    sizes = sizes_at_met(load_growth_params(name, 'ov'), load_growth_params(name, 'om'), vmax_ov=ov['vmax'],
+                         vmax_om=om['vmax'], model=name)
+    return {'model': name, 'ovarian_params': ov, 'omental_params': om, 'sizes': sizes}
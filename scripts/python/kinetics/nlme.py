@@ -0,0 +1,413 @@
+'''
+Batched nonlinear mixed effects (NLME) fitter for the transformed Gompertz and exponential models.
+This is the Python counterpart of scripts/MATLAB/utils/fit_gompertz.m and fit_exponential.m.
+
+Both growth models are transformed so that the observations are linear in dt
+    y = phi(2) + phi(1) * dt
+where, as with 'ParamTransform' [1, 1] in nlmefit, the parameters are log transformed and every patient has
+a random effect on both of them
+    y_ij = exp(phi(2) + b_i(2)) + exp(phi(1) + b_i(1)) * dt_ij + e_ij,   b_i ~ N(0, PSI),   e_ij ~ N(0, sigma^2)
+For the Gompertz model phi(1) = log(beta) and phi(2) = log(q) with q = beta * t1,
+for the exponential model phi(1) = log(mu) and phi(2) = log(mu * t1).
+
+The fit uses the linearised (Lindstrom-Bates) approximation as in nlmefit: the random effects are estimated by
+penalised least squares, the model is linearised around them and the resulting linear mixed effects model is
+fitted by maximum likelihood (damped Newton steps on the variance parameters). Every step works on whole arrays of
+(datasets x patients x observations), so thousands of datasets (e.g. noise realisations or Vmax values) sharing
+the same patients and time points are fitted in one call.
+'''
+import numpy as np
+import pandas as pd
+
+from kinetics.io import load_site_data # the loader lives in kinetics/io.py, it is kept importable from here
+
+
+V0 = 1e-9 # starting volume (cm3)
+
+# Max volumes used for each disease site and the starting guesses for the fixed effects, as in the MATLAB scripts
+VMAX = {'ov': 5000, 'om': 3000}
+PHI0_GOMPERTZ = np.log([0.005, 0.005 * 500]) # beta is around 0.005 and t1 is around 500 days
+PHI0_EXPONENTIAL = np.log([0.02, 0.02 * 500]) # mu is around 0.02 and t1 is around 500 days
+
+
+def gompertz_transform(volumes, vmax, V0=V0):
+    '''
+    y = -ln(1 - omega/K) where omega = ln(V/V0) and K = ln(Vmax/V0). Broadcasts over volumes and vmax.
+    '''
+    omega = np.log(np.asarray(volumes) / V0)
+    K = np.log(np.asarray(vmax) / V0)
+    return -np.log(1 - omega / K)
+
+
+def exponential_transform(volumes, V0=V0):
+    '''
+    y = ln(V/V0)
+    '''
+    return np.log(np.asarray(volumes) / V0)
+
+
+def _pack(ids, values):
+    '''
+    Group per-measurement values by patient into a padded (..., patients, max measurements) array
+    '''
+    patients, inverse, counts = np.unique(ids, return_inverse=True, return_counts=True)
+    order = np.argsort(inverse, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    col = np.arange(len(ids)) - np.repeat(starts, counts)
+    packed = np.zeros(values.shape[:-1] + (len(patients), counts.max()))
+    packed[..., inverse[order], col] = values[..., order]
+    mask = np.zeros((len(patients), counts.max()), dtype=bool)
+    mask[inverse[order], col] = True
+    return patients, packed, mask
+
+
+def _model(u, dt):
+    '''
+    Model and its Jacobian with respect to the log parameters u = (log slope, log intercept)
+    '''
+    slope, intercept = np.exp(u[..., 0:1]), np.exp(u[..., 1:2])
+    f = intercept + slope * dt
+    J = np.stack([slope * dt, np.broadcast_to(intercept, f.shape)], axis=-1)
+    return f, J
+
+
+def _pnls(phi, b, PSI_inv, sigma2, Y, T, m, n_iter):
+    '''
+    Penalised nonlinear least squares for the random effects b given phi, PSI^-1 and sigma^2 (Gauss-Newton steps)
+    '''
+    for _ in range(n_iter):
+        f, J = _model(phi[:, None, :] + b, T)
+        J = J * m[..., None]
+        r = m * (Y - f)
+        lhs = np.einsum('dpni,dpnj->dpij', J, J) + sigma2[:, None, None, None] * PSI_inv
+        rhs = np.einsum('dpni,dpn->dpi', J, r) - sigma2[:, None, None] * np.einsum('dpij,dpj->dpi', PSI_inv, b)
+        b = b + np.linalg.solve(lhs, rhs[..., None])[..., 0]
+    return b
+
+
+def _individual_start(phi, b, Y, T, m, scale, pnls_iter, full_cov, theta_min):
+    '''
+    Starting values from individual fits started at phi + b: phi and PSI from the mean and variance of the
+    individual parameters and sigma^2 from their residuals
+
+    Returns
+    -------
+    phi, b and theta
+    '''
+    u = phi[:, None, :] + _pnls(phi, b, np.eye(2)[None, None], 1e-8 * scale, Y, T, m, pnls_iter)
+    phi = u.mean(axis=1)
+    b = u - phi[:, None, :]
+    f, _ = _model(u, T)
+    sigma2 = np.maximum(np.sum(m * (Y - f) ** 2, axis=(1, 2)) / m.sum(), 1e-6 * scale)
+    PSI = np.maximum(b.var(axis=1), 1e-16)[..., None] * np.eye(2)
+    return phi, b, _to_theta(PSI, sigma2, full_cov, theta_min)
+
+
+def _to_theta(PSI, sigma2, full_cov, theta_min):
+    '''
+    Unconstrained parameters theta = (log L11, log L22, [L21], log sigma^2) from PSI and sigma^2, within theta_min
+    '''
+    L = np.linalg.cholesky(PSI + 1e-300 * np.eye(2))
+    theta = np.zeros(theta_min.shape)
+    theta[:, 0], theta[:, 1] = np.log(L[:, 0, 0]), np.log(L[:, 1, 1])
+    if full_cov:
+        theta[:, 2] = L[:, 1, 0]
+    theta[:, -1] = np.log(sigma2)
+    return np.maximum(theta, theta_min)
+
+
+def _laplace_objective(phi, b, PSI, sigma2, Y, T, m):
+    '''
+    -2 log likelihood (up to a constant) of the nonlinear model by the Laplace approximation
+    at the penalised least squares estimates b of the random effects
+    '''
+    f, J = _model(phi[:, None, :] + b, T)
+    J = J * m[..., None]
+    n = m.sum(axis=1)
+    PSI_inv = np.linalg.inv(PSI)
+    rss = np.sum(m * (Y - f) ** 2, axis=2)
+    # log|J'J / sigma^2 + PSI^-1| written so that it stays finite as sigma^2 goes to 0
+    logdet = np.linalg.slogdet(np.einsum('dpni,dpnj->dpij', J, J) + sigma2[:, None, None, None] * PSI_inv[:, None])[1]
+    per_patient = ((n - 2) * np.log(sigma2)[:, None] + rss / sigma2[:, None]
+                   + np.einsum('dpi,dij,dpj->dp', b, PSI_inv, b) + logdet)
+    return per_patient.sum(axis=1) + b.shape[1] * np.linalg.slogdet(PSI)[1]
+
+
+def _covariances(theta, full_cov):
+    '''
+    PSI and sigma^2 from the unconstrained parameters theta = (log L11, log L22, [L21], log sigma^2),
+    where L is the Cholesky factor of PSI
+    '''
+    L = np.zeros(theta.shape[:-1] + (2, 2))
+    L[..., 0, 0] = np.exp(theta[..., 0])
+    L[..., 1, 1] = np.exp(theta[..., 1])
+    if full_cov:
+        L[..., 1, 0] = theta[..., 2]
+    return L @ np.swapaxes(L, -1, -2), np.exp(theta[..., -1])
+
+
+def _lme_objective(theta, Z, w, m, full_cov):
+    '''
+    -2 log likelihood (up to a constant) of the linear mixed effects model w_i = Z_i (phi + b_i) + e_i,
+    with phi profiled out by generalised least squares. The marginal covariance of each patient
+    V_i = Z_i PSI Z_i' + sigma^2 I is formed explicitly, which stays well conditioned as sigma^2 goes to 0.
+
+    Returns
+    -------
+    objective (n_datasets,), phi (n_datasets, 2), GLS information matrix (n_datasets, 2, 2)
+    and V^-1 (w - Z phi) (n_datasets, n_patients, n_max) for the random effects
+    '''
+    PSI, sigma2 = _covariances(theta, full_cov)
+    n = m.shape[-1]
+    V = np.einsum('dpni,dij,dpkj->dpnk', Z, PSI, Z)
+    # Padded measurements get unit variance and zero residual so they do not contribute
+    V = V + np.eye(n) * (sigma2[:, None, None] * m + (1 - m))[..., None, :]
+    solved = np.linalg.solve(V, np.concatenate([Z, w[..., None]], axis=-1))
+    VZ, Vw = solved[..., :2], solved[..., 2]
+    info = np.einsum('dpni,dpnj->dij', Z, VZ)
+    phi = np.linalg.solve(info, np.einsum('dpni,dpn->di', Z, Vw)[..., None])[..., 0]
+    Vr = Vw - np.einsum('dpni,di->dpn', VZ, phi)
+    r = w - np.einsum('dpni,di->dpn', Z, phi)
+    objective = np.linalg.slogdet(V)[1].sum(axis=1) + np.einsum('dpn,dpn->d', r, Vr)
+    return objective, phi, info, Vr
+
+
+def _minimise_lme(theta, Z, w, m, full_cov, theta_min, max_iter=100, h=1e-4, tol=1e-8, max_step=2.):
+    '''
+    Damped Newton minimisation of _lme_objective over theta for all datasets at once.
+    The datasets are independent, so the finite difference gradient and Hessian of every dataset
+    are obtained from the same batched evaluations. Datasets drop out of the batch once they have converged.
+    '''
+    theta = np.maximum(theta, theta_min)
+    k = theta.shape[1]
+    eye = np.eye(k)
+    damping = np.full(theta.shape[0], 1e-3)
+    f0 = _lme_objective(theta, Z, w, m, full_cov)[0]
+    active = np.arange(theta.shape[0])
+    for _ in range(max_iter):
+        a = active
+        t, lo = theta[a], theta_min[a]
+
+        def objective(x):
+            return _lme_objective(np.maximum(x, lo), Z[a], w[a], m, full_cov)[0]
+
+        plus = [objective(t + h * eye[i]) for i in range(k)]
+        minus = [objective(t - h * eye[i]) for i in range(k)]
+        grad = np.stack([(p - q) / (2 * h) for p, q in zip(plus, minus)], axis=1)
+        hess = np.empty(t.shape + (k,))
+        for i in range(k):
+            hess[:, i, i] = (plus[i] - 2 * f0[a] + minus[i]) / h ** 2
+            for j in range(i):
+                hess[:, i, j] = hess[:, j, i] = (objective(t + h * (eye[i] + eye[j])) - plus[i] - plus[j] + f0[a]) / h ** 2
+        # Shift the Hessian to be positive definite and take a damped Newton step of bounded size
+        finite = np.isfinite(grad).all(axis=1) & np.isfinite(hess).all(axis=(1, 2))
+        grad = np.where(finite[:, None], grad, 0)
+        hess = np.where(finite[:, None, None], hess, eye)
+        eig = np.linalg.eigvalsh(hess)
+        shift = np.maximum(0, -eig[:, 0]) + damping[a] * (1 + np.abs(eig).max(axis=1))
+        step = -np.linalg.solve(hess + shift[:, None, None] * eye, grad[..., None])[..., 0]
+        step = step * np.minimum(1, max_step / np.abs(step).max(axis=1, keepdims=True).clip(1e-300))
+        candidate = np.maximum(t + step, lo)
+        f1 = objective(candidate)
+        better = f1 < f0[a]
+        # A dataset has converged once its improvement is below tol, or a failed step has been damped to nothing
+        converged = np.where(better, f0[a] - f1 < tol * (1 + np.abs(f0[a])), damping[a] >= 1e10)
+        theta[a] = np.where(better[:, None], candidate, t)
+        f0[a] = np.where(better, f1, f0[a])
+        damping[a] = np.clip(np.where(better, damping[a] / 10, damping[a] * 10), 1e-10, 1e12)
+        active = a[~converged]
+        if active.size == 0:
+            break
+    return theta
+
+
+def fit_nlme(dt, y, ids, phi0=PHI0_GOMPERTZ, start=None, full_cov=False, max_iter=100, tol=1e-4, pnls_iter=10):
+    '''
+    Fit the transformed model to one or many datasets at once.
+
+    Parameters
+    ----------
+    dt : time interval between volume measurements (days), one per measurement
+    y : transformed observations, either one dataset (n_measurements,) or a batch (n_datasets, n_measurements)
+        sharing the same ids and dt
+    ids : patient id of each measurement
+    phi0 : starting guess for the log transformed fixed effects, used to find the individual fits that the
+           fixed effects and PSI start from
+    start : a previous fit (dict with phi, PSI, br and errorparam, batched or not) to warm start from instead
+    full_cov : whether the random effects have a full (True) or diagonal (False) covariance matrix
+    max_iter : maximum number of linearisation steps
+    tol : convergence tolerance on the change in phi and PSI between linearisation steps
+    pnls_iter : Gauss-Newton steps for the random effects at each linearisation
+
+    Returns
+    -------
+    dict with (a leading n_datasets axis when y is 2D)
+        phi : (2,) fixed effects of log(slope) and log(intercept)
+        PSI : (2, 2) covariance matrix of the random effects
+        sebeta : (2,) standard errors of phi
+        br : (2, n_patients) random effects of each patient, in the order of 'ids'
+        rmse : root mean square error of the residuals
+        errorparam : estimated standard deviation of the residuals, sigma
+        n_iter : number of linearisation steps taken
+        ids : (n_patients,) patient ids (no leading axis)
+    '''
+    y = np.asarray(y, dtype=float)
+    single = y.ndim == 1
+    y = np.atleast_2d(y)
+    D = y.shape[0]
+    patients, Y, mask = _pack(np.asarray(ids), y)
+    _, T, _ = _pack(np.asarray(ids), np.asarray(dt, dtype=float))
+    m = mask.astype(float)
+    n_obs = mask.sum()
+    P = len(patients)
+
+    scale = np.sum(m * Y ** 2, axis=(1, 2)) / n_obs
+    # sigma^2 is bounded below relative to the scale of the data; with as many measurements as random effects
+    # per patient the maximum likelihood estimate is often on that boundary (an exact fit to every patient)
+    theta_min = np.full((D, 4 if full_cov else 3), -np.inf)
+    theta_min[:, :2] = np.log(1e-8) # random effects standard deviations of at least 1e-8
+    theta_min[:, -1] = np.log(1e-24 * scale)
+    if start is None:
+        # Starting values from individual fits: the random effects are first estimated with a negligible penalty,
+        # then phi and PSI start from the mean and variance of the individual parameters
+        phi = np.broadcast_to(np.asarray(phi0, dtype=float), (D, 2)).copy()
+        phi, b, theta = _individual_start(phi, np.zeros((D, P, 2)), Y, T, m, scale, pnls_iter, full_cov, theta_min)
+    else:
+        # Warm start from a previous fit (e.g. at a neighbouring Vmax). The individual fits, started from its
+        # random effects, remain a candidate for the best iterate as in a cold start.
+        phi = np.broadcast_to(np.asarray(start['phi'], dtype=float), (D, 2)).copy()
+        b = np.broadcast_to(np.swapaxes(np.asarray(start['br'], dtype=float), -1, -2), (D, P, 2)).copy()
+        individual = _individual_start(phi, b, Y, T, m, scale, pnls_iter, full_cov, theta_min)
+        theta = _to_theta(np.broadcast_to(np.asarray(start['PSI'], dtype=float), (D, 2, 2)),
+                          np.broadcast_to(np.asarray(start['errorparam'], dtype=float) ** 2, (D,)), full_cov, theta_min)
+
+    n_iter = np.zeros(D, dtype=int)
+    converged = np.zeros(D, dtype=bool)
+    best = np.full(D, np.inf)
+    best_phi, best_theta, best_b = phi.copy(), theta.copy(), b.copy()
+    if start is not None:
+        best_phi, best_b, best_theta = individual
+        best = _laplace_objective(best_phi, best_b, *_covariances(best_theta, full_cov), Y, T, m)
+    stalled = np.zeros(D, dtype=int)
+    active = np.arange(D)
+    for it in range(max_iter + 1):
+        # Only the datasets that have not converged yet are updated
+        a = active
+        Ya = Y[a]
+        PSI, sigma2 = _covariances(theta[a], full_cov)
+
+        # 1. Penalised nonlinear least squares for the random effects
+        b[a] = _pnls(phi[a], b[a], np.linalg.inv(PSI)[:, None], sigma2, Ya, T, m, pnls_iter)
+
+        # The linearisation steps can fall into a two-cycle (e.g. between an exact fit to every patient and a
+        # shrunken fit with a larger sigma), so the iterate with the best Laplace approximation of the likelihood
+        # is kept and a dataset stops once that has not improved for a few steps. A warm start is a fit to other
+        # data, so it is not a candidate itself.
+        objective = _laplace_objective(phi[a], b[a], PSI, sigma2, Ya, T, m)
+        candidate = it > 0 or start is None
+        improved = candidate & (objective < best[a] - tol * (1 + np.abs(objective)))
+        keep = candidate & (objective < best[a])
+        best[a] = np.where(keep, objective, best[a])
+        best_phi[a] = np.where(keep[:, None], phi[a], best_phi[a])
+        best_theta[a] = np.where(keep[:, None], theta[a], best_theta[a])
+        best_b[a] = np.where(keep[:, None, None], b[a], best_b[a])
+        stalled[a] = np.where(improved, 0, stalled[a] + 1)
+        active = a = a[(stalled[a] < 5) & ~converged[a]]
+        if it == max_iter or a.size == 0:
+            break
+        Ya = Y[a]
+        PSI, _ = _covariances(theta[a], full_cov)
+
+        # 2. Linearise the model around the current estimates: w = Z (phi + b) + e
+        u = phi[a][:, None, :] + b[a]
+        f, Z = _model(u, T)
+        Z = Z * m[..., None]
+        w = m * (Ya - f) + np.einsum('dpni,dpi->dpn', Z, u)
+
+        # 3. Maximum likelihood of the linear mixed effects model, then the random effects given phi
+        theta[a] = _minimise_lme(theta[a], Z, w, m, full_cov, theta_min[a])
+        _, phi_new, _, Vr = _lme_objective(theta[a], Z, w, m, full_cov)
+        PSI_new, _ = _covariances(theta[a], full_cov)
+        b[a] = np.einsum('dij,dpnj,dpn->dpi', PSI_new, Z, Vr)
+
+        change = np.maximum(np.abs(phi_new - phi[a]).max(axis=1), np.abs(PSI_new - PSI).max(axis=(1, 2)))
+        phi[a] = phi_new
+        n_iter[a] = it + 1
+        converged[a] = change < tol * (1 + np.abs(phi_new).max(axis=1))
+
+    phi, theta, b = best_phi, best_theta, best_b
+    PSI, sigma2 = _covariances(theta, full_cov)
+
+    # Standard errors of the fixed effects from the GLS information matrix of the model linearised at the estimates
+    u = phi[:, None, :] + b
+    f, Z = _model(u, T)
+    Z = Z * m[..., None]
+    info = _lme_objective(theta, Z, m * (Y - f) + np.einsum('dpni,dpi->dpn', Z, u), m, full_cov)[2]
+    sebeta = np.sqrt(np.diagonal(np.linalg.inv(info), axis1=1, axis2=2))
+    rmse = np.sqrt(np.sum(m * (Y - f) ** 2, axis=(1, 2)) / n_obs)
+
+    results = {'phi': phi, 'PSI': PSI, 'sebeta': sebeta, 'br': np.swapaxes(b, 1, 2), 'rmse': rmse,
+               'errorparam': np.sqrt(sigma2), 'n_iter': n_iter}
+    if single:
+        results = {k: v[0] for k, v in results.items()}
+    results['ids'] = patients
+    return results
+
+
+def fit_gompertz(ids, volumes, dt, vmax, V0=V0, **kwargs):
+    '''
+    Fit the transformed Gompertz model -ln(1 - omega/K) = ln(q) + beta * dt, as in fit_gompertz.m.
+    volumes may be (n_measurements,) or (n_datasets, n_measurements), and vmax a scalar or one per dataset.
+    kwargs are passed on to fit_nlme.
+    '''
+    vmax = np.asarray(vmax, dtype=float)
+    if vmax.ndim == 1:
+        vmax = vmax[:, None]
+    y = gompertz_transform(volumes, vmax, V0)
+    kwargs.setdefault('phi0', PHI0_GOMPERTZ)
+    return fit_nlme(dt, y, ids, **kwargs)
+
+
+def fit_exponential(ids, volumes, dt, V0=V0, **kwargs):
+    '''
+    Fit the transformed exponential model ln(V/V0) = mu * t1 + mu * dt, as in fit_exponential.m.
+    kwargs are passed on to fit_nlme.
+    '''
+    kwargs.setdefault('phi0', PHI0_EXPONENTIAL)
+    return fit_nlme(dt, exponential_transform(volumes, V0), ids, **kwargs)
+
+
+def random_effects(fit, ids, y, dt, pnls_iter=20):
+    '''
+    Random effects of patients given the population parameters (phi, PSI and errorparam) of a single fit, e.g. for
+    patients whose measurements changed since the fit, without refitting the population. y are the transformed
+    observations (gompertz_transform or exponential_transform) and dt the times, one per measurement.
+
+    Returns
+    -------
+    dict with phi, br (2, n_patients) and ids, as accepted by individual_params
+    '''
+    patients, Y, mask = _pack(np.asarray(ids), np.asarray(y, dtype=float)[None])
+    _, T, _ = _pack(np.asarray(ids), np.asarray(dt, dtype=float))
+    phi = np.asarray(fit['phi'], dtype=float)[None]
+    PSI_inv = np.linalg.inv(np.asarray(fit['PSI'], dtype=float))[None, None]
+    sigma2 = np.atleast_1d(np.asarray(fit['errorparam'], dtype=float) ** 2)
+    b = _pnls(phi, np.zeros((1, len(patients), 2)), PSI_inv, sigma2, Y, T, mask.astype(float), pnls_iter)
+    return {'phi': phi[0], 'br': b[0].T, 'ids': patients}
+
+
+def individual_params(fit):
+    '''
+    Individual parameters of each patient in the layout of gompertz_params_*.csv / exponential_params_*.csv
+        beta = exp(phi(1) + br(1,:)),  t1 = exp(phi(2) + br(2,:)) / beta
+
+    Returns
+    -------
+    DataFrame with columns id, beta and t1 for a single fit, or a list of them for a batch
+    '''
+    phi, br = np.asarray(fit['phi']), np.asarray(fit['br'])
+    if phi.ndim == 2:
+        return [individual_params(dict(fit, phi=p, br=r)) for p, r in zip(phi, br)]
+    beta = np.exp(phi[0] + br[0])
+    t1 = np.exp(phi[1] + br[1]) / beta
+    return pd.DataFrame({'id': fit['ids'], 'beta': beta, 't1': t1})
@@ -0,0 +1,416 @@
+'''
+Runner for the whole analysis: the numbered scripts and the figures as a graph of stages, rerun only when stale.
+
+Every stage declares the files it reads (inputs), the files or folders it writes (outputs), its code and its parameters.
+The stages are ordered by their files: a stage that reads an output of another one runs after it, and the stages that do
+not depend on each other (e.g. the simulation and figure_2, figure_S1 and figure_S2) run concurrently on worker processes.
+
+A stage is keyed by the content hash (sha256) of its inputs and code and by its parameters. The code of a stage is its
+script or function and every module of kinetics/ it imports, found by following the imports of the source
+(code_dependencies), so an edit to any module a stage runs makes it stale. Its key and the hashes of its
+outputs are kept in output/pipeline/state.json, and a stage whose key did not change and whose outputs are still there
+and unchanged is skipped. As the keys are computed from the inputs when a stage is about to run, a stage whose inputs
+were rewritten with the same content (e.g. a simulation rerun with the same seed) is skipped as well.
+
+The Gompertz parameters (gompertz_params_<site>.csv) and the sensitivity tables in output/sensitivity-analysis come
+from the MATLAB fits. They are inputs of the graph, so the figures that use them are redrawn when they are refitted.
+'''
+import ast
+import hashlib
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import redirect_stdout
+
+from kinetics.io import ROOT, PATH_TO_VOLUMES, OUTPUT_DIR, SIMULATIONS_DIR, SENSITIVITY_DIR
+
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLOT_DIR = os.path.join(SCRIPTS_DIR, 'plot')
+PIPELINE_DIR = os.path.join(OUTPUT_DIR, 'pipeline') # state.json and the logs of the stages
+
+
+def _module(name):
+    return os.path.join(SCRIPTS_DIR, 'kinetics', name + '.py')
+
+
+def _imports(nodes):
+    # (module, names) of the kinetics modules imported in nodes, names is None when the whole module is needed
+    found = []
+    for node in nodes:
+        for n in ast.walk(node):
+            if isinstance(n, ast.Import):
+                found += [(a.name.split('.')[1], None) for a in n.names if a.name.startswith('kinetics.')]
+            elif isinstance(n, ast.ImportFrom) and n.module == 'kinetics':
+                found += [(a.name, None) for a in n.names] # from kinetics import profiling (or a re-export)
+            elif isinstance(n, ast.ImportFrom) and n.module and n.module.startswith('kinetics.'):
+                found.append((n.module.split('.')[1], [a.name for a in n.names]))
+    return found
+
+
+def _used_defs(path, names):
+    # Top level statements of a module and the functions / classes in names, with the ones they refer to
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    defs = {node.name: node for node in tree.body
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))}
+    nodes = [node for node in tree.body if node not in defs.values()]
+    todo = list(defs) if names is None else [name for name in names if name in defs]
+    seen = set()
+    while todo:
+        name = todo.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        todo += [n.id for n in ast.walk(defs[name]) if isinstance(n, ast.Name) and n.id in defs]
+    # The names the top level statements refer to (e.g. the kernels registered in models.py)
+    top = {n.id for node in nodes for n in ast.walk(node) if isinstance(n, ast.Name) and n.id in defs} - seen
+    for name in top:
+        seen.add(name)
+        seen.update(n.id for n in ast.walk(defs[name]) if isinstance(n, ast.Name) and n.id in defs)
+    return nodes + [defs[name] for name in seen]
+
+
+def code_dependencies(path, names=None):
+    '''
+    Source files a script or the functions names of a module run: the file itself, kinetics/__init__.py and the
+    modules of kinetics/ it imports (also inside functions), followed through their imports. An import of some names
+    of a module only follows what those names and the top level of the module use.
+
+    Returns
+    -------
+    sorted list of paths
+    '''
+    files, todo, seen = {os.path.abspath(path), _module('__init__')}, [(os.path.abspath(path), names)], set()
+    while todo:
+        path, names = todo.pop()
+        key = (path, None if names is None else tuple(sorted(names)))
+        if key in seen:
+            continue
+        seen.add(key)
+        for module, imported in _imports(_used_defs(path, names)):
+            if os.path.exists(_module(module)):
+                files.add(_module(module))
+                todo.append((_module(module), imported))
+    return sorted(files)
+
+
+def default_stages(n_tumours=10000, chunk_size=1000000, seed=2024, workers=1, output_format='csv',
+                   analysis_chunk_size=1000000, model='gompertz'):
+    '''
+    The stages of the analysis, from the raw volumes and the MATLAB outputs to the figures
+
+    Parameters
+    ----------
+    n_tumours, chunk_size, seed, workers, output_format, model : the settings of II_simulate_population.py
+    analysis_chunk_size : the CHUNK_SIZE of III_analyse_simulation_results.py
+
+    Returns
+    -------
+    dict of name: stage, a dict with
+        target : a script (run as python <script> in its folder) or a function (module.function, called with kwargs)
+        kwargs : arguments of the function
+        params : other parameters the outputs depend on (part of the key)
+        inputs, outputs : files (or folders) read and written
+        code : source files of the stage (part of the key)
+    '''
+    from kinetics import simulation
+    from kinetics.models import get_model
+
+    tvdts = os.path.join(OUTPUT_DIR, 'tvdts.csv')
+    params = [os.path.join(OUTPUT_DIR, 'gompertz_params_{}.csv'.format(site)) for site in ('ov', 'om')]
+    sims = os.path.join(SIMULATIONS_DIR, 'sims.csv' if output_format == 'csv' else 'sims')
+    plots, suppmat = os.path.join(OUTPUT_DIR, 'plots'), os.path.join(OUTPUT_DIR, 'plots', 'suppmat')
+    simulation_params = {name: getattr(simulation, name) for name in ('V0', 'LIMIT_US', 'LIMIT_CA', 'ovarian_params',
+                                                                      'omental_params', 'pt_size_at_met', 'p_om')}
+    model = get_model(model).name
+    # The other models are simulated with the parameters of their fits (kinetics.models.model_kwargs)
+    fits = [] if model == 'gompertz' else [os.path.join(OUTPUT_DIR, '{}_params_{}.csv'.format(model, site))
+                                           for site in ('ov', 'om')]
+
+    def figure(script, inputs, outputs):
+        return {'target': os.path.join(PLOT_DIR, script), 'inputs': inputs, 'outputs': outputs}
+
+    stages = {
+        'tvdt': {'target': 'kinetics.stages.calculate_tvdts',
+                 'kwargs': {'path_to_volumes': PATH_TO_VOLUMES, 'path_for_output': tvdts},
+                 'inputs': [PATH_TO_VOLUMES], 'outputs': [tvdts]},
+        'simulate': {'target': 'kinetics.stages.simulate_population',
+                     'kwargs': {'path_for_output': SIMULATIONS_DIR, 'n_tumours': n_tumours, 'chunk_size': chunk_size,
+                                'seed': seed, 'workers': workers, 'output_format': output_format, 'model': model},
+                     'params': simulation_params, 'inputs': fits, 'outputs': [sims]},
+        'analyse': {'target': 'kinetics.pipeline.write_woo_report',
+                    'kwargs': {'sims': sims, 'chunk_size': analysis_chunk_size,
+                               'path_for_output': os.path.join(SIMULATIONS_DIR, 'woo_report.txt')},
+                    'inputs': [sims], 'outputs': [os.path.join(SIMULATIONS_DIR, 'woo_report.txt')]},
+        'figure_2': figure('figure_2.py', [PATH_TO_VOLUMES, tvdts],
+                           [os.path.join(plots, 'figure_2_a.png'), os.path.join(plots, 'figure_2_b.png')]),
+        'figure_3': figure('figure_3.py', [PATH_TO_VOLUMES] + params, [os.path.join(plots, 'figure-3')]),
+        'figure_S1': figure('figure_S1.py', [PATH_TO_VOLUMES],
+                            [os.path.join(suppmat, 'figure_S1_a.png'), os.path.join(suppmat, 'figure_S1_b.png')]),
+        'figure_S2_a_b': figure('figure_S2_a_b.py',
+                                [os.path.join(SENSITIVITY_DIR, 'measurement_10per_{}.csv'.format(s)) for s in ('ov', 'om')],
+                                [os.path.join(suppmat, 'figure_S2_{}.png'.format(s)) for s in ('a', 'b')]),
+        'figure_S2_c_d': figure('figure_S2_c_d.py',
+                                [os.path.join(SENSITIVITY_DIR, 'vmax_{}.csv'.format(s)) for s in ('ov', 'om')],
+                                [os.path.join(suppmat, 'figure_S2_{}.png'.format(s)) for s in ('c', 'd')]),
+    }
+    for stage in stages.values():
+        target = stage['target']
+        if target.endswith('.py'):
+            stage['code'] = code_dependencies(target)
+        else:
+            module, function = target.rsplit('.', 1)
+            stage['code'] = code_dependencies(_module(module.split('.')[-1]), [function])
+    return stages
+
+
+def write_woo_report(sims, chunk_size, path_for_output):
+    '''
+    The statistics of III_analyse_simulation_results.py, written to a text file
+    '''
+    from kinetics.stages import analyse_simulations, woo_report
+    report = woo_report(analyse_simulations(sims, chunk_size))
+    with open(path_for_output, 'w') as f:
+        f.write(report + '\n')
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def content_hash(path, cache=None):
+    '''
+    sha256 of a file, or of the names and hashes of the files in a folder, None if it does not exist.
+    cache : dict of path: [size, mtime_ns, hash] so that only the files that changed since the last run are read
+    '''
+    if os.path.isdir(path):
+        h = hashlib.sha256()
+        for folder, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file = os.path.join(folder, name)
+                h.update('{}\0{}\0'.format(os.path.relpath(file, path), content_hash(file, cache)).encode())
+        return h.hexdigest()
+    if not os.path.exists(path):
+        return None
+    if cache is None:
+        return _sha256(path)
+    stat = os.stat(path)
+    known = cache.get(path)
+    if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return known[2]
+    digest = _sha256(path)
+    cache[path] = [stat.st_size, stat.st_mtime_ns, digest]
+    return digest
+
+
+def _jsonable(x):
+    # numpy scalars and arrays in the parameters
+    if hasattr(x, 'tolist'):
+        return x.tolist()
+    return str(x)
+
+
+def stage_key(stage, cache=None, root=ROOT):
+    '''
+    Hash of the target, arguments, parameters and of the content of the inputs and the code of a stage
+    '''
+    def hashes(paths):
+        return {os.path.relpath(p, root): content_hash(p, cache) for p in paths}
+
+    target = stage['target']
+    if target.endswith('.py'):
+        target = os.path.relpath(target, root)
+    spec = {'target': target,
+            'kwargs': {k: os.path.relpath(v, root) if isinstance(v, str) and os.path.isabs(v) else v
+                       for k, v in stage.get('kwargs', {}).items()},
+            'params': stage.get('params', {}), 'inputs': hashes(stage['inputs']), 'code': hashes(stage.get('code', []))}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=_jsonable).encode()).hexdigest()
+
+
+def dependencies(stages):
+    '''
+    The stages each stage depends on: those that write one of its inputs
+    '''
+    producers = {path: name for name, stage in stages.items() for path in stage['outputs']}
+    return {name: sorted({producers[p] for p in stage['inputs'] if p in producers and producers[p] != name})
+            for name, stage in stages.items()}
+
+
+def _upstream(names, deps):
+    # names and every stage they depend on
+    selected, todo = set(), list(names)
+    while todo:
+        name = todo.pop()
+        if name not in selected:
+            selected.add(name)
+            todo.extend(deps[name])
+    return selected
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {'stages': {}, 'files': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(path, state):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(path + '.tmp', path) # an interrupted run never leaves a partial state
+
+
+def _is_fresh(name, stage, key, state, cache, root):
+    record = state['stages'].get(name)
+    if record is None or record['key'] != key:
+        return False
+    for path in stage['outputs']:
+        digest = content_hash(path, cache)
+        if digest is None or record['outputs'].get(os.path.relpath(path, root)) != digest:
+            return False
+    return True
+
+
+def _run_stage(args):
+    '''
+    Run one stage, with its output sent to its log (top level so that it can be sent to worker processes)
+    '''
+    target, kwargs, log, root = args
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(log), exist_ok=True)
+    with open(log, 'w') as f:
+        if target.endswith('.py'):
+            # Scripts resolve their paths from HGSOC_ROOT and import kinetics from scripts/python
+            env = dict(os.environ, HGSOC_ROOT=root, MPLBACKEND='Agg',
+                       PYTHONPATH=os.pathsep.join([SCRIPTS_DIR] + os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+            returncode = subprocess.run([sys.executable, target], cwd=os.path.dirname(target), env=env, stdout=f,
+                                        stderr=subprocess.STDOUT).returncode
+            if returncode != 0:
+                raise RuntimeError('{} exited with status {}, see {}'.format(os.path.basename(target), returncode, log))
+        else:
+            module, function = target.rsplit('.', 1)
+            with redirect_stdout(f):
+                getattr(importlib.import_module(module), function)(**kwargs)
+    return time.perf_counter() - start
+
+
+def plan(stages=None, state_path=os.path.join(PIPELINE_DIR, 'state.json'), force=(), root=ROOT):
+    '''
+    Which stages would run: those that are stale (or forced) and those downstream of them
+
+    Returns
+    -------
+    dict of name: 'fresh', 'stale' or 'missing inputs', in the order the stages would run
+    '''
+    stages = default_stages() if stages is None else stages
+    deps = dependencies(stages)
+    state = load_state(state_path)
+    cache = state.get('files', {})
+    status = {}
+    while len(status) < len(stages):
+        for name in stages:
+            if name in status or any(d not in status for d in deps[name]):
+                continue
+            stage = stages[name]
+            upstream = [status[d] for d in deps[name]]
+            if any(s != 'fresh' for s in upstream):
+                status[name] = 'stale'
+            elif any(not os.path.exists(p) for p in stage['inputs']):
+                status[name] = 'missing inputs'
+            elif name in force or not _is_fresh(name, stage, stage_key(stage, cache, root), state, cache, root):
+                status[name] = 'stale'
+            else:
+                status[name] = 'fresh'
+    return status
+
+
+def run_pipeline(stages=None, workers=4, state_path=os.path.join(PIPELINE_DIR, 'state.json'), force=(), only=None,
+                 root=ROOT, verbose=True):
+    '''
+    Run the stale stages, as soon as the stages they depend on are done, on up to workers processes
+
+    Parameters
+    ----------
+    stages : dict of stages (default_stages())
+    workers : number of stages run at the same time
+    state_path : json file with the keys and output hashes of the last runs
+    force : names of stages to rerun even if they are fresh
+    only : names of the stages to bring up to date (with the stages they depend on), all of them if None
+
+    Returns
+    -------
+    dict of name: 'skipped', 'ran', 'failed' (with the error) or 'blocked' (a stage it depends on failed)
+    '''
+    stages = default_stages() if stages is None else stages
+    deps = dependencies(stages)
+    if only is not None:
+        selected = _upstream(only, deps)
+        stages = {name: stage for name, stage in stages.items() if name in selected}
+    state = load_state(state_path)
+    cache = state.setdefault('files', {})
+    log_dir = os.path.join(os.path.dirname(os.path.abspath(state_path)), 'logs')
+
+    def report(name, message):
+        if verbose:
+            print('{:>14} {}'.format(name, message))
+
+    status, running = {}, {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while len(status) < len(stages):
+            progress = len(status)
+            for name, stage in stages.items():
+                if name in status or name in running.values() or any(d not in status for d in deps[name]):
+                    continue
+                if any(status[d] not in ('skipped', 'ran') for d in deps[name]):
+                    status[name] = 'blocked'
+                    report(name, 'blocked')
+                    continue
+                missing = [p for p in stage['inputs'] if not os.path.exists(p)]
+                if missing:
+                    status[name] = 'failed: missing ' + ', '.join(os.path.relpath(p, root) for p in missing)
+                    report(name, status[name])
+                    continue
+                key = stage_key(stage, cache, root)
+                if name not in force and _is_fresh(name, stage, key, state, cache, root):
+                    status[name] = 'skipped'
+                    report(name, 'up to date')
+                    continue
+                report(name, 'running')
+                future = executor.submit(_run_stage, (stage['target'], stage.get('kwargs', {}),
+                                                      os.path.join(log_dir, name + '.log'), root))
+                future.key = key
+                running[future] = name
+            if not running:
+                if len(status) == progress:
+                    raise ValueError('the stages {} depend on each other'.format(sorted(set(stages) - set(status))))
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                stage = stages[name]
+                try:
+                    wall = future.result()
+                except Exception as e:
+                    status[name] = 'failed: {}'.format(e)
+                    report(name, status[name])
+                    continue
+                status[name] = 'ran'
+                report(name, 'done in {:.1f} s'.format(wall))
+                state['stages'][name] = {'key': future.key, 'wall': wall, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                                         'outputs': {os.path.relpath(p, root): content_hash(p, cache)
+                                                     for p in stage['outputs']}}
+                save_state(state_path, state)
+    save_state(state_path, state)
+    return status
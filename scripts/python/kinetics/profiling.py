@@ -0,0 +1,303 @@
+'''
+Instrumentation of the pipeline stages: timers, allocation tracking and a JSON manifest of every run.
+
+The stages mark their steps with
+    with profiling.stage('write', rows=n):
+        ...
+and the chunks they stream with profiling.iterate('read', chunks), which times the production of each chunk. Nothing is
+recorded unless a run is being profiled (profile_run with a path, PROFILE = True in the scripts or python -m kinetics
+--manifest PATH): stage then returns a shared object that does nothing and iterate returns the chunks unchanged.
+
+A profiled run writes a manifest with, for every step (named by its path, e.g. simulate/draws), the number of calls, the
+wall and CPU time (and the time not spent in nested steps), the rows processed and, with memory=True, the peak and net
+allocations traced by tracemalloc, together with the parameters and seeds of the run and the environment. The whole run
+can also be profiled by cProfile or by a sampling profiler (pyinstrument, if installed), saved next to the manifest.
+'''
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+_ACTIVE = None # Profiler of the run being profiled, if any
+
+
+class _NullStage:
+    '''
+    What stage returns when no run is profiled
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add_rows(self, n):
+        pass
+
+
+_NULL = _NullStage()
+
+
+def stage(name, rows=None):
+    '''
+    Context manager timing a step of the current run (a no-op when no run is profiled).
+    rows : number of rows processed, or add them with add_rows on the object returned
+    '''
+    if _ACTIVE is None:
+        return _NULL
+    return _ACTIVE.stage(name, rows)
+
+
+def iterate(name, iterable, rows=None):
+    '''
+    Time the production of every item of iterable (e.g. reading or simulating chunks) as the step name.
+    rows : function giving the number of rows of an item. Returns iterable itself when no run is profiled.
+    '''
+    if _ACTIVE is None:
+        return iterable
+    return _ACTIVE.iterate(name, iterable, rows)
+
+
+def annotate(**params):
+    '''
+    Record parameters (sizes, seeds, formats...) in the manifest of the current run
+    '''
+    if _ACTIVE is not None:
+        _ACTIVE.params.update(params)
+
+
+def chunk_rows(chunk):
+    '''
+    Number of rows of a chunk of simulations (dict of arrays or DataFrame)
+    '''
+    return len(next(iter(chunk.values()))) if isinstance(chunk, dict) else len(chunk)
+
+
+class _Stage:
+    def __init__(self, profiler, name, rows):
+        self.profiler = profiler
+        self.name = name
+        self.rows = rows or 0
+        self.children = 0. # wall time of the nested steps
+        self.peak_seen = 0 # largest traced memory of the nested steps
+
+    def add_rows(self, n):
+        self.rows += int(n)
+
+    def __enter__(self):
+        profiler = self.profiler
+        parent = profiler.stack[-1] if profiler.stack else None
+        self.path = self.name if parent is None else parent.path + '/' + self.name
+        profiler.stack.append(self)
+        if profiler.memory:
+            import tracemalloc
+            # The peak is reset for this step, so the one of the enclosing step is carried over by hand
+            current, peak = tracemalloc.get_traced_memory()
+            if parent is not None:
+                parent.peak_seen = max(parent.peak_seen, peak)
+            tracemalloc.reset_peak()
+            self.memory_start = current
+        self.cpu_start = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu_start
+        profiler = self.profiler
+        profiler.stack.pop()
+        parent = profiler.stack[-1] if profiler.stack else None
+        if parent is not None:
+            parent.children += wall
+
+        record = profiler.stages.get(self.path)
+        if record is None:
+            record = profiler.stages[self.path] = {'calls': 0, 'wall': 0., 'self_wall': 0., 'cpu': 0., 'rows': 0}
+        record['calls'] += 1
+        record['wall'] += wall
+        record['self_wall'] += wall - self.children
+        record['cpu'] += cpu
+        record['rows'] += self.rows
+        if profiler.memory:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, self.peak_seen)
+            if parent is not None:
+                parent.peak_seen = max(parent.peak_seen, peak)
+            record['alloc_peak_mb'] = max(record.get('alloc_peak_mb', 0.), (peak - self.memory_start) / 2 ** 20)
+            record['alloc_net_mb'] = record.get('alloc_net_mb', 0.) + (current - self.memory_start) / 2 ** 20
+        return False
+
+
+class Profiler:
+    '''
+    Timings (and allocations, with memory=True) of the steps of a run, by path of nested step names
+
+    Parameters
+    ----------
+    memory : trace the allocations of every step with tracemalloc (slows the allocations down)
+    sampler : None, 'cprofile' or 'pyinstrument' to also profile the whole run
+    '''
+    def __init__(self, memory=False, sampler=None):
+        if sampler not in (None, 'cprofile', 'pyinstrument'):
+            raise ValueError('sampler should be None, cprofile or pyinstrument, not {!r}'.format(sampler))
+        self.memory = memory
+        self.sampler = sampler
+        self.stages = {} # path: totals, in the order the steps first ran
+        self.stack = []
+        self.params = {}
+        self._sampler = None
+
+    def stage(self, name, rows=None):
+        return _Stage(self, name, rows)
+
+    def iterate(self, name, iterable, rows=None):
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name) as s:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                if rows is not None:
+                    s.add_rows(rows(item))
+            yield item
+
+    def start(self):
+        self.started = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.start_time, self.cpu_start = time.perf_counter(), time.process_time()
+        if self.memory:
+            import tracemalloc
+            tracemalloc.start()
+        if self.sampler == 'cprofile':
+            import cProfile
+            self._sampler = cProfile.Profile()
+            self._sampler.enable()
+        elif self.sampler == 'pyinstrument':
+            from pyinstrument import Profiler as Sampler
+            self._sampler = Sampler()
+            self._sampler.start()
+
+    def stop(self):
+        if self.sampler == 'cprofile':
+            self._sampler.disable()
+        elif self.sampler == 'pyinstrument':
+            self._sampler.stop()
+        self.wall = time.perf_counter() - self.start_time
+        self.cpu = time.process_time() - self.cpu_start
+        if self.memory:
+            import tracemalloc
+            self.traced_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def save_sampler(self, path):
+        '''
+        Write the profile of the sampler: cProfile stats (.prof, for pstats or snakeviz) or the pyinstrument report (.txt)
+        '''
+        if self.sampler == 'cprofile':
+            path = os.path.splitext(path)[0] + '.prof'
+            self._sampler.dump_stats(path)
+        elif self.sampler == 'pyinstrument':
+            path = os.path.splitext(path)[0] + '.txt'
+            with open(path, 'w') as f:
+                f.write(self._sampler.output_text())
+        else:
+            return None
+        return path
+
+    def manifest(self):
+        '''
+        Summary of the run: environment, parameters and the totals of every step
+        '''
+        stages = []
+        for path, record in self.stages.items():
+            stages.append(dict(record, stage=path,
+                               rows_per_s=record['rows'] / record['wall'] if record['rows'] and record['wall'] > 0 else None))
+        manifest = dict(environment(), started=self.started, wall=self.wall, cpu=self.cpu, peak_rss_mb=peak_rss_mb(),
+                        argv=sys.argv, params=self.params, stages=stages)
+        if self.memory:
+            manifest['traced_peak_mb'] = self.traced_peak / 2 ** 20
+        return manifest
+
+
+def git_commit():
+    '''
+    Short hash of the checked out commit of the repository, or None outside of a git checkout
+    '''
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    '''
+    Commit, host and versions of python and of the libraries that were imported
+    '''
+    env = {'commit': git_commit(), 'host': platform.node(), 'python': platform.python_version()}
+    for module in ('numpy', 'pandas', 'scipy'):
+        if module in sys.modules:
+            env[module] = sys.modules[module].__version__
+    return env
+
+
+def peak_rss_mb():
+    '''
+    Peak resident memory of this process (MB)
+    '''
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10 # bytes on macOS, kB on Linux
+
+
+def manifest_path(directory, name):
+    '''
+    Path of a new manifest of name in directory, stamped with the time
+    '''
+    return os.path.join(directory, '{}-{}.json'.format(name, time.strftime('%Y%m%dT%H%M%S')))
+
+
+def _jsonable(x):
+    # numpy scalars and arrays, paths and anything else json does not know
+    if hasattr(x, 'tolist'):
+        return x.tolist()
+    return str(x)
+
+
+@contextmanager
+def profile_run(path, memory=False, sampler=None, **params):
+    '''
+    Profile everything run in the with block and write its manifest to path. With path None nothing is profiled.
+
+    Parameters
+    ----------
+    path : JSON file to write the manifest to (see manifest_path), or None
+    memory, sampler : see Profiler
+    params : parameters of the run to record (the stages record their own sizes and seeds)
+
+    Yields
+    ------
+    the Profiler, or None
+    '''
+    global _ACTIVE
+    if path is None:
+        yield None
+        return
+    profiler = Profiler(memory, sampler)
+    profiler.params.update(params)
+    previous, _ACTIVE = _ACTIVE, profiler
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        _ACTIVE = previous
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        manifest = profiler.manifest()
+        manifest['sampler_output'] = profiler.save_sampler(path)
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=1, default=_jsonable)
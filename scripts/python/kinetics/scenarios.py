@@ -0,0 +1,234 @@
+'''
+Simulation of a grid of scenarios (parameter sets) with common random numbers.
+
+Every tumour is drawn once: a uniform variate for the primary site, the index of its size at metastasis and a standard
+normal variate for log(beta_pt), in the order simulate_tumours draws them. Each scenario maps the same variates through
+its own parameters (primary omental if u <= p_om, beta_pt = exp(ln_beta_mean + ln_beta_std * z), K = ln(vmax / V0), its
+detection limits) as a (scenarios x tumours) array, so all the scenarios are evaluated in one pass over the chunks and
+the random numbers are drawn once instead of once per scenario.
+
+With the same tumours in every scenario, the difference between a scenario and the baseline (the first scenario) only
+reflects the parameters. The differences are taken tumour by tumour (paired): for the fraction detected before
+metastasis from the tumours whose detection changed, and for the mean WOO from the tumours detected before metastasis
+in both, so their standard errors are much smaller than with independent runs. The baseline scenario is the tumours of
+simulate_chunks with the same seed and chunk size.
+'''
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from kinetics.aggregate import DAYS_TO_MONTHS, Moments, QuantileSketch
+from kinetics.gompertz import get_time_to_vol_gompertz
+from kinetics.simulation import V0, LIMIT_CA, LIMIT_US, ovarian_params, omental_params, pt_size_at_met, p_om
+
+
+PARAMS = ['ln_beta_mean_ov', 'ln_beta_std_ov', 'vmax_ov', 'ln_beta_mean_om', 'ln_beta_std_om', 'vmax_om', 'p_om',
+          'limit_ca125', 'limit_US'] # parameters of a scenario
+DETECTIONS = ['ca125', 'US'] # named as the time_to_<name> columns of sims.csv
+QUANTILES = [0.25, 0.5, 0.75]
+
+
+def baseline_scenario(ovarian_params=ovarian_params, omental_params=omental_params, p_om=p_om, limit_ca=LIMIT_CA,
+                      limit_us=LIMIT_US):
+    '''
+    The parameters of kinetics/simulation.py as a scenario
+    '''
+    return {'ln_beta_mean_ov': ovarian_params['ln_beta_mean'], 'ln_beta_std_ov': ovarian_params['ln_beta_std'],
+            'vmax_ov': ovarian_params['vmax'], 'ln_beta_mean_om': omental_params['ln_beta_mean'],
+            'ln_beta_std_om': omental_params['ln_beta_std'], 'vmax_om': omental_params['vmax'], 'p_om': p_om,
+            'limit_ca125': limit_ca, 'limit_US': limit_us}
+
+
+def scenario_grid(vmax_tables=None, measurement_tables=None, p_oms=(), limits_ca=(), limits_us=(), baseline=None):
+    '''
+    The baseline and one scenario per alternative parameter value, the other parameters staying at the baseline
+
+    Parameters
+    ----------
+    vmax_tables, measurement_tables : dicts of site: sensitivity table (vmax_<site>.csv, measurement_10per_<site>.csv).
+        Every row gives the mean and variance of log(beta) of the site (fe-logbeta, sd-logbeta). The rows of the vmax
+        tables are for the values in their vmax column, or on the 2000-10000 cm3 grid of the MATLAB outputs
+        (as in figure_S2_c_d.py)
+    p_oms, limits_ca, limits_us : other values of p_om and of the CA125 and US detection limits (cm3)
+    baseline : the baseline scenario (baseline_scenario())
+
+    Returns
+    -------
+    DataFrame with one row per scenario, the baseline first: source, site and row (where it comes from) and PARAMS
+    '''
+    baseline = baseline_scenario() if baseline is None else baseline
+    rows = [dict(baseline, source='baseline', site='', row=-1)]
+    for source, tables in [('vmax', vmax_tables), ('measurement', measurement_tables)]:
+        for site, df in (tables or {}).items():
+            if source == 'vmax':
+                vmaxs = df['vmax'].values if 'vmax' in df else np.linspace(2000, 10000, len(df))
+            else:
+                vmaxs = np.full(len(df), baseline['vmax_' + site])
+            for i, (mean, var, vmax) in enumerate(zip(df['fe-logbeta'], df['sd-logbeta'], vmaxs)):
+                # sd-logbeta is the variance of log(beta), as the ln_beta_std of kinetics/simulation.py notes
+                rows.append(dict(baseline, source=source, site=site, row=i, **{'ln_beta_mean_' + site: mean,
+                                 'ln_beta_std_' + site: np.sqrt(var), 'vmax_' + site: vmax}))
+    for source, name, values in [('p_om', 'p_om', p_oms), ('limit', 'limit_ca125', limits_ca),
+                                 ('limit', 'limit_US', limits_us)]:
+        for i, value in enumerate(values):
+            rows.append(dict(baseline, source=source, site='', row=i, **{name: value}))
+    return pd.DataFrame(rows, columns=['source', 'site', 'row'] + PARAMS)
+
+
+def common_draws(n, rng, n_sizes):
+    '''
+    The variates shared by all the scenarios, drawn as simulate_tumours draws them: uniform (primary site), index of the
+    size at metastasis and standard normal (log(beta_pt))
+    '''
+    return rng.uniform(size=n), rng.integers(0, n_sizes, size=n), rng.standard_normal(n)
+
+
+class ScenarioSweep:
+    '''
+    For every scenario and detection limit: how many tumours reach the limit before metastasis (and how many more or
+    fewer than in the baseline, the first scenario) and the moments and quantiles of their WOO (months)
+
+    Parameters
+    ----------
+    scenarios : DataFrame with the columns in PARAMS (scenario_grid)
+    sizes : sizes of the primary at the onset of metastasis to draw from (cm3)
+    max_elements : maximum size of the (scenarios x tumours) arrays, the chunks are split into blocks to stay below it
+    sketch_kwargs : passed on to QuantileSketch
+    '''
+    def __init__(self, scenarios, sizes=pt_size_at_met, V0=V0, max_elements=5 * 10 ** 6, **sketch_kwargs):
+        self.scenarios = scenarios.reset_index(drop=True)
+        self.sizes = np.asarray(sizes, dtype=float)
+        self.V0 = V0
+        self.max_elements = max_elements
+        self.params = {name: self.scenarios[name].values.astype(float)[:, None] for name in PARAMS}
+        shape = (len(self.scenarios), len(DETECTIONS))
+        self.n_total = 0
+        self.n_before_met = np.zeros(shape, dtype=np.int64)
+        self.n_gained = np.zeros(shape, dtype=np.int64) # detected before metastasis only in the scenario
+        self.n_lost = np.zeros(shape, dtype=np.int64) # detected before metastasis only in the baseline
+        self.moments = Moments(shape=shape)
+        self.woo_diff = Moments(shape=shape) # WOO in the scenario - WOO in the baseline, tumours detected in both
+        self.sketch = QuantileSketch(shape=shape, **sketch_kwargs)
+
+    def update(self, u, size_ix, z):
+        '''
+        Add a chunk of tumours given by their common variates (common_draws)
+        '''
+        p = self.params
+        K_ov, K_om = np.log(p['vmax_ov'] / self.V0), np.log(p['vmax_om'] / self.V0)
+        limits = np.stack([p['limit_' + name] for name in DETECTIONS], axis=1) # (scenarios x detections x 1)
+        step = max(1, self.max_elements // len(self.scenarios))
+        for start in range(0, len(z), step):
+            s = slice(start, start + step)
+            # The same tumours through every scenario: (scenarios x tumours)
+            omental = u[s] <= p['p_om']
+            mean = np.where(omental, p['ln_beta_mean_om'], p['ln_beta_mean_ov'])
+            std = np.where(omental, p['ln_beta_std_om'], p['ln_beta_std_ov'])
+            beta_pt = np.exp(mean + std * z[s])
+            K = np.where(omental, K_om, K_ov)
+            time_to_met = get_time_to_vol_gompertz(self.sizes[size_ix[s]], beta_pt, K, self.V0)
+
+            # (scenarios x detections x tumours)
+            time_to_detect = get_time_to_vol_gompertz(limits, beta_pt[:, None], K[:, None], self.V0)
+            b4_mets = time_to_met[:, None] > time_to_detect
+            woo = (time_to_met[:, None] - time_to_detect) * DAYS_TO_MONTHS
+            self.n_before_met += b4_mets.sum(axis=-1)
+            self.n_gained += (b4_mets & ~b4_mets[:1]).sum(axis=-1)
+            self.n_lost += (~b4_mets & b4_mets[:1]).sum(axis=-1)
+            self.moments.update(woo, b4_mets)
+            self.woo_diff.update(woo - woo[:1], b4_mets & b4_mets[:1])
+            self.sketch.update(woo, b4_mets)
+        self.n_total += len(z)
+        return self
+
+    def merge(self, other):
+        '''
+        Combine with a sweep over the same scenarios filled from another part of the population
+        '''
+        if not self.scenarios[PARAMS].equals(other.scenarios[PARAMS]):
+            raise ValueError('Only sweeps over the same scenarios can be merged')
+        self.n_total += other.n_total
+        self.n_before_met += other.n_before_met
+        self.n_gained += other.n_gained
+        self.n_lost += other.n_lost
+        self.moments.merge(other.moments)
+        self.woo_diff.merge(other.woo_diff)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def summary(self):
+        '''
+        The scenarios with, for each detection limit, the fraction detected before metastasis and the mean, std and
+        quartiles of the WOO (months), and the differences of the fraction and of the mean WOO from the baseline with
+        their paired standard errors (and the ones independent runs would have)
+        '''
+        n = max(self.n_total, 1)
+        df = self.scenarios.copy()
+        fraction = self.n_before_met / n
+        diff = (self.n_gained - self.n_lost) / n
+        # Paired: variance of the per tumour differences (-1, 0 or 1)
+        se_paired = np.sqrt(np.maximum((self.n_gained + self.n_lost) / n - diff ** 2, 0) / n)
+        se_independent = np.sqrt((fraction * (1 - fraction) + fraction[:1] * (1 - fraction[:1])) / n)
+        m, d = self.moments, self.woo_diff
+        se_woo_paired = d.std / np.sqrt(np.maximum(d.count, 1))
+        se_woo_independent = np.sqrt(m.std ** 2 / np.maximum(m.count, 1) + m.std[:1] ** 2 / np.maximum(m.count[:1], 1))
+        quantiles = self.sketch.quantile(QUANTILES)
+        seen = m.count > 0
+        for j, name in enumerate(DETECTIONS):
+            df['fraction_before_met_' + name] = fraction[:, j]
+            df['diff_fraction_' + name] = diff[:, j]
+            df['se_diff_' + name] = se_paired[:, j]
+            df['se_diff_independent_' + name] = se_independent[:, j]
+            df['woo_mean_' + name] = np.where(seen[:, j], m.mean[:, j], np.nan)
+            df['woo_std_' + name] = m.std[:, j]
+            for k, q in enumerate(QUANTILES):
+                df['woo_q{:g}_{}'.format(100 * q, name)] = quantiles[:, j, k]
+            df['diff_woo_mean_' + name] = np.where(d.count[:, j] > 0, d.mean[:, j], np.nan)
+            df['se_diff_woo_mean_' + name] = se_woo_paired[:, j]
+            df['se_diff_woo_mean_independent_' + name] = se_woo_independent[:, j]
+        return df
+
+
+def _run_chunk(args):
+    '''
+    Draw one chunk of tumours with its own generator and run it through every scenario (top level for the workers)
+    '''
+    n, seed_seq, scenarios, kwargs = args
+    sweep = ScenarioSweep(scenarios, **kwargs)
+    return sweep.update(*common_draws(n, np.random.default_rng(seed_seq), len(sweep.sizes)))
+
+
+def simulate_scenarios(scenarios, n, chunk_size=1000000, seed=None, workers=1, **kwargs):
+    '''
+    Simulate n tumours through every scenario with common random numbers
+
+    Parameters
+    ----------
+    scenarios : DataFrame of scenarios (scenario_grid), the baseline first
+    n : number of tumours
+    chunk_size : number of tumours per chunk. Each chunk gets its own generator spawned from the seed, as in
+                 simulate_chunks, so the baseline scenario is the population II_simulate_population.py simulates.
+    seed : master seed
+    workers : number of worker processes. The results do not depend on it.
+    kwargs : passed on to ScenarioSweep
+
+    Returns
+    -------
+    ScenarioSweep
+    '''
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    starts = range(0, n, chunk_size)
+    shards = [(min(chunk_size, n - start), child, scenarios, kwargs)
+              for start, child in zip(starts, seed_seq.spawn(len(starts)))]
+
+    # The chunks are merged in order, so the moments are the same whatever the number of workers
+    sweep = ScenarioSweep(scenarios, **kwargs)
+    if workers <= 1:
+        for shard in shards:
+            sweep.merge(_run_chunk(shard))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for part in executor.map(_run_chunk, shards):
+                sweep.merge(part)
+    return sweep
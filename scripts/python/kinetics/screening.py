@@ -0,0 +1,149 @@
+'''
+Periodic screening schedules for the simulated population.
+
+A schedule screens every 'interval' months from 'start' months after the onset of the primary, with a modality that
+detects the primary from a volume 'limit' (cm3). The onset of a tumour is not aligned with the screening calendar,
+so the screens fall at start + phase + k * interval with a phase uniform over [0, interval).
+
+A tumour is detectable before metastasis in the window [max(start, t_detect), t_met), with t_detect = c(limit) / beta_pt
+as in kinetics/thresholds.py, c being the invariant of the growth model the population was simulated with.
+No time stepping is needed:
+- the first screen at or after the start of the window is found with a ceil, and the tumour is detected before
+  metastasis if it falls before t_met. The WOO left at detection is t_met minus the time of that screen.
+- averaged over the phase, the probability of a screen inside the window is min(1, window / interval).
+Everything is evaluated on (schedules x tumours) arrays, in blocks over the tumours of each chunk.
+'''
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from kinetics.aggregate import DAYS_TO_MONTHS, Moments, QuantileSketch
+from kinetics.simulation import ovarian_params, omental_params
+from kinetics.thresholds import detection_invariant
+
+
+def make_schedules(intervals, starts=(0,), limits=(0.5,)):
+    '''
+    DataFrame with one schedule per combination of interval (months), start (months after onset) and limit (cm3)
+    '''
+    return pd.DataFrame(list(itertools.product(intervals, starts, limits)), columns=['interval', 'start', 'limit'])
+
+
+def first_screen_after(t, interval, phase):
+    '''
+    Time of the first screen at or after t for screens at phase + k * interval, k >= 0
+    '''
+    return phase + np.maximum(np.ceil((t - phase) / interval), 0) * interval
+
+
+def detection_probability(window_start, window_end, interval):
+    '''
+    Probability that a screen every interval falls in [window_start, window_end) for a phase uniform over [0, interval)
+    '''
+    return np.clip((window_end - window_start) / interval, 0, 1)
+
+
+class ScreeningSweep:
+    '''
+    For every schedule: the probability of screen detection before metastasis (averaged over the phase),
+    the fraction detected for phases drawn per tumour, the expected number of screens before metastasis
+    and the moments and quantiles of the WOO (months) left at detection
+
+    Parameters
+    ----------
+    schedules : DataFrame with columns interval (months), start (months) and limit (cm3), e.g. from make_schedules
+    seed : seed of the phases. One uniform draw per tumour is shared by all the schedules (phase = u * interval),
+           so the schedules are compared on the same tumours and phases.
+    ovarian_params, omental_params : dicts with 'vmax', as in kinetics/simulation.py
+    model : growth model the chunks were simulated with (kinetics/models.py)
+    max_elements : maximum size of the (schedules x tumours) arrays
+    sketch_kwargs : passed on to QuantileSketch
+    '''
+    def __init__(self, schedules, seed=None, ovarian_params=ovarian_params, omental_params=omental_params,
+                 max_elements=10 ** 7, model='gompertz', **sketch_kwargs):
+        self.schedules = pd.DataFrame(schedules)[['interval', 'start', 'limit']].reset_index(drop=True)
+        # Schedules in days, as the simulations
+        self.interval = self.schedules['interval'].values[:, None] / DAYS_TO_MONTHS
+        self.start = self.schedules['start'].values[:, None] / DAYS_TO_MONTHS
+        # Invariants of the inverse of the model for the limit of each schedule, when the primary is ovarian / omental
+        self.c_ov = detection_invariant(self.schedules['limit'].values, ovarian_params['vmax'], model=model)[:, None]
+        self.c_om = detection_invariant(self.schedules['limit'].values, omental_params['vmax'], model=model)[:, None]
+        self.rng = np.random.default_rng(seed)
+        self.max_elements = max_elements
+        shape = len(self.schedules)
+        self.n_total = 0
+        self.p_detect = np.zeros(shape)
+        self.n_screens = np.zeros(shape)
+        self.n_detected = np.zeros(shape, dtype=np.int64)
+        self.moments = Moments(shape=shape)
+        self.sketch = QuantileSketch(shape=shape, **sketch_kwargs)
+
+    def update(self, chunk):
+        '''
+        Add a chunk of simulations (dict of arrays or DataFrame with omental, beta_pt and time_to_met)
+        '''
+        omental = np.asarray(chunk['omental'], dtype=bool)
+        inv_beta = 1 / np.asarray(chunk['beta_pt'], dtype=float)
+        time_to_met = np.asarray(chunk['time_to_met'], dtype=float)
+        u = self.rng.uniform(size=len(time_to_met))
+        step = max(1, self.max_elements // len(self.schedules))
+        for first in range(0, len(time_to_met), step):
+            s = slice(first, first + step)
+            # Window in which a screen detects the primary before metastasis: (schedules x tumours)
+            time_to_detect = np.where(omental[s], self.c_om, self.c_ov) * inv_beta[s]
+            window_start = np.maximum(self.start, time_to_detect)
+            window_end = time_to_met[s]
+            self.p_detect += detection_probability(window_start, window_end, self.interval).sum(axis=1)
+            self.n_screens += (np.maximum(window_end - self.start, 0) / self.interval).sum(axis=1)
+
+            # Screens for the drawn phases
+            phase = self.start + u[s] * self.interval
+            screen = first_screen_after(window_start, self.interval, phase)
+            detected = screen < window_end
+            woo = (window_end - screen) * DAYS_TO_MONTHS
+            self.n_detected += detected.sum(axis=1)
+            self.moments.update(woo, detected)
+            self.sketch.update(woo, detected)
+        self.n_total += len(time_to_met)
+        return self
+
+    def merge(self, other):
+        '''
+        Combine with a sweep over the same schedules filled from another part of the population
+        '''
+        if not self.schedules.equals(other.schedules):
+            raise ValueError('Only sweeps over the same schedules can be merged')
+        self.n_total += other.n_total
+        self.p_detect += other.p_detect
+        self.n_screens += other.n_screens
+        self.n_detected += other.n_detected
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def summary(self):
+        '''
+        DataFrame with one row per schedule: the phase-averaged probability of detection before metastasis,
+        the expected number of screens before metastasis per tumour, the fraction detected for the drawn phases
+        and the summary of the WOO (months) left at detection in the layout of pandas describe
+        '''
+        m = self.moments
+        q25, q50, q75 = np.moveaxis(self.sketch.quantile([0.25, 0.5, 0.75]), -1, 0)
+        seen = m.count > 0
+        n = max(self.n_total, 1)
+        return self.schedules.assign(p_detect=self.p_detect / n, screens_before_met=self.n_screens / n,
+                                     fraction_detected=self.n_detected / n, count=m.count.astype(float),
+                                     mean=np.where(seen, m.mean, np.nan), std=m.std,
+                                     min=np.where(seen, m.min, np.nan), **{'25%': q25, '50%': q50, '75%': q75},
+                                     max=np.where(seen, m.max, np.nan))
+
+
+def sweep_schedules(chunks, schedules, **kwargs):
+    '''
+    Fill a ScreeningSweep from an iterable of chunks (e.g. simulate_chunks or iter_store_chunks)
+    '''
+    sweep = ScreeningSweep(schedules, **kwargs)
+    for chunk in chunks:
+        sweep.update(chunk)
+    return sweep
@@ -0,0 +1,231 @@
+'''
+Sensitivity of the NLME estimates to measurement errors and to the choice of Vmax.
+These are the batched counterparts of scripts/MATLAB/run_measurement_sensitivity.m and run_vmax_sensitivity.m.
+
+Measurement errors: Gaussian noise is added to the measured volumes for many replicates at once. As in MATLAB, a replicate is only kept
+if every patient still grows by more than 10% (otherwise it would not have been included in the analysis), and the
+rejection is done on whole arrays of replicates. All accepted replicates are then fitted in one batched NLME call,
+and blocks of replicates can be run on several processes with their own seeds.
+
+Vmax: only K = ln(Vmax/V0) changes between the fits, so omega = ln(V/V0) is computed once and the transformed
+observations y = -ln(1 - omega/K) of a whole block of Vmax values are fitted together, warm started from the fit
+at the middle of the block. Any number of Vmax values can be run, and the sweeps of the two sites combined into a grid.
+'''
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from kinetics.lognormal import logt1_moments
+from kinetics.nlme import fit_gompertz, fit_nlme, V0, PHI0_GOMPERTZ
+
+
+MIN_GROWTH = 0.1 # minimum relative increase in volume between the first and last scan of every patient
+MIN_ACCEPTANCE = 1e-4 # acceptance rate of the noisy replicates below which draw_noisy_volumes gives up
+
+# Columns of the outputs, as in measurement_10per_*.csv and vmax_*.csv
+COLUMNS = ['mean-logt1', 'std-logt1', 'fe-logbeta', 'fe-logq', 'sd-logbeta', 'sd-logq', 'rmse',
+           'mean_noise', 'std_noise', 'max_noise']
+VMAX_COLUMNS = ['mean-logt1', 'std-logt1', 'fe-logbeta', 'fe-logq', 'sd-logbeta', 'sd-logq']
+
+
+def draw_noisy_volumes(ids, volumes, percent_noise, n_replicates, rng, min_growth=MIN_GROWTH, max_batch=100000,
+                       min_acceptance=MIN_ACCEPTANCE):
+    '''
+    Draw noisy volumes and keep only the replicates where every patient grows by more than min_growth
+
+    Parameters
+    ----------
+    ids : patient id of each measurement (the measurements of a patient in time order)
+    volumes : measured volumes (cm3)
+    percent_noise : standard deviation of the Gaussian noise, in % of the volume
+    n_replicates : number of accepted replicates to return
+    rng : numpy Generator
+    min_growth : minimum relative increase between the first and last scan of every patient
+    max_batch : maximum number of replicates drawn at a time
+    min_acceptance : at most n_replicates / min_acceptance replicates are drawn. A ValueError with the acceptance
+                     rate observed is raised if they are not enough (e.g. a patient that barely grows and a large noise).
+
+    Returns
+    -------
+    (n_replicates, n_measurements) arrays of noisy volumes and of the noise, and the acceptance rate
+    '''
+    ids, volumes = np.asarray(ids), np.asarray(volumes, dtype=float)
+    # Position of the first and last measurement of each patient
+    _, first = np.unique(ids, return_index=True)
+    _, last = np.unique(ids[::-1], return_index=True)
+    last = len(ids) - 1 - last
+
+    accepted, n_drawn, n_accepted = [], 0, 0
+    rate = 1.
+    max_draws = int(np.ceil(n_replicates / min_acceptance))
+    while n_accepted < n_replicates:
+        if n_drawn >= max_draws:
+            raise ValueError('Only {} of {} replicates drawn with {}% noise were accepted (acceptance rate {:.2g}, '
+                             'minimum {:.2g})'.format(n_accepted, n_drawn, percent_noise, n_accepted / n_drawn,
+                                                      min_acceptance))
+        # Draw enough replicates to fill the remainder at the acceptance rate seen so far
+        n = int(min(max_batch, max_draws - n_drawn,
+                    np.ceil(1.2 * (n_replicates - n_accepted) / max(rate, min_acceptance)) + 10))
+        noise = rng.normal(0, percent_noise / 100, size=(n, len(volumes)))
+        noisy = volumes * (1 + noise)
+        growth = (noisy[:, last] - noisy[:, first]) / noisy[:, first]
+        keep = np.all(growth > min_growth, axis=1)
+        accepted.append(noise[keep])
+        n_drawn += n
+        n_accepted += keep.sum()
+        rate = max(n_accepted, 1) / n_drawn
+
+    noise = np.concatenate(accepted)[:n_replicates]
+    return volumes * (1 + noise), noise, n_accepted / n_drawn
+
+
+def logt1_stats(fit):
+    '''
+    Table of the fixed effects and random effects variances, with the mean and std of log(t1) = log(q) - log(beta)
+    from the closed form for the difference of two independent normal variables
+    (the columns sd-logbeta and sd-logq hold the variances PSI(1,1) and PSI(2,2), as in the MATLAB output)
+    '''
+    phi, PSI = np.atleast_2d(fit['phi']), np.asarray(fit['PSI']).reshape(-1, 2, 2)
+    mean_logt1, std_logt1 = logt1_moments(phi[:, 0], phi[:, 1], PSI[:, 0, 0], PSI[:, 1, 1])
+    return pd.DataFrame({'mean-logt1': mean_logt1,
+                         'std-logt1': std_logt1,
+                         'fe-logbeta': phi[:, 0],
+                         'fe-logq': phi[:, 1],
+                         'sd-logbeta': PSI[:, 0, 0],
+                         'sd-logq': PSI[:, 1, 1],
+                         'rmse': np.atleast_1d(fit['rmse'])})
+
+
+def _run_block(args):
+    '''
+    Draw and fit one block of replicates with its own generator (top level so that it can be sent to worker processes)
+    '''
+    ids, volumes, dt, vmax, percent_noise, n, seed_seq = args
+    noisy, noise, rate = draw_noisy_volumes(ids, volumes, percent_noise, n, np.random.default_rng(seed_seq))
+    df = logt1_stats(fit_gompertz(ids, noisy, dt, vmax))
+    abs_noise = np.abs(noise)
+    df['mean_noise'] = abs_noise.mean(axis=1)
+    df['std_noise'] = abs_noise.std(axis=1, ddof=1)
+    df['max_noise'] = abs_noise.max(axis=1)
+    df['acceptance'] = rate
+    return df
+
+
+def run_measurement_sensitivity(ids, volumes, dt, vmax, percent_noises, n_replicates, seed=None, workers=1,
+                                block_size=500):
+    '''
+    Fit the Gompertz NLME model to n_replicates noisy versions of the data for each noise level
+
+    Parameters
+    ----------
+    ids, volumes, dt : measurements of one disease site, e.g. from load_site_data
+    vmax : maximum volume (cm3)
+    percent_noises : noise levels (standard deviation in % of the volume)
+    n_replicates : number of accepted replicates per noise level
+    seed : master seed; every block of replicates gets its own generator spawned from it
+    workers : number of worker processes. The results do not depend on it.
+    block_size : number of replicates drawn and fitted together
+
+    Returns
+    -------
+    DataFrame with one row per replicate: percent_noise, the columns in COLUMNS and the acceptance rate
+    of the growth criterion in the replicate's block
+    '''
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    blocks = []
+    for percent_noise, level_seq in zip(percent_noises, seed_seq.spawn(len(percent_noises))):
+        sizes = [min(block_size, n_replicates - start) for start in range(0, n_replicates, block_size)]
+        blocks += [(ids, volumes, dt, vmax, percent_noise, n, child)
+                   for n, child in zip(sizes, level_seq.spawn(len(sizes)))]
+
+    if workers <= 1:
+        results = [_run_block(block) for block in blocks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_run_block, blocks))
+
+    for block, df in zip(blocks, results):
+        df.insert(0, 'percent_noise', block[4])
+    return pd.concat(results, ignore_index=True)
+
+
+def summarise_sensitivity(df):
+    '''
+    Coefficient of variation of the population t1 (exp of mean-logt1) and median / IQR of the RMSE per noise level,
+    as printed by plot/figure_S2_a_b.py
+    '''
+    def summary(group):
+        t1 = np.exp(group['mean-logt1'])
+        return pd.Series({'n': len(group),
+                          'cv_t1': np.std(t1) / np.mean(t1),
+                          'cv_std_logt1': np.std(group['std-logt1']) / np.mean(group['std-logt1']),
+                          'rmse_median': group.rmse.quantile(0.5),
+                          'rmse_q25': group.rmse.quantile(0.25),
+                          'rmse_q75': group.rmse.quantile(0.75)})
+    return df.groupby('percent_noise')[df.columns.drop('percent_noise')].apply(summary)
+
+
+def _fit_vmax_block(args):
+    '''
+    Fit one block of Vmax values, warm started from the fit at the middle of the block
+    (top level so that it can be sent to worker processes)
+    '''
+    ids, omega, dt, vmaxs, V0, warm_start = args
+    # Only K changes with Vmax, omega is shared by the whole block
+    y = -np.log(1 - omega / np.log(vmaxs / V0)[:, None])
+    start = fit_nlme(dt, y[len(vmaxs) // 2], ids, phi0=PHI0_GOMPERTZ) if warm_start else None
+    fit = fit_nlme(dt, y, ids, phi0=PHI0_GOMPERTZ, start=start)
+    df = logt1_stats(fit)
+    df['n_iter'] = fit['n_iter']
+    df.insert(0, 'vmax', vmaxs)
+    return df
+
+
+def vmax_sweep(ids, volumes, dt, vmaxs, V0=V0, workers=1, block_size=20, warm_start=True):
+    '''
+    Fit the Gompertz NLME model for every Vmax in vmaxs
+
+    Parameters
+    ----------
+    ids, volumes, dt : measurements of one disease site, e.g. from load_site_data
+    vmaxs : Vmax values (cm3), all larger than the largest measured volume
+    V0 : starting volume (cm3)
+    workers : number of worker processes the blocks are run on
+    block_size : number of consecutive Vmax values fitted together
+    warm_start : whether each block starts from the fit at its middle value rather than from individual fits
+
+    Returns
+    -------
+    DataFrame indexed by vmax with the columns in VMAX_COLUMNS (as in vmax_*.csv), rmse and the number of
+    linearisation steps taken
+    '''
+    vmaxs = np.sort(np.asarray(vmaxs, dtype=float))
+    volumes = np.asarray(volumes, dtype=float)
+    if vmaxs[0] <= volumes.max():
+        raise ValueError('Vmax must be larger than the largest measured volume ({:.1f} cm3)'.format(volumes.max()))
+    omega = np.log(volumes / V0)
+    blocks = [(ids, omega, dt, vmaxs[i:i + block_size], V0, warm_start) for i in range(0, len(vmaxs), block_size)]
+
+    if workers <= 1:
+        results = [_fit_vmax_block(block) for block in blocks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_fit_vmax_block, blocks))
+    return pd.concat(results, ignore_index=True).set_index('vmax')
+
+
+def vmax_grid(sweeps):
+    '''
+    Combine the sweeps of several sites (dict of site: vmax_sweep table) into one table over the grid of Vmax values.
+    The sites are fitted independently, so every (Vmax_ov, Vmax_om) point just pairs the fits of each site.
+
+    Returns
+    -------
+    DataFrame indexed by (vmax_<site>, ...) with the columns of each sweep suffixed by _<site>
+    '''
+    grid = None
+    for site, df in sweeps.items():
+        df = df.add_suffix('_' + site).rename_axis('vmax_' + site).reset_index()
+        grid = df if grid is None else grid.merge(df, how='cross')
+    return grid.set_index(['vmax_' + site for site in sweeps])
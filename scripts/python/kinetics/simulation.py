@@ -0,0 +1,164 @@
+'''
+Batch engine for simulating a population of tumours using the Gompertz growth parameters
+calculated using the NLME model.
+
+Instead of looping over tumours, every random quantity (primary site, size of the primary at metastasis,
+beta_pt and beta_met) is drawn as a whole array and the Gompertz functions are evaluated over those arrays.
+Other growth models of kinetics/models.py are simulated the same way, with their kernels looked up once per batch.
+'''
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from kinetics import profiling
+from kinetics.models import get_model
+
+
+'''
+Parameter setting
+'''
+V0 = 1e-9 # starting volume
+LIMIT_US = 0.5 # ultrasound detection limit (cm3)
+LIMIT_CA = 0.015 # ca125 detection limit (cm3)
+
+# Max volumes set before hand while doing NLME
+# mean and stds of log(beta) estimated using NLME - from Matlab
+# beta is the Gompertz decay rate
+ovarian_params = {'vmax': 5000, # max volume -> determines K = log(Vmax/V0) where V0 = 1e-9
+                  'ln_beta_mean': -5.7905, # mean of log(beta) from the NLME model
+                  'ln_beta_std': np.sqrt(0.8802),} # std of log(beta) from the NLME model. It actually gives us the variance.
+omental_params = {'vmax': 3000,
+                  'ln_beta_mean': -5.5188,
+                  'ln_beta_std': np.sqrt(0.8799),}
+
+# sizes at metastasis from the 11 cases with growing lesions in both sites (got this from plot_gompertz_indi_from_matlab.py)
+# kinetics.woo.sizes_at_met recomputes them from gompertz_params_<site>.csv
+pt_size_at_met = [6.58634689e-07, 7.49423904e-04, 1.39645166e-02, 8.36070562e-02,
+       3.88565349e-01, 1.04536906e+00, 1.22672942e+00, 2.45892441e+00,
+       3.67071643e+00, 3.87580839e+00, 3.99019334e+00]
+
+# Probability of omental primary vs ovarian primary - 4 out of 11 had omental disease first
+p_om = 4/11
+
+# Columns of the simulation output, in the order they are written to sims.csv
+COLUMNS = ['ix', 'omental', 'size_at_met', 'beta_pt', 'beta_met', 'time_to_met',
+           'time_to_ca125', 'time_to_US', 'met_size_at_ca125', 'met_size_at_US']
+
+
+def simulate_tumours(n, rng=None, start=0, ovarian_params=ovarian_params, omental_params=omental_params,
+                     sizes=pt_size_at_met, p_om=p_om, limit_ca=LIMIT_CA, limit_us=LIMIT_US, model='gompertz'):
+    '''
+    Simulate a batch of tumours with array draws.
+
+    Parameters
+    ----------
+    n : number of tumours to simulate
+    rng : numpy Generator used for all the draws (a fresh unseeded one if None)
+    start : index of the first tumour in the batch, used for the 'ix' column
+    ovarian_params, omental_params : dicts with 'vmax', 'ln_beta_mean' and 'ln_beta_std'
+    sizes : sizes of the primary at the onset of metastasis to draw from (cm3)
+    p_om : probability of an omental primary
+    limit_ca, limit_us : CA125 and ultrasound detection limits (cm3)
+    model : growth model, a name registered in kinetics/models.py (see model_kwargs for its parameters) or a GrowthModel
+
+    Returns
+    -------
+    dict of 1D arrays of length n, keyed by the names in COLUMNS
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    model = get_model(model)
+
+    with profiling.stage('draws', rows=n):
+        # Uniform probability used to determine if it's an ovarian/omental primary
+        omental = rng.uniform(size=n) <= p_om
+
+        # Draw the size of the primary tumour (PT) at the onset of metastasis from the estimated size of PT at
+        # metastasis for the 11 cases with growing omental and ovarian lesions
+        size_at_met = np.asarray(sizes, dtype=float)[rng.integers(0, len(sizes), size=n)]
+
+        # Draw the primary and metastatic decay rates from their respective distributions
+        # When the ovarian is the primary, omental is the metastatic site and vice versa
+        mean_pt = np.where(omental, omental_params['ln_beta_mean'], ovarian_params['ln_beta_mean'])
+        std_pt = np.where(omental, omental_params['ln_beta_std'], ovarian_params['ln_beta_std'])
+        mean_met = np.where(omental, ovarian_params['ln_beta_mean'], omental_params['ln_beta_mean'])
+        std_met = np.where(omental, ovarian_params['ln_beta_std'], omental_params['ln_beta_std'])
+        beta_pt = model.sample_rates(rng, mean_pt, std_pt, n)
+        beta_met = model.sample_rates(rng, mean_met, std_met, n)
+
+    with profiling.stage(model.name, rows=n):
+        # Set the K parameters of the primary and metastatic sites
+        K_ov = np.log(ovarian_params['vmax'] / V0)
+        K_om = np.log(omental_params['vmax'] / V0)
+        K = np.where(omental, K_om, K_ov)
+        K_met = np.where(omental, K_ov, K_om)
+
+        # Time taken for PT to metastasise and to reach the US / CA125 detection limit
+        t_to_met = model.time_to_volume(size_at_met, beta_pt, K, V0)
+        t_to_detect_CA125 = model.time_to_volume(limit_ca, beta_pt, K, V0)
+        t_to_detect_US = model.time_to_volume(limit_us, beta_pt, K, V0)
+
+        # Size of mets at CA125 / US detection limit
+        met_size_at_CA_detect = model.V(t_to_detect_CA125 - t_to_met, K_met, beta_met, V0)
+        met_size_at_US_detect = model.V(t_to_detect_US - t_to_met, K_met, beta_met, V0)
+
+    return {'ix': np.arange(start, start + n), # index of each tumour simulation
+            'omental': omental, # whether it is the omental primary
+            'size_at_met': size_at_met,
+            'beta_pt': beta_pt,
+            'beta_met': beta_met,
+            'time_to_met': t_to_met,
+            'time_to_ca125': t_to_detect_CA125,
+            'time_to_US': t_to_detect_US,
+            'met_size_at_ca125': met_size_at_CA_detect,
+            'met_size_at_US': met_size_at_US_detect,
+            }
+
+
+def _simulate_shard(args):
+    '''
+    Simulate one shard of the population with its own generator (top level so that it can be sent to worker processes)
+    '''
+    n, start, seed_seq, kwargs = args
+    return simulate_tumours(n, np.random.default_rng(seed_seq), start=start, **kwargs)
+
+
+def simulate_chunks(n, chunk_size, seed=None, workers=1, **kwargs):
+    '''
+    Simulate n tumours in fixed-size chunks so that the memory used does not depend on n.
+
+    Each chunk is a shard with its own generator spawned from SeedSequence(seed), so the output for a given
+    seed and chunk_size is bit-identical whatever the number of workers.
+
+    Parameters
+    ----------
+    n : total number of tumours to simulate
+    chunk_size : number of tumours per chunk (the last chunk may be smaller)
+    seed : master seed, an int or a SeedSequence (fresh entropy if None, see SeedSequence.entropy to record it)
+    workers : number of worker processes (1 simulates the chunks in this process)
+    kwargs : passed on to simulate_tumours
+
+    Returns
+    -------
+    generator of dicts of 1D arrays, one per chunk and in order
+    '''
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    starts = range(0, n, chunk_size)
+    shards = [(min(chunk_size, n - start), start, child, kwargs)
+              for start, child in zip(starts, seed_seq.spawn(len(starts)))]
+
+    if workers <= 1:
+        for shard in shards:
+            yield _simulate_shard(shard)
+        return
+
+    # Keep at most two shards per worker in flight so that finished chunks do not pile up in memory
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for shard in shards:
+            pending.append(executor.submit(_simulate_shard, shard))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
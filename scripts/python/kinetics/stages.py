@@ -0,0 +1,417 @@
+'''
+Pipeline stages with explicit input and output paths.
+
+Each stage is what one of the scripts in scripts/python does, as a function that the scripts and the command line
+interface (python -m kinetics) call. The stages import the modules they need when they run, so a job only pays
+for the imports of the stage it runs.
+'''
+import os
+
+from kinetics import profiling
+from kinetics.io import PATH_TO_VOLUMES, OUTPUT_DIR, SIMULATIONS_DIR, SENSITIVITY_DIR
+
+
+def _chunks(sims, chunk_size, columns):
+    # Simulations given as a path (sims.csv or a column store folder) or as an iterable of chunks
+    if isinstance(sims, (str, os.PathLike)):
+        from kinetics.io import iter_simulations
+        return iter_simulations(sims, chunk_size, columns)
+    return sims
+
+
+def _write(df, path, **kwargs):
+    if path is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        df.to_csv(path, **kwargs)
+
+
+def calculate_tvdts(path_to_volumes=PATH_TO_VOLUMES, path_for_output=os.path.join(OUTPUT_DIR, 'tvdts.csv')):
+    '''
+    Tumour volume doubling times of the ovarian and omental lesions (I_calculate_tvdts.py)
+        tvdt = ln(2) / r
+    with r the least squares slope of ln(V) against the time of the valid scans of each patient (kinetics/tvdt.py),
+    i.e. tvdt = t * ln(2) / ln(V/V0) when there are two scans
+    '''
+    from kinetics.io import load_volumes
+    from kinetics.tvdt import calculate_tvdts as _calculate_tvdts
+
+    profiling.annotate(path_to_volumes=path_to_volumes, path_for_output=path_for_output)
+    with profiling.stage('load') as step:
+        vols = load_volumes(path_to_volumes)
+        step.add_rows(len(vols))
+    with profiling.stage('tvdt', rows=len(vols)):
+        tvdt = _calculate_tvdts(vols)
+    with profiling.stage('write', rows=len(tvdt)):
+        _write(tvdt, path_for_output)
+    return tvdt
+
+
+def update_patients(path_to_volumes=PATH_TO_VOLUMES, output_dir=OUTPUT_DIR, full=False):
+    '''
+    Incremental version of calculate_tvdts and of the individual Gompertz parameters (kinetics/incremental.py): only the
+    patients whose scans changed since the last run are recomputed and their rows of tvdts.csv and
+    gompertz_params_<site>.csv are replaced. The hashes and the population parameters are kept in patients_index.json.
+    The first run without patients_index.json builds it from the existing tables and leaves them as they are.
+    With full=True (or without the tables) everything is recomputed and the population is refitted.
+
+    Returns
+    -------
+    ids of the patients that were recomputed and of those that were removed
+    '''
+    import pandas as pd
+    from kinetics.incremental import SITES, load_index, save_index, update_outputs
+    from kinetics.io import load_volumes
+
+    path_to_index = os.path.join(output_dir, 'patients_index.json')
+    path_to_tvdts = os.path.join(output_dir, 'tvdts.csv')
+    path_to_params = os.path.join(output_dir, 'gompertz_params_{}.csv')
+
+    profiling.annotate(path_to_volumes=path_to_volumes, output_dir=output_dir, full=full)
+    index, tvdts, params = None, None, None
+    with profiling.stage('load') as step:
+        if not full and os.path.exists(path_to_tvdts) and all(os.path.exists(path_to_params.format(s)) for s in SITES):
+            index = load_index(path_to_index)
+            tvdts = pd.read_csv(path_to_tvdts, index_col=0)
+            params = {site: pd.read_csv(path_to_params.format(site)) for site in SITES}
+        vols = load_volumes(path_to_volumes)
+        step.add_rows(len(vols))
+    with profiling.stage('update', rows=len(vols)):
+        out = update_outputs(vols, index, tvdts, params)
+    profiling.annotate(changed=len(out['changed']), removed=len(out['removed']))
+
+    with profiling.stage('write'):
+        # The tables are only rewritten when a patient changed, so the MATLAB fits stay as they are until then
+        if tvdts is None or len(out['changed']) or len(out['removed']):
+            _write(out['tvdts'], path_to_tvdts)
+            for site, df in out['params'].items():
+                _write(df, path_to_params.format(site), index=False) # same layout as the MATLAB outputs
+        save_index(path_to_index, out['index']['hashes'], out['index']['population'])
+    return out['changed'], out['removed']
+
+
+def simulate_population(path_for_output=SIMULATIONS_DIR, n_tumours=10000, chunk_size=1000000, seed=2024, workers=1,
+                        output_format='csv', model='gompertz'):
+    '''
+    Simulate the population and write it to sims.csv or to a column store sims/ in path_for_output
+    (II_simulate_population.py). output_format is 'csv', 'npy' or 'compact' (a column store with the compact schema
+    of kinetics/store.py). model is the growth model of kinetics/models.py, with the parameters of model_kwargs
+
+    Returns
+    -------
+    path written and the entropy of the seed used, to reproduce the run
+    '''
+    import numpy as np
+    from kinetics.models import model_kwargs
+    from kinetics.simulation import simulate_chunks, COLUMNS
+
+    os.makedirs(path_for_output, exist_ok=True)
+    seed = np.random.SeedSequence(seed)
+    kwargs = model_kwargs(model)
+    profiling.annotate(n_tumours=n_tumours, chunk_size=chunk_size, seed_entropy=seed.entropy, workers=workers,
+                       output_format=output_format, model=kwargs['model'])
+    # With workers > 1 the simulate step is the wait for the chunks of the worker processes
+    chunks = profiling.iterate('simulate', simulate_chunks(n_tumours, chunk_size, seed=seed, workers=workers, **kwargs),
+                               rows=profiling.chunk_rows)
+
+    if output_format == 'npy':
+        from kinetics.store import write_store
+        path = os.path.join(path_for_output, 'sims')
+        with profiling.stage('write', rows=n_tumours):
+            write_store(path, chunks, n_tumours)
+    elif output_format == 'compact':
+        from kinetics.store import write_compact_store
+        path = os.path.join(path_for_output, 'sims')
+        with profiling.stage('write', rows=n_tumours):
+            write_compact_store(path, chunks, n_tumours, kwargs.get('sizes'), kwargs.get('ovarian_params'),
+                                kwargs.get('omental_params'), model=kwargs['model'])
+    else:
+        import pandas as pd
+        # Append each chunk to the csv as it is simulated
+        path = os.path.join(path_for_output, 'sims.csv')
+        for i, chunk in enumerate(chunks):
+            with profiling.stage('dataframe', rows=len(chunk['ix'])):
+                df = pd.DataFrame(chunk, columns=COLUMNS, index=chunk['ix'])
+            with profiling.stage('write', rows=len(df)):
+                df.to_csv(path, mode='w' if i == 0 else 'a', header=(i == 0))
+    return path, seed.entropy
+
+
+def analyse_simulations(sims=os.path.join(SIMULATIONS_DIR, 'sims.csv'), chunk_size=1000000):
+    '''
+    Detection before metastasis and WOO for the CA125 and US limits (III_analyse_simulation_results.py)
+
+    Parameters
+    ----------
+    sims : sims.csv, a column store folder or an iterable of chunks (e.g. simulate_chunks)
+    chunk_size : number of simulations read at a time
+
+    Returns
+    -------
+    WOOAggregator
+    '''
+    from kinetics.aggregate import aggregate_chunks
+    profiling.annotate(sims=sims if isinstance(sims, (str, os.PathLike)) else type(sims).__name__, chunk_size=chunk_size)
+    chunks = profiling.iterate('read', _chunks(sims, chunk_size, ['time_to_met', 'time_to_ca125', 'time_to_US']),
+                               rows=profiling.chunk_rows)
+    with profiling.stage('aggregate') as step:
+        stats = aggregate_chunks(chunks)
+        step.add_rows(stats.n_total)
+    return stats
+
+
+def woo_report(stats):
+    '''
+    Text summary of a WOOAggregator, as printed by III_analyse_simulation_results.py
+    '''
+    lines = ['{} out of {:,} cases reach CA125 detection limit before mets'.format(stats.n_before_met['CA125'], stats.n_total),
+             '{} out of {:,} cases reach US detection limit before mets'.format(stats.n_before_met['US'], stats.n_total)]
+    for name in ['CA125', 'US']:
+        lines += ['\n **** WOO for {} stats **** \n'.format(name), str(stats.describe(name)), '\n']
+    return '\n'.join(lines)
+
+
+def analyse_adaptive(abs_tol=None, rel_tol=0.01, batch_size=10000, max_tumours=10 ** 8, seed=2024, workers=1,
+                     model='gompertz'):
+    '''
+    Simulate batches of tumours until the statistics of analyse_simulations meet the tolerances on their
+    standard errors (kinetics/adaptive.py), without writing the simulations. model is the growth model of
+    kinetics/models.py, with the parameters of model_kwargs
+
+    Returns
+    -------
+    WOOAggregator and the DataFrame of the estimates, standard errors and whether each tolerance was met
+    '''
+    from kinetics.adaptive import simulate_adaptive
+    from kinetics.models import model_kwargs
+    kwargs = model_kwargs(model)
+    profiling.annotate(abs_tol=abs_tol, rel_tol=rel_tol, batch_size=batch_size, max_tumours=max_tumours, seed=seed,
+                       workers=workers, model=kwargs['model'])
+    with profiling.stage('adaptive') as step:
+        stats, errors = simulate_adaptive(abs_tol, rel_tol, batch_size=batch_size, min_tumours=batch_size,
+                                          max_tumours=max_tumours, seed=seed, workers=workers, **kwargs)
+        step.add_rows(stats.n_total)
+    return stats, errors
+
+
+def analyse_analytic(limits=None, path_for_output=None, **kwargs):
+    '''
+    Exact detection before metastasis and WOO statistics of the simulated population for each detection limit
+    (kinetics/analytic.py), without simulating. Only for the Gompertz model. limits defaults to the CA125 and US limits; kwargs are passed on
+    to detection_analytic (quantiles and the simulation parameters).
+    '''
+    from kinetics.analytic import detection_analytic
+    from kinetics.simulation import LIMIT_CA, LIMIT_US
+    limits = [LIMIT_CA, LIMIT_US] if limits is None else limits
+    profiling.annotate(limits=limits, **kwargs)
+    with profiling.stage('analytic', rows=len(limits)):
+        summary = detection_analytic(limits, **kwargs)
+    _write(summary, path_for_output)
+    return summary
+
+
+def detection_limit_sweep(limits, sims=os.path.join(SIMULATIONS_DIR, 'sims.csv'), chunk_size=1000000,
+                          path_for_output=os.path.join(SIMULATIONS_DIR, 'detection_limit_sweep.csv'), model='gompertz'):
+    '''
+    Detection before metastasis and WOO for every detection limit (run_detection_limit_sweep.py),
+    model is the growth model the simulations were made with
+    '''
+    from kinetics.thresholds import sweep_thresholds
+    chunks = _chunks(sims, chunk_size, ['omental', 'beta_pt', 'time_to_met'])
+    summary = sweep_thresholds(chunks, limits, model=model).summary()
+    _write(summary, path_for_output)
+    return summary
+
+
+def screening_schedules(schedules, sims=os.path.join(SIMULATIONS_DIR, 'sims.csv'), seed=2024, chunk_size=1000000,
+                        path_for_output=os.path.join(SIMULATIONS_DIR, 'screening_schedules.csv'), model='gompertz'):
+    '''
+    Screen detection before metastasis for every screening schedule (run_screening_schedules.py).
+    model is the growth model the simulations were made with
+    '''
+    from kinetics.screening import sweep_schedules
+    chunks = _chunks(sims, chunk_size, ['omental', 'beta_pt', 'time_to_met'])
+    summary = sweep_schedules(chunks, schedules, seed=seed, model=model).summary()
+    _write(summary, path_for_output, index=False)
+    return summary
+
+
+def bootstrap_population(n_replicates=1000, n_tumours=100000, seed=2024, workers=1, output_dir=OUTPUT_DIR,
+                         path_for_output=os.path.join(SIMULATIONS_DIR, 'bootstrap.csv'), level=0.95):
+    '''
+    Bootstrap the detection and WOO statistics of the simulation over the 11 cases with both sites and the NLME
+    estimates (run_bootstrap.py). The cases are read from gompertz_params_<site>.csv in output_dir.
+    Writes the statistics of every replicate to path_for_output.
+
+    Returns
+    -------
+    DataFrame with one row per replicate and the confidence intervals of its columns
+    '''
+    from kinetics.bootstrap import confidence_intervals, run_bootstrap
+    from kinetics.io import load_gompertz_params
+    from kinetics.woo import both_sites, ttm_woo
+
+    cases = ttm_woo(both_sites(*[load_gompertz_params(site, os.path.join(output_dir, 'gompertz_params_{}.csv'.format(site)))
+                                 for site in ('ov', 'om')]))
+    reps = run_bootstrap(cases['size_at_met'].values, cases['d_t1'].values < 0, n_replicates, n_tumours, seed=seed,
+                         workers=workers)
+    _write(reps, path_for_output, index=False)
+    return reps, confidence_intervals(reps, level)
+
+
+def measurement_sensitivity(sites=('ov', 'om'), percent_noises=(5, 10, 20), n_replicates=1000, seed=2024, workers=1,
+                            block_size=250, path_to_volumes=PATH_TO_VOLUMES, path_for_output=SENSITIVITY_DIR):
+    '''
+    Refit the Gompertz model to noisy volumes for each site and noise level (run_measurement_sensitivity.py).
+    Writes measurement_sweep_<site>.csv in path_for_output.
+
+    Returns
+    -------
+    dict of site: DataFrame with one row per replicate
+    '''
+    from kinetics.io import load_site_data
+    from kinetics.nlme import VMAX
+    from kinetics.sensitivity import run_measurement_sensitivity
+
+    results = {}
+    for site in sites:
+        ids, volumes, dt = load_site_data(path_to_volumes, site)
+        results[site] = run_measurement_sensitivity(ids, volumes, dt, VMAX[site], percent_noises, n_replicates,
+                                                    seed=seed, workers=workers, block_size=block_size)
+        if path_for_output is not None:
+            _write(results[site], os.path.join(path_for_output, 'measurement_sweep_' + site + '.csv'), index=False)
+    return results
+
+
+def vmax_sensitivity(vmaxs, sites=('ov', 'om'), workers=1, block_size=20, path_to_volumes=PATH_TO_VOLUMES,
+                     path_for_output=os.path.join(SENSITIVITY_DIR, 'vmax_sweep.csv'), path_for_grid=None):
+    '''
+    Refit the Gompertz model for every Vmax for each site (run_vmax_sensitivity.py).
+    Writes the table indexed by site and vmax and, if path_for_grid is given, the grid over the sites' Vmax values.
+
+    Returns
+    -------
+    dict of site: DataFrame indexed by vmax
+    '''
+    import pandas as pd
+    from kinetics.io import load_site_data
+    from kinetics.sensitivity import vmax_sweep, vmax_grid
+
+    sweeps = {}
+    for site in sites:
+        ids, volumes, dt = load_site_data(path_to_volumes, site)
+        sweeps[site] = vmax_sweep(ids, volumes, dt, vmaxs, workers=workers, block_size=block_size)
+    _write(pd.concat(sweeps, names=['site']), path_for_output)
+    if path_for_grid is not None:
+        _write(vmax_grid(sweeps), path_for_grid)
+    return sweeps
+
+
+def benchmark_stages(cases=None, scales=(10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6), max_rows=None, repeats=1,
+                     output_dir=os.path.join(OUTPUT_DIR, 'benchmarks'), threshold=0.2, save_baseline=False):
+    '''
+    Time the stages on synthetic data at every scale (run_benchmarks.py). Appends the results to history.jsonl in
+    output_dir and either stores them as baseline.json or compares them with it.
+
+    Returns
+    -------
+    list of benchmark records and list of regressions (empty when the baseline is saved or there is none)
+    '''
+    from kinetics.benchmark import CASES, append_history, compare, run_benchmarks, save_baseline as save
+
+    records = run_benchmarks(cases or CASES, scales, max_rows, repeats)
+    append_history(os.path.join(output_dir, 'history.jsonl'), records)
+    if save_baseline:
+        save(os.path.join(output_dir, 'baseline.json'), records)
+        return records, []
+    return records, compare(records, os.path.join(output_dir, 'baseline.json'), threshold)
+
+
+def scenario_sweep(n_tumours=100000, chunk_size=1000000, seed=2024, workers=1, sites=('ov', 'om'), p_oms=(),
+                   limits_ca=(), limits_us=(), sensitivity_dir=SENSITIVITY_DIR,
+                   path_for_output=os.path.join(SIMULATIONS_DIR, 'scenarios.csv')):
+    '''
+    Simulate the baseline, every row of vmax_<site>.csv and measurement_10per_<site>.csv in sensitivity_dir and the
+    other values of p_om and of the detection limits with common random numbers (run_scenarios.py)
+
+    Returns
+    -------
+    DataFrame with one row per scenario (ScenarioSweep.summary)
+    '''
+    import pandas as pd
+    from kinetics.scenarios import scenario_grid, simulate_scenarios
+
+    tables = {}
+    for source, name in [('vmax', 'vmax_{}.csv'), ('measurement', 'measurement_10per_{}.csv')]:
+        paths = {site: os.path.join(sensitivity_dir, name.format(site)) for site in sites}
+        tables[source] = {site: pd.read_csv(path) for site, path in paths.items() if os.path.exists(path)}
+    scenarios = scenario_grid(tables['vmax'], tables['measurement'], p_oms, limits_ca, limits_us)
+    profiling.annotate(n_tumours=n_tumours, chunk_size=chunk_size, seed=seed, workers=workers, n_scenarios=len(scenarios))
+    with profiling.stage('scenarios', rows=n_tumours * len(scenarios)):
+        summary = simulate_scenarios(scenarios, n_tumours, chunk_size, seed=seed, workers=workers).summary()
+    _write(summary, path_for_output, index=False)
+    return summary
+
+
+def trajectory_fan_chart(n_tumours=1000000, chunk_size=100000, seed=2024, workers=1, grid=None, sims=None,
+                         path_for_output=os.path.join(SIMULATIONS_DIR, 'trajectories.csv'), model='gompertz'):
+    '''
+    Quantiles of the primary, metastatic and total volumes of the population over time (run_trajectories.py)
+
+    Parameters
+    ----------
+    n_tumours, chunk_size, seed, workers : the tumours simulated, as in simulate_population
+    grid : times since the onset of the primary (days), kinetics.trajectories.GRID if None
+    sims : sims.csv, a column store folder or an iterable of chunks to use instead of simulating the tumours
+    model : growth model the tumours are simulated with (or were, for sims), see kinetics/models.py
+
+    Returns
+    -------
+    FanChart
+    '''
+    from kinetics.models import model_kwargs
+    from kinetics.trajectories import GRID, fan_chart, simulate_fan_chart
+
+    grid = GRID if grid is None else grid
+    profiling.annotate(n_tumours=n_tumours, chunk_size=chunk_size, seed=seed, workers=workers, n_times=len(grid), model=model,
+                       sims=sims if sims is None or isinstance(sims, (str, os.PathLike)) else type(sims).__name__)
+    with profiling.stage('trajectories') as step:
+        if sims is None:
+            chart = simulate_fan_chart(n_tumours, chunk_size, seed=seed, workers=workers, grid=grid, **model_kwargs(model))
+        else:
+            chunks = _chunks(sims, chunk_size, ['ix', 'omental', 'beta_pt', 'beta_met', 'time_to_met'])
+            chart = fan_chart(profiling.iterate('read', chunks, rows=profiling.chunk_rows), grid, model=model)
+        step.add_rows(chart.n_total * len(grid))
+    _write(chart.summary(), path_for_output)
+    return chart
+
+
+def metastatic_cascades(n_tumours=1000000, chunk_size=100000, seed=2024, workers=1, sites=None, seeds_per_lesion=1,
+                        max_generations=2, max_lesions=8, path_for_output=os.path.join(SIMULATIONS_DIR, 'cascades.csv'),
+                        **kwargs):
+    '''
+    Simulate the metastatic cascades of n_tumours patients and summarise their detection (run_cascades.py)
+
+    Parameters
+    ----------
+    sites : dict of site: params ('vmax', 'ln_beta_mean', 'ln_beta_std'), kinetics.cascade.SITES if None
+    seeds_per_lesion, max_generations, max_lesions, kwargs : passed on to simulate_cascades
+
+    Returns
+    -------
+    DataFrame with one row per detection limit (CascadeSummary.summary)
+    '''
+    from kinetics.cascade import SITES, cascade_chunks, summarise_cascades
+
+    sites = SITES if sites is None else sites
+    profiling.annotate(n_tumours=n_tumours, chunk_size=chunk_size, seed=seed, workers=workers, sites=list(sites),
+                       seeds_per_lesion=seeds_per_lesion, max_generations=max_generations, max_lesions=max_lesions)
+    chunks = cascade_chunks(n_tumours, chunk_size, seed=seed, workers=workers, sites=sites,
+                            seeds_per_lesion=seeds_per_lesion, max_generations=max_generations,
+                            max_lesions=max_lesions, **kwargs)
+    with profiling.stage('summarise') as step:
+        summary = summarise_cascades(profiling.iterate('cascades', chunks, rows=profiling.chunk_rows), sites,
+                                     kwargs.get('limits', ('ca125', 'US')))
+        step.add_rows(summary.n_total)
+    summary = summary.summary()
+    _write(summary, path_for_output)
+    return summary
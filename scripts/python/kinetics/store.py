@@ -0,0 +1,200 @@
+'''
+Columnar binary store for the simulation results.
+
+A store is a folder with one .npy file per column and a meta.json file with the number of rows and the column names.
+Chunks are written straight into memory-mapped .npy files, so the memory used while writing is bounded by the
+chunk size and any column can be read back on its own without parsing the others.
+'''
+import json
+import os
+
+import numpy as np
+
+
+def write_store(path, chunks, n_rows, meta=None):
+    '''
+    Write chunks of columns into a store
+
+    Parameters
+    ----------
+    path : folder of the store (created if it does not exist)
+    chunks : iterable of dicts of 1D arrays, all with the same keys, e.g. from simulate_chunks
+    n_rows : total number of rows across all the chunks
+    meta : optional dict of entries added to meta.json
+
+    Returns
+    -------
+    number of rows written
+    '''
+    os.makedirs(path, exist_ok=True)
+    columns, arrays = None, {}
+    row = 0
+    for chunk in chunks:
+        if columns is None:
+            # Allocate the full columns on disk from the dtypes of the first chunk
+            columns = list(chunk.keys())
+            for col in columns:
+                arrays[col] = np.lib.format.open_memmap(os.path.join(path, col + '.npy'), mode='w+',
+                                                        dtype=np.asarray(chunk[col]).dtype, shape=(n_rows,))
+        n = len(chunk[columns[0]])
+        if row + n > n_rows:
+            raise ValueError('Chunks hold more than the {} rows allocated for the store'.format(n_rows))
+        for col in columns:
+            arrays[col][row:row + n] = chunk[col]
+        row += n
+
+    for array in arrays.values():
+        array.flush()
+    if row != n_rows:
+        raise ValueError('Only {} of the {} rows allocated for the store were written'.format(row, n_rows))
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(dict(meta or {}, n_rows=n_rows, columns=columns or []), f, indent=1)
+    return row
+
+
+def read_meta(path):
+    '''
+    Read the number of rows and the column names of a store
+    '''
+    with open(os.path.join(path, 'meta.json')) as f:
+        return json.load(f)
+
+
+def load_column(path, column):
+    '''
+    Memory-map a single column of a store (read only)
+    '''
+    return np.load(os.path.join(path, column + '.npy'), mmap_mode='r')
+
+
+def load_store(path, columns=None):
+    '''
+    Memory-map the columns of a store
+
+    Parameters
+    ----------
+    path : folder of the store
+    columns : names of the columns to load (all of them if None)
+
+    Returns
+    -------
+    dict of read-only memory-mapped arrays
+    '''
+    if columns is None:
+        columns = read_meta(path)['columns']
+    return {col: load_column(path, col) for col in columns}
+
+
+def iter_store_chunks(path, chunk_size, columns=None):
+    '''
+    Iterate over a store in chunks of rows
+
+    Parameters
+    ----------
+    path : folder of the store
+    chunk_size : number of rows per chunk
+    columns : names of the columns to read (all of them if None)
+
+    Returns
+    -------
+    generator of dicts of in-memory arrays with at most chunk_size rows
+    '''
+    meta = read_meta(path)
+    if meta.get('schema') == 'compact':
+        yield from iter_compact_chunks(path, chunk_size, columns)
+        return
+    store = load_store(path, columns)
+    for start in range(0, meta['n_rows'], chunk_size):
+        yield {col: np.asarray(array[start:start + chunk_size]) for col, array in store.items()}
+
+
+'''
+Compact schema
+
+Only the random draws of each tumour are stored: the primary site as a bool, the size at metastasis as a uint8 index
+into the table of sizes and beta_pt / beta_met as float32, 10 bytes per tumour instead of the ten float64 columns.
+Everything else is a deterministic function of those and of the simulation parameters kept in meta.json, and is
+recomputed in float64 when the store is read: ix from the row number, the times from the inverse Gompertz function
+and the sizes of the metastasis at detection, optionally as log10 (log10_met_size_at_ca125 / log10_met_size_at_US)
+since the volumes of metastases that start long after detection underflow to 0.
+'''
+COMPACT_DTYPES = {'omental': np.bool_, 'size_ix': np.uint8, 'beta_pt': np.float32, 'beta_met': np.float32}
+
+
+def encode_compact(chunk, sizes):
+    '''
+    Compact columns of a chunk of simulations (dict of arrays with omental, size_at_met, beta_pt and beta_met)
+    '''
+    sizes = np.asarray(sizes, dtype=float)
+    order = np.argsort(sizes)
+    size_at_met = np.asarray(chunk['size_at_met'], dtype=float)
+    pos = np.minimum(np.searchsorted(sizes[order], size_at_met), len(sizes) - 1)
+    if not np.array_equal(sizes[order][pos], size_at_met):
+        raise ValueError('size_at_met holds values that are not in the table of sizes')
+    return {'omental': np.asarray(chunk['omental'], dtype=np.bool_), 'size_ix': order[pos].astype(np.uint8),
+            'beta_pt': np.asarray(chunk['beta_pt'], dtype=np.float32),
+            'beta_met': np.asarray(chunk['beta_met'], dtype=np.float32)}
+
+
+def write_compact_store(path, chunks, n_rows, sizes=None, ovarian_params=None, omental_params=None, limit_ca=None,
+                        limit_us=None, V0=None, model='gompertz'):
+    '''
+    Write chunks of simulations into a store with the compact schema. The simulation parameters default to those of
+    kinetics/simulation.py and must be the ones the chunks were simulated with.
+    '''
+    from kinetics import simulation
+    from kinetics.models import get_model
+    sizes = simulation.pt_size_at_met if sizes is None else sizes
+    if len(sizes) > 256:
+        raise ValueError('The compact schema holds at most 256 sizes at metastasis')
+    meta = {'schema': 'compact', 'sizes': [float(x) for x in sizes],
+            'vmax_ov': float((ovarian_params or simulation.ovarian_params)['vmax']),
+            'vmax_om': float((omental_params or simulation.omental_params)['vmax']),
+            'limit_ca125': float(simulation.LIMIT_CA if limit_ca is None else limit_ca),
+            'limit_US': float(simulation.LIMIT_US if limit_us is None else limit_us),
+            'V0': float(simulation.V0 if V0 is None else V0), 'model': get_model(model).name}
+    return write_store(path, (encode_compact(chunk, sizes) for chunk in chunks), n_rows, meta)
+
+
+def decode_compact(chunk, meta, start=0, columns=None):
+    '''
+    Columns of the simulation (COLUMNS of kinetics/simulation.py, or log10_met_size_at_ca125 / log10_met_size_at_US)
+    from a chunk of a compact store whose first row is the tumour start
+    '''
+    from kinetics.models import get_model
+    from kinetics.simulation import COLUMNS
+    model = get_model(meta.get('model', 'gompertz')) # stores written before the models were added are Gompertz
+    columns = COLUMNS if columns is None else columns
+    omental = np.asarray(chunk['omental'], dtype=bool)
+    n = len(omental)
+    V0 = meta['V0']
+    K_ov, K_om = np.log(meta['vmax_ov'] / V0), np.log(meta['vmax_om'] / V0)
+    K = np.where(omental, K_om, K_ov)
+    beta_pt = np.asarray(chunk['beta_pt'], dtype=float)
+    size_at_met = np.asarray(meta['sizes'])[chunk['size_ix']]
+
+    out = {'ix': np.arange(start, start + n), 'omental': omental, 'size_at_met': size_at_met, 'beta_pt': beta_pt}
+    if any(c not in out for c in columns):
+        out['time_to_met'] = model.time_to_volume(size_at_met, beta_pt, K, V0)
+        out['time_to_ca125'] = model.time_to_volume(meta['limit_ca125'], beta_pt, K, V0)
+        out['time_to_US'] = model.time_to_volume(meta['limit_US'], beta_pt, K, V0)
+        out['beta_met'] = np.asarray(chunk['beta_met'], dtype=float)
+        K_met = np.where(omental, K_ov, K_om)
+        for name in ['ca125', 'US']:
+            if 'met_size_at_' + name in columns or 'log10_met_size_at_' + name in columns:
+                log_size = model.log_V(out['time_to_' + name] - out['time_to_met'], K_met, out['beta_met'], V0)
+                out['met_size_at_' + name] = np.exp(log_size)
+                out['log10_met_size_at_' + name] = log_size / np.log(10)
+    return {col: out[col] for col in columns}
+
+
+def iter_compact_chunks(path, chunk_size, columns=None):
+    '''
+    Iterate over a store with the compact schema in chunks of rows, decoded to the columns of the simulation
+    '''
+    meta = read_meta(path)
+    store = load_store(path, list(COMPACT_DTYPES))
+    for start in range(0, meta['n_rows'], chunk_size):
+        chunk = {col: np.asarray(array[start:start + chunk_size]) for col, array in store.items()}
+        yield decode_compact(chunk, meta, start, columns)
@@ -0,0 +1,108 @@
+'''
+Sweep over detection limits for the simulated population.
+
+The time for a primary to reach a volume L is t = -1/beta * ln(1 - ln(L/V0)/K), where only beta depends on the tumour.
+c(L) = -ln(1 - ln(L/V0)/K) is computed once per detection limit and site, and the detection times of all the
+tumours for all the limits are the outer product c(L) * (1 / beta_pt). The fraction of tumours detected before
+metastasis and the WOO summaries are gathered per limit with the aggregators of kinetics/aggregate.py, so thousands
+of limits are evaluated in a single pass over the simulation chunks. The time to reach a volume is c / beta for the
+other growth models of kinetics/models.py as well, with their own invariant c.
+'''
+import numpy as np
+import pandas as pd
+
+from kinetics.aggregate import DAYS_TO_MONTHS, Moments, QuantileSketch
+from kinetics.models import get_model
+from kinetics.simulation import V0, ovarian_params, omental_params
+
+
+def detection_invariant(limits, vmax, V0=V0, model='gompertz'):
+    '''
+    c = -ln(1 - ln(limit/V0)/K) with K = ln(vmax/V0), so that the time to reach each limit is c / beta.
+    Limits that are never reached (limit >= vmax) get c = inf. For the other models, their invariant (kinetics/models.py).
+    '''
+    return get_model(model).invariant(limits, np.log(vmax / V0), V0)
+
+
+class ThresholdSweep:
+    '''
+    For every detection limit (cm3): how many tumours reach it before metastasis and the moments and quantiles
+    of the WOO (months) for those tumours, as WOOAggregator does for the CA125 and US limits
+
+    Parameters
+    ----------
+    limits : detection limits (cm3)
+    ovarian_params, omental_params : dicts with 'vmax', as in kinetics/simulation.py
+    max_elements : maximum size of the (limits x tumours) arrays, chunks are split into blocks to stay below it
+    model : growth model the chunks were simulated with (kinetics/models.py)
+    sketch_kwargs : passed on to QuantileSketch
+    '''
+    def __init__(self, limits, ovarian_params=ovarian_params, omental_params=omental_params, max_elements=10 ** 7,
+                 model='gompertz', **sketch_kwargs):
+        self.limits = np.asarray(limits, dtype=float)
+        # Invariants of the Gompertz inverse for each limit, when the primary is ovarian / omental
+        self.c_ov = detection_invariant(self.limits, ovarian_params['vmax'], model=model)
+        self.c_om = detection_invariant(self.limits, omental_params['vmax'], model=model)
+        self.max_elements = max_elements
+        self.n_total = 0
+        self.n_before_met = np.zeros(len(self.limits), dtype=np.int64)
+        self.moments = Moments(shape=len(self.limits))
+        self.sketch = QuantileSketch(shape=len(self.limits), **sketch_kwargs)
+
+    def update(self, chunk):
+        '''
+        Add a chunk of simulations (dict of arrays or DataFrame with omental, beta_pt and time_to_met)
+        '''
+        omental = np.asarray(chunk['omental'], dtype=bool)
+        inv_beta = 1 / np.asarray(chunk['beta_pt'], dtype=float)
+        time_to_met = np.asarray(chunk['time_to_met'], dtype=float)
+        step = max(1, self.max_elements // len(self.limits))
+        for start in range(0, len(time_to_met), step):
+            s = slice(start, start + step)
+            # Detection time of every tumour for every limit: (limits x tumours)
+            c = np.where(omental[s], self.c_om[:, None], self.c_ov[:, None])
+            time_to_detect = c * inv_beta[s]
+            b4_mets = time_to_met[s] > time_to_detect
+            woo = (time_to_met[s] - time_to_detect) * DAYS_TO_MONTHS
+            self.n_before_met += b4_mets.sum(axis=1)
+            self.moments.update(woo, b4_mets)
+            self.sketch.update(woo, b4_mets)
+        self.n_total += len(time_to_met)
+        return self
+
+    def merge(self, other):
+        '''
+        Combine with a sweep over the same limits filled from another part of the population
+        '''
+        if not np.array_equal(self.limits, other.limits):
+            raise ValueError('Only sweeps over the same detection limits can be merged')
+        self.n_total += other.n_total
+        self.n_before_met += other.n_before_met
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def summary(self):
+        '''
+        DataFrame indexed by the detection limit with the number and fraction of tumours detected before metastasis
+        and the summary of their WOO (months) in the layout of pandas describe
+        '''
+        m = self.moments
+        q25, q50, q75 = np.moveaxis(self.sketch.quantile([0.25, 0.5, 0.75]), -1, 0)
+        seen = m.count > 0
+        return pd.DataFrame({'n_before_met': self.n_before_met,
+                             'fraction_before_met': self.n_before_met / max(self.n_total, 1),
+                             'count': m.count.astype(float), 'mean': np.where(seen, m.mean, np.nan), 'std': m.std,
+                             'min': np.where(seen, m.min, np.nan), '25%': q25, '50%': q50, '75%': q75,
+                             'max': np.where(seen, m.max, np.nan)},
+                            index=pd.Index(self.limits, name='limit'))
+
+
+def sweep_thresholds(chunks, limits, **kwargs):
+    '''
+    Fill a ThresholdSweep from an iterable of chunks (e.g. simulate_chunks or iter_store_chunks)
+    '''
+    sweep = ThresholdSweep(limits, **kwargs)
+    for chunk in chunks:
+        sweep.update(chunk)
+    return sweep
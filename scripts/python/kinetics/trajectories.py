@@ -0,0 +1,192 @@
+'''
+Volume trajectories of the simulated tumours and their population fan charts.
+
+For every tumour of the simulation chunks, the primary grows from the onset (t = 0) as V(t, K, beta_pt) and the
+metastasis from the onset of metastasis (time_to_met) as V(t - time_to_met, K_met, beta_met), 0 before it. The
+trajectories are evaluated on a time grid in blocks of at most max_elements (tumours x time points), and FanChart
+streams them into one quantile sketch per time point and series (primary, metastasis and their sum), so the memory
+used depends on the grid and not on the number of tumours. The quantiles (median, IQR, 95% band) and densities of the
+volumes at every time point come from the sketches; the tumours without a metastasis yet are counted apart.
+'''
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from kinetics.aggregate import DAYS_TO_MONTHS, QuantileSketch
+from kinetics.models import get_model
+from kinetics.simulation import V0, ovarian_params, omental_params, _simulate_shard
+
+
+GRID = np.linspace(0, 3650, 241) # days since the onset of the primary (10 years, every ~15 days)
+SERIES = ['primary', 'met', 'total'] # total is the tumour burden, primary + metastasis
+QUANTILES = [0.025, 0.25, 0.5, 0.75, 0.975]
+
+
+def trajectory_chunks(chunks, grid=GRID, vmax_ov=ovarian_params['vmax'], vmax_om=omental_params['vmax'], V0=V0,
+                      max_elements=5 * 10 ** 6, model='gompertz'):
+    '''
+    Volume curves (cm3) of the tumours of each chunk on the time grid
+
+    Parameters
+    ----------
+    chunks : iterable of chunks with omental, beta_pt, beta_met and time_to_met (e.g. simulate_chunks)
+    grid : times since the onset of the primary (days)
+    vmax_ov, vmax_om : max volumes (cm3) of the two sites
+    max_elements : maximum size of the (tumours x time points) arrays yielded
+    model : growth model the chunks were simulated with (kinetics/models.py)
+
+    Returns
+    -------
+    generator of dicts with ix (index of each tumour), primary and met (tumours x time points)
+    '''
+    grid = np.asarray(grid, dtype=float)
+    V = get_model(model).V
+    K_ov, K_om = np.log(vmax_ov / V0), np.log(vmax_om / V0)
+    step = max(1, max_elements // len(grid))
+    for chunk in chunks:
+        omental = np.asarray(chunk['omental'], dtype=bool)
+        beta_pt, beta_met = np.asarray(chunk['beta_pt'], dtype=float), np.asarray(chunk['beta_met'], dtype=float)
+        time_to_met = np.asarray(chunk['time_to_met'], dtype=float)
+        ix = np.asarray(chunk['ix']) if 'ix' in chunk else np.arange(len(omental))
+        for start in range(0, len(omental), step):
+            s = slice(start, start + step)
+            # When the ovarian is the primary, omental is the metastatic site and vice versa
+            K = np.where(omental[s], K_om, K_ov)[:, None]
+            K_met = np.where(omental[s], K_ov, K_om)[:, None]
+            t_met = grid - time_to_met[s][:, None]
+            yield {'ix': ix[s],
+                   'primary': V(grid, K, beta_pt[s][:, None], V0),
+                   'met': np.where(t_met >= 0, V(np.maximum(t_met, 0), K_met, beta_met[s][:, None], V0), 0.)}
+
+
+def _quantiles(sketch, n_zero, q):
+    # Quantiles of the values of each sketch and n_zero zeros (the zeros rank first)
+    q = np.asarray(q, dtype=float)
+    cum = np.cumsum(sketch.counts, axis=-1) + n_zero[:, None]
+    total = cum[:, -1]
+    rank = q[None, :] * (total[:, None] - 1)
+    i = np.sum(cum[:, None, :] <= rank[..., None], axis=-1)
+    gamma = (1 + sketch.accuracy) / (1 - sketch.accuracy)
+    values = 2 * np.exp((i + sketch.offset) * sketch.log_gamma) / (gamma + 1)
+    values = np.where(rank < n_zero[:, None], 0., values)
+    return np.where(total[:, None] > 0, values, np.nan)
+
+
+class FanChart:
+    '''
+    Quantiles and densities over the population of the primary, metastatic and total volumes at every time point
+
+    Parameters
+    ----------
+    grid : times since the onset of the primary (days), as in trajectory_chunks
+    sketch_kwargs : passed on to QuantileSketch (accuracy, min_value, max_value)
+    '''
+    def __init__(self, grid=GRID, **sketch_kwargs):
+        self.grid = np.asarray(grid, dtype=float)
+        self.n_total = 0
+        self.sketches = {name: QuantileSketch(shape=len(self.grid), **sketch_kwargs) for name in SERIES}
+        self.n_zero = {name: np.zeros(len(self.grid), dtype=np.int64) for name in SERIES} # no volume yet
+
+    def update(self, trajectories):
+        '''
+        Add a block of trajectories (trajectory_chunks)
+        '''
+        volumes = {'primary': trajectories['primary'], 'met': trajectories['met']}
+        volumes['total'] = volumes['primary'] + volumes['met']
+        for name, v in volumes.items():
+            v = v.T # (time points x tumours), one sketch per time point
+            positive = v > 0
+            self.n_zero[name] += len(positive[0]) - positive.sum(axis=1)
+            self.sketches[name].update(np.where(positive, v, 1.), positive)
+        self.n_total += len(volumes['primary'])
+        return self
+
+    def merge(self, other):
+        '''
+        Combine with a fan chart over the same grid filled from another part of the population
+        '''
+        if not np.array_equal(self.grid, other.grid):
+            raise ValueError('Only fan charts over the same time grid can be merged')
+        self.n_total += other.n_total
+        for name in SERIES:
+            self.sketches[name].merge(other.sketches[name])
+            self.n_zero[name] += other.n_zero[name]
+        return self
+
+    def quantiles(self, name, q=QUANTILES):
+        '''
+        Quantile(s) q of the volumes (cm3) of a series at every time point (time points x quantiles)
+        '''
+        return _quantiles(self.sketches[name], self.n_zero[name], q)
+
+    def density(self, name, edges):
+        '''
+        Fraction of the tumours with a volume in each bin of edges (cm3) at every time point (time points x bins).
+        The tumours with no volume yet are in no bin.
+        '''
+        sketch = self.sketches[name]
+        gamma = (1 + sketch.accuracy) / (1 - sketch.accuracy)
+        mid = 2 * np.exp((np.arange(sketch.counts.shape[-1]) + sketch.offset) * sketch.log_gamma) / (gamma + 1)
+        # Each bucket of the sketch goes to the bin of its mid-point
+        bins = np.digitize(mid, edges) - 1
+        inside = (bins >= 0) & (bins < len(edges) - 1)
+        counts = np.zeros((len(self.grid), len(edges) - 1), dtype=np.int64)
+        np.add.at(counts.T, bins[inside], sketch.counts[:, inside].T)
+        return counts / max(self.n_total, 1)
+
+    def summary(self, q=QUANTILES):
+        '''
+        DataFrame indexed by the time since the onset of the primary (months) with the quantiles of each series (cm3),
+        e.g. primary_q50 or met_q97.5, and the fraction of the tumours that have metastasised
+        '''
+        df = pd.DataFrame(index=pd.Index(self.grid * DAYS_TO_MONTHS, name='months'))
+        for name in SERIES:
+            for label, values in zip(q, self.quantiles(name, q).T):
+                df['{}_q{:g}'.format(name, 100 * label)] = values
+        df['fraction_with_met'] = 1 - self.n_zero['met'] / max(self.n_total, 1)
+        return df
+
+
+def fan_chart(chunks, grid=GRID, max_elements=5 * 10 ** 6, sketch_kwargs=None, **kwargs):
+    '''
+    Fill a FanChart from an iterable of simulation chunks (e.g. simulate_chunks or iter_store_chunks)
+    kwargs : passed on to trajectory_chunks (vmax_ov, vmax_om, V0, model)
+    '''
+    chart = FanChart(grid, **(sketch_kwargs or {}))
+    for block in trajectory_chunks(chunks, grid, max_elements=max_elements, **kwargs):
+        chart.update(block)
+    return chart
+
+
+def _run_shard(args):
+    '''
+    Simulate one shard (as simulate_chunks does) and fill its fan chart (top level so that it can be sent to workers)
+    '''
+    shard, grid, max_elements, sketch_kwargs = args
+    kwargs = shard[-1] # of simulate_tumours, the curves use the same max volumes and model
+    return fan_chart([_simulate_shard(shard)], grid, max_elements, sketch_kwargs,
+                     vmax_ov=kwargs.get('ovarian_params', ovarian_params)['vmax'],
+                     vmax_om=kwargs.get('omental_params', omental_params)['vmax'], model=kwargs.get('model', 'gompertz'))
+
+
+def simulate_fan_chart(n, chunk_size=100000, seed=None, workers=1, grid=GRID, max_elements=5 * 10 ** 6,
+                       sketch_kwargs=None, **kwargs):
+    '''
+    Fan chart of n tumours simulated in chunks, the chunks simulated and summarised on workers processes.
+    The chunks are the ones of simulate_chunks(n, chunk_size, seed) and the result does not depend on workers.
+    kwargs : passed on to simulate_tumours
+    '''
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    starts = range(0, n, chunk_size)
+    shards = [((min(chunk_size, n - start), start, child, kwargs), grid, max_elements, sketch_kwargs)
+              for start, child in zip(starts, seed_seq.spawn(len(starts)))]
+    chart = FanChart(grid, **(sketch_kwargs or {}))
+    if workers <= 1:
+        for shard in shards:
+            chart.merge(_run_shard(shard))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for part in executor.map(_run_shard, shards):
+                chart.merge(part)
+    return chart
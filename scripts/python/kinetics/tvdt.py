@@ -0,0 +1,105 @@
+'''
+Tumour volume doubling times for any number of scans per patient.
+
+With V = V0 exp(r*t), ln(V) is linear in t and the growth rate r of every lesion is the least squares slope of
+ln(V) against the time of its valid scans, tvdt = ln(2) / r. With two scans this is t * ln(2) / ln(V/V0) as in
+I_calculate_tvdts.py. The scans are sorted by patient and time once, and the sums the slopes are made of are
+taken over the contiguous block of each patient with np.add.reduceat, so there is no per patient Python code.
+'''
+import numpy as np
+import pandas as pd
+
+
+SITES = ['ov', 'om']
+
+
+def group_bounds(ids, t=None):
+    '''
+    Order of the scans sorted by patient (and time) and the start of each patient's block in that order
+
+    Returns
+    -------
+    order : indices that sort the scans
+    keys : id of each patient
+    starts : index of the first scan of each patient in the sorted scans
+    '''
+    ids = np.asarray(ids)
+    if t is None:
+        order = np.argsort(ids, kind='stable')
+    else:
+        order = np.lexsort((np.asarray(t), ids))
+    sorted_ids = ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    return order, sorted_ids[starts], starts
+
+
+def log_linear_fit(starts, t, y, w):
+    '''
+    Weighted least squares slope of y against t within each block of sorted scans
+
+    Parameters
+    ----------
+    starts : start of each block (group_bounds)
+    t, y : times and log volumes of the sorted scans
+    w : weight of each scan (1 for the valid scans, 0 for the others)
+
+    Returns
+    -------
+    slope : slope of each block, nan where there are fewer than two distinct valid times
+    n : number of valid scans in each block
+    '''
+    t, y, w = np.asarray(t, dtype=float), np.asarray(y, dtype=float), np.asarray(w, dtype=float)
+    y = np.where(w > 0, y, 0.) # invalid volumes (e.g. nan) have no weight
+    sum_w = np.add.reduceat(w, starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Centre the times on the (weighted) mean of their block first, to keep the sums well conditioned
+        t_mean = np.add.reduceat(w * t, starts) / sum_w
+        dt = t - np.repeat(t_mean, np.diff(np.r_[starts, len(t)]))
+        dt = np.where(w > 0, dt, 0.)
+        sxx = np.add.reduceat(w * dt * dt, starts)
+        sxy = np.add.reduceat(w * dt * y, starts)
+        slope = np.where(sxx > 0, sxy / sxx, np.nan)
+    return slope, sum_w.astype(np.int64)
+
+
+def calculate_tvdts(vols, sites=SITES):
+    '''
+    Growth rates and doubling times of the lesions from a table of scans in the layout of raw_volumes.csv
+    (anon_id, dt and vol_<site>, valid_<site> per site). Patients can have any number of scans, in any order.
+
+    Returns
+    -------
+    DataFrame with one row per patient (sorted by anon_id): the time of the last scan (dt) and per site the ratio of
+    the last to the first valid volume (ratio_<site>), the doubling time from the log-linear fit (tvdt_<site>, in days)
+    and the number of valid scans (n_<site>)
+    '''
+    order, keys, starts = group_bounds(vols['anon_id'], vols['dt'])
+    t = np.asarray(vols['dt'], dtype=float)[order]
+    ends = np.r_[starts[1:], len(t)] - 1
+
+    tvdt = pd.DataFrame({'anon_id': keys, 'dt': np.asarray(vols['dt'])[order][ends]})
+    tvdts, counts = {}, {}
+    for site in sites:
+        valid = np.asarray(vols['valid_' + site])[order] >= 1
+        vol = np.asarray(vols['vol_' + site], dtype=float)[order]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            logv = np.log(vol)
+        slope, n = log_linear_fit(starts, t, logv, valid)
+
+        # First and last valid scan of each patient: V_last / V_first
+        idx = np.arange(len(t))
+        first = np.minimum.reduceat(np.where(valid, idx, len(t)), starts)
+        last = np.maximum.reduceat(np.where(valid, idx, -1), starts)
+        seen = n > 0
+        ratio = np.full(len(keys), np.nan)
+        ratio[seen] = vol[last[seen]] / vol[first[seen]]
+
+        tvdt['ratio_' + site] = ratio
+        with np.errstate(divide='ignore'):
+            tvdts[site] = np.log(2) / slope
+        counts[site] = n
+    for site in sites:
+        tvdt['tvdt_' + site] = tvdts[site]
+    for site in sites:
+        tvdt['n_' + site] = counts[site]
+    return tvdt
@@ -0,0 +1,78 @@
+'''
+Time to metastasis (TTM) and window of opportunity (WOO) of the patients with growing ovarian and omental lesions.
+
+This is the table of plot/figure_3.py computed on whole columns: the time for each lesion to reach a detection limit
+is the inverse Gompertz function of its beta (or the inverse of another model of kinetics/models.py), and the WOO
+and the size of the primary at the onset of metastasis follow from the difference between the t1 of the two sites.
+The sizes at metastasis are what the simulator draws from (pt_size_at_met in kinetics/simulation.py).
+'''
+import numpy as np
+import pandas as pd
+
+from kinetics.models import get_model
+from kinetics.simulation import V0, LIMIT_CA, LIMIT_US, ovarian_params, omental_params
+
+
+LIMITS = {'us': LIMIT_US, 'ca': LIMIT_CA} # detection limits (cm3) by modality
+
+
+def both_sites(ov_params, om_params):
+    '''
+    Patients with individual Gompertz parameters for both sites (id, beta_ov, t1_ov, beta_om, t1_om),
+    from the tables of gompertz_params_ov.csv and gompertz_params_om.csv (load_gompertz_params)
+    '''
+    df = pd.merge(ov_params, om_params, on='id', suffixes=('_ov', '_om'), how='outer')
+    df = df.reset_index().rename(columns={df.index.name: 'anon_id'})
+    return df.dropna()
+
+
+def ttm_woo(df, limits=LIMITS, vmax_ov=ovarian_params['vmax'], vmax_om=omental_params['vmax'], V0=V0, model='gompertz'):
+    '''
+    TTM, detection times, WOO and size of the primary at metastasis for every patient
+
+    Parameters
+    ----------
+    df : DataFrame with beta_ov, t1_ov, beta_om and t1_om (days), e.g. from both_sites
+    limits : dict of detection limits (cm3) by modality
+    vmax_ov, vmax_om : max volumes (cm3) of the two sites
+    model : growth model the parameters were fitted with (kinetics/models.py)
+
+    Returns
+    -------
+    copy of df with
+        d_t1, d_t1_abs : t1_ov - t1_om and its absolute value, the time between the onset of the two lesions (days)
+        t_detect_<site>_<modality> : time for the lesion to reach the detection limit (days)
+        WOO_met_init_<modality> : time between the primary reaching the detection limit and the onset of metastasis
+                                  (days), negative when the primary is only detectable after metastasis
+        size_at_met : volume of the primary at the onset of metastasis (cm3)
+    '''
+    model = get_model(model)
+    K_ov, K_om = np.log(vmax_ov / V0), np.log(vmax_om / V0)
+    beta_ov, beta_om = df['beta_ov'].values, df['beta_om'].values
+    t1_ov, t1_om = df['t1_ov'].values, df['t1_om'].values
+
+    out = df.copy()
+    d_t1 = t1_ov - t1_om
+    out['d_t1'] = d_t1
+    out['d_t1_abs'] = np.abs(d_t1)
+    for modality, limit in limits.items():
+        t_ov = model.time_to_volume(limit, beta_ov, K_ov, V0)
+        t_om = model.time_to_volume(limit, beta_om, K_om, V0)
+        out['t_detect_ov_' + modality] = t_ov
+        out['t_detect_om_' + modality] = t_om
+    for modality in limits:
+        # The WOO isn't t_detect_ov - t1_om because t1_ov/om is the time from the onset of the ovarian/omental lesion
+        # to the first scan. It is instead t1_ov - t_detect_ov - t1_om (or the same with the sites swapped)
+        out['WOO_met_init_' + modality] = np.maximum(t1_ov - out['t_detect_ov_' + modality].values - t1_om,
+                                                     t1_om - out['t_detect_om_' + modality].values - t1_ov)
+    # The primary is the site that started first (d_t1 > 0: ovarian)
+    out['size_at_met'] = np.where(d_t1 > 0, model.V(d_t1, K_ov, beta_ov, V0), model.V(-d_t1, K_om, beta_om, V0))
+    return out
+
+
+def sizes_at_met(ov_params, om_params, **kwargs):
+    '''
+    Sorted sizes of the primary at the onset of metastasis (cm3) of the patients with both sites,
+    to pass to simulate_tumours(sizes=...) in place of pt_size_at_met
+    '''
+    return np.sort(ttm_woo(both_sites(ov_params, om_params), **kwargs)['size_at_met'].values)
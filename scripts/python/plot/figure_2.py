@@ -6,12 +6,16 @@ import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 import os
+import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # kinetics, if it is not installed
+from kinetics.io import OUTPUT_DIR, PATH_TO_VOLUMES
 
-# Paths
-path_to_volumes = '../../../data/raw_volumes.csv'
-path_to_tvdts = '../../../output/tvdts.csv'
-path_for_output = '../../../output/plots/'
+
+# Paths (resolved from the repository, so the script can be run from any folder)
+path_to_volumes = PATH_TO_VOLUMES
+path_to_tvdts = os.path.join(OUTPUT_DIR, 'tvdts.csv')
+path_for_output = os.path.join(OUTPUT_DIR, 'plots', '')
 
 if not os.path.exists(path_for_output):
     os.makedirs(path_for_output)
@@ -35,7 +39,8 @@ print(growth_rates[growth_rates.tvdt_om.gt(0)].tvdt_om.apply(lambda x: x * 12 /
 '''
 X = [growth_rates[growth_rates.tvdt_ov.gt(0)].tvdt_ov.values * 12 / 365,
      growth_rates[growth_rates.tvdt_om.gt(0)].tvdt_om.values * 12 / 365]
-plt.boxplot(X, labels=['Ovarian', 'Omental'])
+plt.boxplot(X)
+plt.xticks([1, 2], ['Ovarian', 'Omental']) # boxplot(labels=) was removed from matplotlib
 
 # Add jitter
 for e, i in enumerate(X):
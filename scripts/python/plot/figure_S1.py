@@ -2,12 +2,20 @@
 Script to just plot all the volumes from the 34 patients..
 the ones we discard will be in red lines and red crosses/dots
 '''
+import os
+import sys
+
 import pandas as pd
 import matplotlib.pyplot as plt
 
-# Paths
-path_to_volumes = './../../../data/raw_volumes.csv'
-path_for_output = './../../../output/plots/suppmat/'
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # kinetics, if it is not installed
+from kinetics.io import OUTPUT_DIR, PATH_TO_VOLUMES
+
+# Paths (resolved from the repository, so the script can be run from any folder)
+path_to_volumes = PATH_TO_VOLUMES
+path_for_output = os.path.join(OUTPUT_DIR, 'plots', 'suppmat', '')
+if not os.path.exists(path_for_output):
+    os.makedirs(path_for_output)
 
 vols = pd.read_csv(path_to_volumes)
 vols = vols.sort_values(by=['anon_id', 'dt'])
@@ -2,15 +2,21 @@
 Script to plot violin plots for all the measurement error sensitivity runs from Matlab
 """
 import os
+import sys
 
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # kinetics, if it is not installed
+from kinetics import lognormal
+from kinetics.io import OUTPUT_DIR, SENSITIVITY_DIR
 
-# Paths
-path_to_sensitivity = './../../../output/sensitivity-analysis/measurement_10per_{}.csv'
-path_for_output = './../../../output/plots/suppmat'
+ANALYTIC = True # Draw the violins from the closed form lognormal density of t1 instead of a KDE of 50,000 samples per run
+
+# Paths (resolved from the repository, so the script can be run from any folder)
+path_to_sensitivity = os.path.join(SENSITIVITY_DIR, 'measurement_10per_{}.csv')
+path_for_output = os.path.join(OUTPUT_DIR, 'plots', 'suppmat')
 if not os.path.exists(path_for_output):
     os.makedirs(path_for_output)
 
@@ -34,19 +40,23 @@ for site, val in sites.items():
     df['std_est'] = np.sqrt(df['sd-logq'] + df['sd-logbeta'])
     df['diff_std'] = np.abs(df['std_est'] - df['std-logt1']) / df['std-logt1']
 
-    # Now draw from the distribution of log-t1 with 50,000 samples
-    data = [np.random.lognormal(mean, sigma, 50000) for mean, sigma in zip(df['mean-logt1'].values, df['std-logt1'].values)]
+    if ANALYTIC:
+        # Create a violin plot from the exact distribution of t1
+        lognormal.violinplot(plt.gca(), df['mu_est'].values, df['std_est'].values, scale=12 / 365, points=500)
+    else:
+        # Now draw from the distribution of log-t1 with 50,000 samples
+        data = [np.random.lognormal(mean, sigma, 50000) for mean, sigma in zip(df['mean-logt1'].values, df['std-logt1'].values)]
 
-    # Creating a DataFrame for plotting
-    df_plot = pd.DataFrame({f'Dist {i + 1}': dist for i, dist in enumerate(data)})
+        # Creating a DataFrame for plotting
+        df_plot = pd.DataFrame({f'Dist {i + 1}': dist for i, dist in enumerate(data)})
 
-    # Create a violin plot
-    plt.violinplot(df_plot * 12 / 365, showmedians=True, showextrema=False, points=500) #, quantiles=[[0.25, 0.75]]*20)
+        # Create a violin plot
+        plt.violinplot(df_plot * 12 / 365, showmedians=True, showextrema=False, points=500) #, quantiles=[[0.25, 0.75]]*20)
     plt.ylim([0, 100])
     plt.xticks([])
 
     # Plot the median from the no-noise case taken directly from the data
-    plt.plot([0.5, 20.5], [val, val], 'r--', linewidth=1)
+    plt.plot([0.5, len(df) + 0.5], [val, val], 'r--', linewidth=1)
 
     # Customizing the plot
     plt.xlabel('Runs', fontsize=18)
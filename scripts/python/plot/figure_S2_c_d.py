@@ -1,18 +1,25 @@
 """
-Script to plot violin plots for all the vmax sensitivity runs from Matlab
+Script to plot violin plots for all the vmax sensitivity runs from Matlab (vmax_<site>.csv)
+or, with USE_SWEEP, from the table of run_vmax_sensitivity.py (vmax_sweep.csv, indexed by site and vmax)
 """
 import os
+import sys
 
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # kinetics, if it is not installed
+from kinetics import lognormal
+from kinetics.io import OUTPUT_DIR, SENSITIVITY_DIR
 
-Vmaxs = np.linspace(2000, 10000, 17)
+ANALYTIC = True # Draw the violins from the closed form lognormal density of t1 instead of a KDE of 50,000 samples per run
+USE_SWEEP = False # Plot vmax_sweep.csv of run_vmax_sensitivity.py instead of the MATLAB outputs
 
-# Paths
-path_to_sensitivity = './../../../output/sensitivity-analysis/vmax_{}.csv'
-path_for_output = './../../../output/plots/suppmat/'
+# Paths (resolved from the repository, so the script can be run from any folder)
+path_to_sensitivity = os.path.join(SENSITIVITY_DIR, 'vmax_{}.csv')
+path_to_sweep = os.path.join(SENSITIVITY_DIR, 'vmax_sweep.csv')
+path_for_output = os.path.join(OUTPUT_DIR, 'plots', 'suppmat', '')
 if not os.path.exists(path_for_output):
     os.makedirs(path_for_output)
 
@@ -21,19 +28,33 @@ sites = {'ov': 5000,
 fig_names = {'ov': 'c',
          'om': 'd'}
 for site, vmax in sites.items():
-    df = pd.read_csv(path_to_sensitivity.format(site))
-    data = [np.random.lognormal(mean, sigma, 50000) for mean, sigma in zip(df['mean-logt1'].values, df['std-logt1'].values)]
+    if USE_SWEEP:
+        df = pd.read_csv(path_to_sweep, index_col=['site', 'vmax']).loc[site].reset_index()
+    else:
+        df = pd.read_csv(path_to_sensitivity.format(site))
+    # The MATLAB outputs have no vmax column, they are on the 2000:500:10000 grid
+    Vmaxs = df['vmax'].values if 'vmax' in df else np.linspace(2000, 10000, len(df))
+    if ANALYTIC:
+        # Exact distribution of t1 from the fixed effects and variances of log(beta) and log(q)
+        mu, sigma = lognormal.logt1_moments(df['fe-logbeta'], df['fe-logq'], df['sd-logbeta'], df['sd-logq'])
+        lognormal.violinplot(plt.gca(), mu, sigma, scale=12 / 365, points=500)
+    else:
+        data = [np.random.lognormal(mean, sigma, 50000) for mean, sigma in zip(df['mean-logt1'].values, df['std-logt1'].values)]
 
-    # Creating a DataFrame for plotting
-    df_plot = pd.DataFrame({f'{int(Vmaxs[i])}': dist for i, dist in enumerate(data)})
+        # Creating a DataFrame for plotting
+        df_plot = pd.DataFrame({f'{int(Vmaxs[i])}': dist for i, dist in enumerate(data)})
 
-    plt.violinplot(df_plot * 12 / 365, showmedians=True, showextrema=False, points=500) #, quantiles=[[0.25, 0.75]]*20)
+        plt.violinplot(df_plot * 12 / 365, showmedians=True, showextrema=False, points=500) #, quantiles=[[0.25, 0.75]]*20)
     plt.ylim([0, 100])
     plt.xticks(ticks=np.arange(1, len(Vmaxs)+1), labels=['{}'.format(int(i)) for i in Vmaxs], rotation=45, fontsize=16)
 
-    # Plot a horizontal line at the median value of either 5000 or 3000
-    y_val = df_plot[str(vmax)].median() * 12 / 365
-    plt.plot([0.5, 17.5], [y_val, y_val], 'r--', linewidth=1)
+    # Plot a horizontal line at the median value of either 5000 or 3000 (the nearest Vmax of the grid)
+    ref = np.argmin(np.abs(Vmaxs - vmax))
+    if ANALYTIC:
+        y_val = np.exp(np.asarray(mu)[ref]) * 12 / 365
+    else:
+        y_val = df_plot.iloc[:, ref].median() * 12 / 365
+    plt.plot([0.5, len(Vmaxs) + 0.5], [y_val, y_val], 'r--', linewidth=1)
 
     # Customizing the plot
     plt.xlabel('$V_{\infty}$', fontsize=18)
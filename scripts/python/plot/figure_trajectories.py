@@ -0,0 +1,45 @@
+'''
+Script to plot the fan charts of run_trajectories.py: median, interquartile range and 95% band of the primary,
+metastatic and total volumes of the simulated tumours over time
+'''
+import os
+import sys
+
+import pandas as pd
+import matplotlib.pyplot as plt
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # kinetics, if it is not installed
+from kinetics.io import OUTPUT_DIR, SIMULATIONS_DIR
+
+# Paths (resolved from the repository, so the script can be run from any folder)
+path_to_trajectories = os.path.join(SIMULATIONS_DIR, 'trajectories.csv')
+path_for_output = os.path.join(OUTPUT_DIR, 'plots', 'suppmat', '')
+if not os.path.exists(path_for_output):
+    os.makedirs(path_for_output)
+
+fan = pd.read_csv(path_to_trajectories)
+T = fan['months']
+
+fig, axes = plt.subplots(1, 3, figsize=(15, 5), sharey=True)
+for ax, name, title in zip(axes, ['primary', 'met', 'total'], ['Primary', 'Metastasis', 'Total']):
+    ax.fill_between(T, fan[name + '_q2.5'], fan[name + '_q97.5'], color='tab:blue', alpha=0.2, lw=0, label='95%')
+    ax.fill_between(T, fan[name + '_q25'], fan[name + '_q75'], color='tab:blue', alpha=0.4, lw=0, label='IQR')
+    ax.plot(T, fan[name + '_q50'], color='tab:blue', label='Median')
+    ax.set_title(title, fontsize=18)
+    ax.set_xlabel('Time (months)', fontsize=18)
+    ax.tick_params(axis='x', labelsize=16)
+    ax.tick_params(axis='y', labelsize=16)
+    ax.set_yscale('log')
+    ax.set_ylim([1e-6, ax.get_ylim()[1]]) # below 1e-6 cm3 the curves only show the V0 of the model
+axes[0].set_ylabel('Volume ($cm^3$)', fontsize=18)
+axes[0].legend(fontsize=14, loc='lower right')
+
+# Fraction of the tumours with a metastasis, on the metastasis panel
+ax = axes[1].twinx()
+ax.plot(T, fan['fraction_with_met'], color='black', ls='--')
+ax.set_ylim([0, 1])
+ax.set_ylabel('Fraction with metastasis', fontsize=16)
+ax.tick_params(axis='y', labelsize=14)
+
+fig.tight_layout()
+fig.savefig(path_for_output + 'figure_trajectories.png')  # Save the figure
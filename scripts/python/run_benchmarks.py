@@ -0,0 +1,42 @@
+'''
+Script to time the stages of the pipeline on synthetic data of increasing size (kinetics/benchmark.py):
+1. The doubling times of I_calculate_tvdts.py
+2. The simulation of II_simulate_population.py
+3. The detection and WOO statistics of III_analyse_simulation_results.py
+4. The TTM / WOO table of plot/figure_3.py
+5. The violin statistics of the Figure S2 scripts
+
+Every case and size runs in its own process with a fixed seed. The wall time, peak memory and throughput are appended
+to output/benchmarks/history.jsonl, and the cases more than THRESHOLD slower (or larger) than in
+output/benchmarks/baseline.json are reported as regressions. Also run by: python -m kinetics bench
+'''
+import os
+
+from kinetics.io import OUTPUT_DIR
+from kinetics.stages import benchmark_stages
+
+
+# Paths (resolved from the repository, so the script can be run from any folder)
+path_for_output = os.path.join(OUTPUT_DIR, 'benchmarks')
+
+CASES = ['tvdt', 'simulate', 'analyse', 'woo', 'violins']
+SCALES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7, 10 ** 8] # Number of rows (scans, tumours, patients or runs)
+# Largest size run for each case: the inputs of tvdt and woo are held in memory (~50 and ~80 bytes per row) and the
+# violins are 500 points each; the simulation and the analysis stream chunks of 10^6 tumours
+MAX_ROWS = {'tvdt': 10 ** 7, 'simulate': 10 ** 8, 'analyse': 10 ** 7, 'woo': 10 ** 7, 'violins': 10 ** 5}
+REPEATS = 1 # The best of REPEATS runs is kept
+THRESHOLD = 0.2 # Relative increase of the wall time or peak memory over the baseline reported as a regression
+SAVE_BASELINE = False # Store this run as the baseline instead of comparing with it
+
+
+if __name__ == '__main__':
+    records, regressions = benchmark_stages(CASES, SCALES, MAX_ROWS, REPEATS, path_for_output, THRESHOLD, SAVE_BASELINE)
+
+    if SAVE_BASELINE:
+        print('\nBaseline of {} benchmarks saved to {}'.format(len(records), path_for_output))
+    elif regressions:
+        print('\n **** {} regression(s) over {:g}% **** \n'.format(len(regressions), 100 * THRESHOLD))
+        for r in regressions:
+            print('{case} n={n:.0e} {metric}: {value:.4g} (baseline {baseline:.4g}, x{ratio:.2f})'.format(**r))
+    else:
+        print('\nNo regressions over {:g}%'.format(100 * THRESHOLD))
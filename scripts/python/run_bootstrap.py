@@ -0,0 +1,34 @@
+'''
+Script to put confidence intervals on the results of II_simulate_population.py and III_analyse_simulation_results.py.
+The simulation takes the NLME estimates of log(beta), p_om = 4/11 and the sizes at metastasis of the 11 cases with
+growing lesions in both sites as exact. Each bootstrap replicate resamples the 11 cases and draws the estimates from
+their sampling distributions, then simulates N_TUMOURS tumours (kinetics/bootstrap.py) to give
+1. The fraction of tumours detected before metastasis by CA125 / US
+2. The mean and quartiles of the WOO for those tumours
+
+Writes the statistics of every replicate to output/simulations/bootstrap.csv. Also run by: python -m kinetics bootstrap
+'''
+import os
+
+from kinetics.io import OUTPUT_DIR, SIMULATIONS_DIR
+from kinetics.stages import bootstrap_population
+
+
+# Paths (resolved from the repository, so the script can be run from any folder)
+path_to_params = OUTPUT_DIR # gompertz_params_<site>.csv
+path_for_output = SIMULATIONS_DIR
+
+N_REPLICATES = 1000 # Number of bootstrap replicates
+N_TUMOURS = 100000 # Number of tumours simulated per replicate
+SEED = 2024 # Master seed, every block of replicates gets its own generator spawned from it
+N_WORKERS = 1 # Number of processes the blocks are run on. The results do not depend on it.
+LEVEL = 0.95 # Confidence level of the intervals
+
+
+if __name__ == '__main__':
+    reps, intervals = bootstrap_population(N_REPLICATES, N_TUMOURS, SEED, N_WORKERS, path_to_params,
+                                           os.path.join(path_for_output, 'bootstrap.csv'), LEVEL)
+
+    print('\n **** {:g}% bootstrap confidence intervals over {} replicates of {} tumours **** \n'.format(
+        100 * LEVEL, N_REPLICATES, N_TUMOURS))
+    print(intervals)
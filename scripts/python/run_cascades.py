@@ -0,0 +1,38 @@
+'''
+Script to simulate metastatic cascades (kinetics/cascade.py): every lesion can seed further lesions in the other
+sites, up to MAX_GENERATIONS generations, and a patient is detected by whichever lesion reaches the CA125 / US
+detection limit first.
+
+The lesions of every site grow with the Gompertz parameters of kinetics/simulation.py and seed when they reach one of
+the sizes of the primary at metastasis. Writes, for each detection limit, the fraction of the patients detected before
+metastasis and their WOO, the fraction detected by a metastasis or by a lesion of each site and the number of lesions
+at detection to output/simulations/cascades.csv. Also run by: python -m kinetics cascades
+'''
+import os
+
+from kinetics.io import SIMULATIONS_DIR
+from kinetics.simulation import ovarian_params, omental_params
+from kinetics.stages import metastatic_cascades
+
+
+# Path (resolved from the repository, so the script can be run from any folder)
+path_for_output = SIMULATIONS_DIR
+
+N_TUMOURS = 1000000 # Number of patients
+CHUNK_SIZE = 100000 # Number of patients simulated at a time
+SEED = 2024 # Master seed, every chunk gets its own generator spawned from it
+N_WORKERS = 1 # Number of processes the chunks are run on. The results do not depend on it.
+# Sites the lesions can grow in. There are no fits for the peritoneal sites other than the omentum: they grow like it.
+SITES = {'ov': ovarian_params, 'om': omental_params, 'peritoneum': omental_params}
+SEEDS_PER_LESION = 1 # Number of lesions each lesion seeds
+MAX_GENERATIONS = 2 # Lesions of this generation do not seed (the primary is generation 0, its metastases 1)
+MAX_LESIONS = 8 # Lesions per patient at most, patients that would have more are counted as truncated
+
+
+# The guard keeps the worker processes from re-running the script when they import it
+if __name__ == '__main__':
+    summary = metastatic_cascades(N_TUMOURS, CHUNK_SIZE, SEED, N_WORKERS, SITES, SEEDS_PER_LESION, MAX_GENERATIONS,
+                                  MAX_LESIONS, os.path.join(path_for_output, 'cascades.csv'))
+
+    print('\n **** Detection of the metastatic cascades **** \n')
+    print(summary.T.to_string())
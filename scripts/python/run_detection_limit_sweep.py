@@ -0,0 +1,46 @@
+'''
+Script to sweep the detection limit over a grid of volumes and determine for each limit
+1. What proportion of tumours reach it before metastasis
+2. What the WOO is for those tumours
+
+This gives the curves of III_analyse_simulation_results.py as a function of the detection limit (e.g. for a new biomarker),
+from a single pass over the simulations (kinetics/thresholds.py). Also run by: python -m kinetics thresholds
+'''
+import os
+
+import numpy as np
+
+from II_simulate_population import MODEL # growth model the simulations are made with
+from kinetics.io import SIMULATIONS_DIR
+from kinetics.simulation import LIMIT_CA, LIMIT_US
+from kinetics.stages import detection_limit_sweep
+
+
+# Paths (resolved from the repository, so the script can be run from any folder)
+path_to_sims = os.path.join(SIMULATIONS_DIR, 'sims.csv')
+path_to_store = os.path.join(SIMULATIONS_DIR, 'sims')
+path_for_output = SIMULATIONS_DIR
+# 'csv', 'npy', 'simulate' or 'analytic' (exact, without simulations), as in III_analyse_simulation_results.py
+INPUT_FORMAT = 'csv'
+CHUNK_SIZE = 1000000 # Number of simulations read at a time
+
+LIMITS = np.union1d(np.logspace(-4, 1, 2000), [LIMIT_CA, LIMIT_US]) # detection limits (cm3), including the CA125 and US limits
+
+
+if __name__ == '__main__':
+    if INPUT_FORMAT == 'analytic':
+        from kinetics.stages import analyse_analytic
+        summary = analyse_analytic(LIMITS, os.path.join(path_for_output, 'detection_limit_sweep_analytic.csv'))
+    else:
+        if INPUT_FORMAT == 'simulate':
+            from II_simulate_population import N_TUMOURS, SEED, N_WORKERS, CHUNK_SIZE as SIM_CHUNK_SIZE
+            from kinetics.models import model_kwargs
+            from kinetics.simulation import simulate_chunks
+            sims = simulate_chunks(N_TUMOURS, SIM_CHUNK_SIZE, seed=SEED, workers=N_WORKERS, **model_kwargs(MODEL))
+        else:
+            sims = path_to_store if INPUT_FORMAT == 'npy' else path_to_sims
+        summary = detection_limit_sweep(LIMITS, sims, CHUNK_SIZE, os.path.join(path_for_output, 'detection_limit_sweep.csv'),
+                                        MODEL)
+
+    print('\n **** Detection before mets and WOO at the CA125 and US limits **** \n')
+    print(summary.loc[[LIMIT_CA, LIMIT_US]].T)
@@ -0,0 +1,35 @@
+'''
+Sensitivity of the NLME estimates to measurement errors (Python counterpart of run_measurement_sensitivity.m).
+Gaussian noise is added to the measured volumes and the Gompertz model is refitted for many replicates
+at several noise levels, to see how much the population estimates of log(t1) vary.
+
+The replicates are drawn, filtered and fitted in batches (kinetics/sensitivity.py) and can be spread over N_WORKERS processes.
+The results are written next to the MATLAB outputs as measurement_sweep_<site>.csv, so those are not overwritten.
+Also run by: python -m kinetics noise
+'''
+from kinetics.io import PATH_TO_VOLUMES, SENSITIVITY_DIR
+from kinetics.sensitivity import summarise_sensitivity
+from kinetics.stages import measurement_sensitivity
+
+
+# Paths (resolved from the repository, so the script can be run from any folder)
+path_to_volumes = PATH_TO_VOLUMES
+path_for_output = SENSITIVITY_DIR
+
+SITES = ['ov', 'om']
+PERCENT_NOISES = [5, 10, 20] # standard deviation of the noise in % of the volume (10% in the paper)
+N_REPLICATES = 1000 # Number of accepted noise realisations per noise level (20 in the MATLAB script)
+BLOCK_SIZE = 250 # Number of replicates drawn and fitted together
+SEED = 2024 # Master seed, every block of replicates gets its own generator spawned from it
+N_WORKERS = 1 # Number of processes the blocks are run on. The results do not depend on it.
+
+
+if __name__ == '__main__':
+    results = measurement_sensitivity(SITES, PERCENT_NOISES, N_REPLICATES, SEED, N_WORKERS, BLOCK_SIZE,
+                                      path_to_volumes, path_for_output)
+
+    for site, df in results.items():
+        print('\n **** Sensitivity to measurement errors ({}) **** \n'.format(site))
+        print('Acceptance rate of the 10% growth criterion per noise level')
+        print(df.groupby('percent_noise').acceptance.mean())
+        print(summarise_sensitivity(df))
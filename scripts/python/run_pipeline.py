@@ -0,0 +1,31 @@
+'''
+Script to bring every output of the analysis up to date (kinetics/pipeline.py): the doubling times, the simulation and
+its statistics (written to output/simulations/woo_report.txt) and the figures of plot/.
+
+Only the stages whose inputs, code or parameters changed since their last run are rerun, and the stages that do not
+depend on each other run at the same time. The MATLAB outputs (gompertz_params_<site>.csv and the sensitivity tables)
+are inputs: rerun the MATLAB fits first for them to change. The keys of the last runs are kept in
+output/pipeline/state.json and the output of every stage in output/pipeline/logs. Also run by: python -m kinetics pipeline
+'''
+from II_simulate_population import N_TUMOURS, CHUNK_SIZE, SEED, N_WORKERS, OUTPUT_FORMAT, MODEL
+from III_analyse_simulation_results import CHUNK_SIZE as ANALYSIS_CHUNK_SIZE
+from kinetics.pipeline import default_stages, plan, run_pipeline
+
+
+WORKERS = 4 # Number of stages run at the same time
+FORCE = [] # Stages to rerun even if they are up to date, e.g. ['figure_3']
+ONLY = None # Stages to bring up to date (with the stages they depend on), e.g. ['analyse']. None runs all of them.
+DRY_RUN = False # Only list the stages that are stale
+
+
+# The guard keeps the worker processes from re-running the pipeline when they import this script
+if __name__ == '__main__':
+    stages = default_stages(N_TUMOURS, CHUNK_SIZE, SEED, N_WORKERS, OUTPUT_FORMAT, ANALYSIS_CHUNK_SIZE, MODEL)
+    if DRY_RUN:
+        for name, status in plan(stages, force=FORCE).items():
+            print('{:>14} {}'.format(name, status))
+    else:
+        status = run_pipeline(stages, WORKERS, force=FORCE, only=ONLY)
+        failed = [name for name, s in status.items() if s not in ('skipped', 'ran')]
+        if failed:
+            print('\nFailed or blocked: {}'.format(', '.join(failed)))
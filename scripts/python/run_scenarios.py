@@ -0,0 +1,36 @@
+'''
+Script to propagate the sensitivity analyses through the population simulation (kinetics/scenarios.py):
+every row of output/sensitivity-analysis/vmax_<site>.csv and measurement_10per_<site>.csv (a mean and variance of
+log(beta), and a Vmax) and other values of p_om and of the CA125 / US detection limits is a scenario.
+
+All the scenarios are simulated on the same tumours (common random numbers): the random numbers are drawn once and
+mapped through the parameters of each scenario, so the differences from the baseline are estimated tumour by tumour.
+Writes one row per scenario to output/simulations/scenarios.csv. Also run by: python -m kinetics scenarios
+'''
+import os
+
+from kinetics.io import SENSITIVITY_DIR, SIMULATIONS_DIR
+from kinetics.stages import scenario_sweep
+
+
+# Paths (resolved from the repository, so the script can be run from any folder)
+path_to_sensitivity = SENSITIVITY_DIR
+path_for_output = SIMULATIONS_DIR
+
+N_TUMOURS = 1000000 # Number of tumours, the same for every scenario
+CHUNK_SIZE = 100000 # Number of tumours drawn at a time
+SEED = 2024 # Master seed. With the same CHUNK_SIZE, the baseline is the population of II_simulate_population.py
+N_WORKERS = 1 # Number of processes the chunks are run on. The results do not depend on it.
+P_OMS = [0.25, 0.5] # Other probabilities of an omental primary (4/11 in the baseline)
+LIMITS_CA = [0.01, 0.05] # Other CA125 detection limits (cm3)
+LIMITS_US = [0.1, 1.0] # Other US detection limits (cm3)
+
+
+if __name__ == '__main__':
+    summary = scenario_sweep(N_TUMOURS, CHUNK_SIZE, SEED, N_WORKERS, ('ov', 'om'), P_OMS, LIMITS_CA, LIMITS_US,
+                             path_to_sensitivity, os.path.join(path_for_output, 'scenarios.csv'))
+
+    print('\n **** Mean WOO (months) of each scenario and its difference from the baseline **** \n')
+    columns = ['source', 'site', 'row', 'fraction_before_met_US', 'woo_mean_US', 'diff_woo_mean_US', 'se_diff_woo_mean_US',
+               'se_diff_woo_mean_independent_US']
+    print(summary[columns].to_string())
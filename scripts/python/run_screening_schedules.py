@@ -0,0 +1,47 @@
+'''
+Script to evaluate periodic screening schedules on the simulated population.
+For every schedule (screening interval, start after onset and modality detection limit) it gives
+1. The probability that a screen detects the primary before metastasis, for a random phase of the screens
+2. The expected number of screens per tumour before metastasis
+3. The WOO left at screen detection
+
+The detection times come from the growth model quantities of II_simulate_population.py in closed form (kinetics/screening.py),
+so dozens of schedules are evaluated in a single pass over the simulations. Also run by: python -m kinetics screening
+'''
+import os
+
+from II_simulate_population import MODEL # growth model the simulations are made with
+from kinetics.io import SIMULATIONS_DIR
+from kinetics.screening import make_schedules
+from kinetics.simulation import LIMIT_CA, LIMIT_US
+from kinetics.stages import screening_schedules
+
+
+# Paths (resolved from the repository, so the script can be run from any folder)
+path_to_sims = os.path.join(SIMULATIONS_DIR, 'sims.csv')
+path_to_store = os.path.join(SIMULATIONS_DIR, 'sims')
+path_for_output = SIMULATIONS_DIR
+# 'csv', 'npy' or 'simulate', as in III_analyse_simulation_results.py
+INPUT_FORMAT = 'csv'
+CHUNK_SIZE = 1000000 # Number of simulations read at a time
+
+SCHEDULES = make_schedules(intervals=[3, 6, 12, 24, 36], # months between screens
+                           starts=[0, 12, 24], # months after the onset of the primary when screening starts
+                           limits=[LIMIT_CA, LIMIT_US]) # detection limit of the modality (cm3)
+SEED = 2024 # Seed of the random phases of the screens
+
+
+if __name__ == '__main__':
+    if INPUT_FORMAT == 'simulate':
+        from II_simulate_population import N_TUMOURS, SEED as SIM_SEED, N_WORKERS, CHUNK_SIZE as SIM_CHUNK_SIZE
+        from kinetics.models import model_kwargs
+        from kinetics.simulation import simulate_chunks
+        sims = simulate_chunks(N_TUMOURS, SIM_CHUNK_SIZE, seed=SIM_SEED, workers=N_WORKERS, **model_kwargs(MODEL))
+    else:
+        sims = path_to_store if INPUT_FORMAT == 'npy' else path_to_sims
+
+    summary = screening_schedules(SCHEDULES, sims, SEED, CHUNK_SIZE, os.path.join(path_for_output, 'screening_schedules.csv'),
+                                  MODEL)
+
+    print('\n **** Detection before mets by screening schedule **** \n')
+    print(summary[['interval', 'start', 'limit', 'p_detect', 'screens_before_met', '50%']].to_string(index=False))
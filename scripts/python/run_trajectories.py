@@ -0,0 +1,39 @@
+'''
+Script to follow the volumes of the simulated tumours over time (kinetics/trajectories.py): the primary and
+metastatic volume of every tumour are evaluated on a time grid, and the median, interquartile range and 95% band of the
+primary, metastatic and total volumes at every time point are written to output/simulations/trajectories.csv
+(with the fraction of the tumours that have metastasised) and drawn by plot/figure_trajectories.py.
+
+The curves are streamed chunk by chunk into one quantile sketch per time point, so the memory does not grow with the
+number of tumours. Also run by: python -m kinetics trajectories
+'''
+import os
+
+import numpy as np
+
+from kinetics.io import SIMULATIONS_DIR
+from kinetics.stages import trajectory_fan_chart
+
+
+# Path (resolved from the repository, so the script can be run from any folder)
+path_for_output = SIMULATIONS_DIR
+
+N_TUMOURS = 1000000 # Number of tumours
+CHUNK_SIZE = 100000 # Number of tumours simulated at a time
+SEED = 2024 # Master seed. With the same CHUNK_SIZE, the tumours are the ones of II_simulate_population.py
+N_WORKERS = 1 # Number of processes the chunks are run on. The results do not depend on it.
+YEARS = 10 # Time since the onset of the primary covered by the grid
+N_TIMES = 241 # Number of time points
+MODEL = 'gompertz' # Growth model of kinetics/models.py, the one of II_simulate_population.py when SIMS is set
+SIMS = None # e.g. os.path.join(SIMULATIONS_DIR, 'sims.csv') to use the tumours written by II instead of simulating them
+
+
+# The guard keeps the worker processes from re-running the script when they import it
+if __name__ == '__main__':
+    grid = np.linspace(0, 365 * YEARS, N_TIMES)
+    chart = trajectory_fan_chart(N_TUMOURS, CHUNK_SIZE, SEED, N_WORKERS, grid, SIMS,
+                                 os.path.join(path_for_output, 'trajectories.csv'), MODEL)
+
+    print('\n **** Median (IQR) volumes (cm3) every year since the onset of the primary **** \n')
+    summary = chart.summary()
+    print(summary.iloc[::(N_TIMES - 1) // YEARS, :].to_string(float_format='{:.3g}'.format))
@@ -0,0 +1,36 @@
+'''
+Sensitivity of the NLME estimates to the choice of Vmax (Python counterpart of run_vmax_sensitivity.m).
+The Gompertz model is refitted for every Vmax on a dense grid for each site (kinetics/sensitivity.py).
+The transformed volumes are recomputed from a cached ln(V/V0) and each block of Vmax values is warm started,
+so hundreds of values take about as long as the 17 in the MATLAB script.
+
+Writes a single table indexed by site and vmax (vmax_sweep.csv) and, with GRID = True,
+the grid of (Vmax_ov, Vmax_om) pairs (vmax_grid.csv). Also run by: python -m kinetics vmax
+'''
+import os
+
+import numpy as np
+
+from kinetics.io import PATH_TO_VOLUMES, SENSITIVITY_DIR
+from kinetics.stages import vmax_sensitivity
+
+
+# Paths (resolved from the repository, so the script can be run from any folder)
+path_to_volumes = PATH_TO_VOLUMES
+path_for_output = SENSITIVITY_DIR
+
+SITES = ['ov', 'om']
+VMAXS = np.arange(2000, 10001, 50) # Vmax values (cm3), 2000:500:10000 in the MATLAB script
+BLOCK_SIZE = 20 # Number of consecutive Vmax values fitted together
+N_WORKERS = 1 # Number of processes the blocks are run on
+GRID = False # Whether to also write the (Vmax_ov x Vmax_om) grid
+
+
+if __name__ == '__main__':
+    sweeps = vmax_sensitivity(VMAXS, SITES, N_WORKERS, BLOCK_SIZE, path_to_volumes,
+                              os.path.join(path_for_output, 'vmax_sweep.csv'),
+                              os.path.join(path_for_output, 'vmax_grid.csv') if GRID else None)
+
+    for site, df in sweeps.items():
+        t1 = np.exp(df['mean-logt1'])
+        print('CV for {} for the mean of log t1 over {} values of Vmax is {}'.format(site, len(df), np.std(t1) / np.mean(t1)))